@@ -22,6 +22,7 @@ from . import geometry
 from . import utils
 from . import scoring
 from . import images
+from . import duplicates
 
 _color_blue = (255, 0, 0)
 _color_good = (0, 210, 0)
@@ -58,7 +59,14 @@ class CellGeometry:
 
 class ExamDecisions:
     def __init__(
-        self, success, answers, detected_id, id_scores, model=None, infobits=None
+        self,
+        success,
+        answers,
+        detected_id,
+        id_scores,
+        model=None,
+        infobits=None,
+        extended_models=False,
     ):
         self.success = success
         self.answers = answers
@@ -67,7 +75,7 @@ class ExamDecisions:
         if model is not None:
             self.model = model
         elif infobits:
-            self.model = utils.decode_model(infobits)
+            self.model = utils.decode_model(infobits, extended=extended_models)
         else:
             self.model = None
         self.student = None
@@ -105,8 +113,20 @@ class ExamCapture:
         self.answer_cells = answer_cells
         self.id_cells = id_cells
         self.progress = progress
+        self._sheet_hash = None
         self.reset_image()
 
+    def sheet_hash(self):
+        """Returns the perceptual hash of the answer area of the capture.
+
+        Returns None when the answer cells are not known. See
+        duplicates.sheet_hash.
+
+        """
+        if self._sheet_hash is None and self.has_answer_cells():
+            self._sheet_hash = duplicates.sheet_hash(self.image_raw, self.answer_cells)
+        return self._sheet_hash
+
     def has_answer_cells(self):
         return self.answer_cells is not None and len(self.answer_cells) > 0
 
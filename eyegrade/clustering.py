@@ -0,0 +1,158 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+import math
+
+import numpy as np
+
+# Data representation:
+# - Lines: numpy float arrays of shape (N, 2), with a row (rho, theta)
+#          per line, as returned by the Hough transform.
+#
+
+
+def as_lines_array(lines):
+    """Returns the lines as a float array with one (rho, theta) row per line.
+
+    `lines` can be any sequence of (rho, theta) pairs, including the
+    (N, 1, 2) arrays returned by cv2.HoughLines.
+
+    """
+    return np.asarray(lines, dtype=float).reshape(-1, 2)
+
+
+def to_line_tuples(lines):
+    """Returns the lines of the array as a list of (rho, theta) tuples."""
+    return [tuple(line) for line in lines.tolist()]
+
+
+def sort_by_theta(lines):
+    """Returns a copy of the lines sorted by theta.
+
+    The sort is stable: lines with the same angle keep their order.
+
+    """
+    lines = as_lines_array(lines)
+    return lines[np.argsort(lines[:, 1], kind="stable")]
+
+
+def angles_perpendicular(angle, angles):
+    """Vectorized version of `geometry.angles_perpendicular`.
+
+    Returns a boolean array that tells which of the `angles` are
+    perpendicular or almost perpendicular to `angle`, with the same
+    margin of +-0.1 radians.
+
+    """
+    diffs = angles - angle
+    return (np.abs(diffs - math.pi / 2) < 0.1) | (np.abs(diffs + math.pi / 2) < 0.1)
+
+
+def split_directions(lines, threshold):
+    """Splits lines sorted by theta into groups of lines with similar angle.
+
+    Each group starts at the line with the lowest angle not yet
+    grouped, and takes all the following lines whose angle differs
+    from it less than `threshold`. Returns a list of arrays.
+
+    """
+    thetas = lines[:, 1]
+    groups = []
+    start = 0
+    while start < len(lines):
+        outside = np.abs(thetas[start:] - thetas[start]) >= threshold
+        if outside.any():
+            end = start + int(np.argmax(outside))
+        else:
+            end = len(lines)
+        groups.append(lines[start:end])
+        start = end
+    return groups
+
+
+def detect_directions(lines, threshold):
+    """Groups lines into axes.
+
+    `lines` is an array of lines sorted by theta. Returns a list of
+    tuples (theta, lines) for each axis, being theta the average angle
+    of its lines. Axes are sorted by angle from horizontal to
+    vertical, and lines within each axis are sorted by the absolute
+    value of rho.
+
+    Lines with an angle close to pi are merged into the axis of the
+    lines close to 0 after being normalized to (-rho, theta - pi).
+
+    """
+    groups = split_directions(lines, threshold)
+    if (
+        len(groups) > 1
+        and abs(groups[0][0, 1] - groups[-1][0, 1] + math.pi) < threshold
+    ):
+        wrapped = groups.pop()
+        wrapped = np.column_stack((-wrapped[:, 0], wrapped[:, 1] - math.pi))
+        groups[0] = np.concatenate((groups[0], wrapped))
+    axes = []
+    for group in groups:
+        order = np.argsort(np.abs(group[:, 0]), kind="stable")
+        axes.append((float(np.mean(group[:, 1])), group[order]))
+    if abs(axes[-1][0] - math.pi) < abs(axes[0][0]):
+        axes = axes[-1:] + axes[:-1]
+    return axes
+
+
+def filter_border_lines(lines, image_size, reference_angle, margin=0.03):
+    """Filters out the lines too close to an image border.
+
+    Lines perpendicular to `reference_angle` (pi / 2 for vertical
+    lines, 0 for horizontal lines) are discarded when the absolute
+    value of their rho is not within `margin` * `image_size` and
+    (1 - `margin`) * `image_size`. The rest of lines are kept.
+
+    """
+    lines = as_lines_array(lines)
+    rhos = np.abs(lines[:, 0])
+    inside = (rhos < (1 - margin) * image_size) & (rhos > margin * image_size)
+    return lines[inside | ~angles_perpendicular(reference_angle, lines[:, 1])]
+
+
+def collapse_lines(lines, horizontal, max_gap, min_gap=5):
+    """Collapses consecutive lines that are close together.
+
+    `lines` is an array of lines sorted by the absolute value of rho.
+    A line starts a new group when the distance in rho to the
+    previous line is greater than `max_gap`, or when it is at least
+    `min_gap` and the angle changes in the direction that separates
+    parallel lines (increasing for horizontal lines, decreasing for
+    vertical ones). Each group is replaced by its mean line.
+
+    Returns the array of collapsed lines or None if there are less
+    than two lines.
+
+    """
+    if len(lines) < 2:
+        return None
+    rho_diffs = np.abs(np.diff(lines[:, 0]))
+    theta_diffs = np.diff(lines[:, 1])
+    if horizontal:
+        turns = theta_diffs > 0
+    else:
+        turns = theta_diffs < 0
+    breaks = (turns & (rho_diffs >= min_gap)) | (rho_diffs > max_gap)
+    starts = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+    counts = np.diff(np.append(starts, len(lines)))
+    return np.add.reduceat(lines, starts, axis=0) / counts[:, np.newaxis]
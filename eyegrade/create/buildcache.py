@@ -0,0 +1,157 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Bump it when the way PDF files are built changes, so that old
+# entries are not reused.
+CACHE_FORMAT = "1"
+
+# Commands of the LaTeX text that read other files
+RE_FILE_REFERENCE = re.compile(
+    r"\\(?:includegraphics|input|include|lstinputlisting|verbatiminput)"
+    r"\s*(?:\[[^\]]*\])?\s*\{([^{}]+)\}"
+)
+
+# Extensions that pdflatex tries when a reference has none
+IMPLICIT_EXTENSIONS = ("", ".pdf", ".png", ".jpg", ".jpeg", ".eps", ".tex")
+
+
+class BuildCache:
+    """Persistent cache of the PDF files built from LaTeX files.
+
+    Entries are keyed by a hash of the LaTeX text and of the contents
+    of the files it references (figures, inputs and listings), so that
+    a model whose text and figures did not change is copied from the
+    cache instead of compiled again.
+
+    The cache also remembers the `.aux` file of the last build of each
+    document name. A document that needs compiling starts from it, so
+    that it only needs another pdflatex pass when its cross
+    references actually change.
+
+    It can be shared by threads that compile different files.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pdf_dir = os.path.join(directory, "pdf")
+        self.aux_dir = os.path.join(directory, "aux")
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        os.makedirs(self.aux_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._file_digests = {}
+        self._lock = threading.Lock()
+
+    def key(self, latex_file):
+        """Returns the key of the LaTeX file in its current state."""
+        directory = os.path.dirname(latex_file)
+        with open(latex_file, mode="rb") as f:
+            text = f.read()
+        digest = hashlib.sha256()
+        digest.update(CACHE_FORMAT.encode("ascii") + b"\0")
+        digest.update(text)
+        references = RE_FILE_REFERENCE.findall(text.decode("utf-8", errors="replace"))
+        for reference in sorted(set(references)):
+            digest.update(b"\0" + reference.encode("utf-8") + b"\0")
+            filename = _find_file(directory, reference.strip())
+            if filename is not None:
+                digest.update(self._file_digest(filename))
+        return digest.hexdigest()
+
+    def get(self, key, pdf_filename):
+        """Copies the cached PDF of the key to `pdf_filename`.
+
+        Returns False, without copying anything, when the key is not
+        in the cache.
+
+        """
+        try:
+            _copy_file(self._pdf_entry(key), pdf_filename)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, pdf_filename):
+        """Stores a copy of the PDF file built for the key."""
+        _copy_file(pdf_filename, self._pdf_entry(key))
+
+    def last_aux(self, name):
+        """Returns the path of the last .aux file of the document, or None."""
+        aux_filename = os.path.join(self.aux_dir, name + ".aux")
+        if os.path.isfile(aux_filename):
+            return aux_filename
+        else:
+            return None
+
+    def set_last_aux(self, name, aux_filename):
+        """Stores the .aux file of the last build of the document."""
+        _copy_file(aux_filename, os.path.join(self.aux_dir, name + ".aux"))
+
+    def _pdf_entry(self, key):
+        return os.path.join(self.pdf_dir, key + ".pdf")
+
+    def _file_digest(self, filename):
+        # The same figures appear in every model: files are hashed
+        # once as long as they are not modified.
+        stat = os.stat(filename)
+        memo_key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            file_digest = self._file_digests.get(memo_key)
+        if file_digest is None:
+            digest = hashlib.sha256()
+            with open(filename, mode="rb") as f:
+                for block in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(block)
+            file_digest = digest.digest()
+            with self._lock:
+                self._file_digests[memo_key] = file_digest
+        return file_digest
+
+
+def _find_file(directory, reference):
+    for extension in IMPLICIT_EXTENSIONS:
+        filename = os.path.join(directory, reference + extension)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def _copy_file(source, destination):
+    # Copies are atomic, so that concurrent builds or an interrupted
+    # run never leave a truncated file in the cache:
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(destination) or None, suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_filename)
+        os.replace(tmp_filename, destination)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
@@ -17,12 +17,15 @@
 #
 import argparse
 import sys
+import os
+import time
 
 # Local imports
 from .. import utils
 from .. import scoring
 from . import latex
 from . import parser
+from . import buildcache
 
 
 EyegradeException = utils.EyegradeException
@@ -94,8 +97,16 @@ def read_cmd_options():
         "-m",
         "--models",
         dest="models",
-        default="A",
-        help="concatenation of the model leters to create",
+        default=None,
+        help="concatenation of the model letters to create (e.g. ABC),"
+        " or comma-separated list of models (e.g. A,B,AA)",
+    )
+    arg_parser.add_argument(
+        "--num-models",
+        type=int,
+        dest="num_models",
+        default=None,
+        help="create this number of models (A, B... Z, AA, AB...)",
     )
     arg_parser.add_argument(
         "-t", "--duration", dest="duration", default=None, help="exam duration time"
@@ -217,6 +228,22 @@ def read_cmd_options():
         default=False,
         help=("produce the .tex files instead of PDF"),
     )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        dest="jobs",
+        default=1,
+        help="number of PDF files compiled at the same time"
+        " (0 for one per processor)",
+    )
+    arg_parser.add_argument(
+        "--build-cache",
+        dest="build_cache",
+        default=None,
+        help="directory in which built PDF files and parsed question files"
+        " are cached across runs, so that only what changed is processed again",
+    )
     arg_parser.add_argument(
         "--variation",
         type=int,
@@ -225,7 +252,14 @@ def read_cmd_options():
         default=None,
     )
     args = arg_parser.parse_args()
-    args.models = args.models.upper()
+    if args.num_models is not None:
+        if args.models is not None:
+            arg_parser.error("Option --num-models is mutually exclusive with -m")
+        if args.num_models < 1:
+            arg_parser.error("The number of models must be at least 1")
+        args.models = [utils.model_name(i) for i in range(args.num_models)]
+    else:
+        args.models = utils.parse_models(args.models or "A")
     # Either -e is specified, or -q and -c are used
     if not args.exam_filename:
         if args.dimensions is None and (
@@ -270,7 +304,9 @@ def create_exam():
 
     # Take options from the input question files
     if args.exam_filename:
-        exam = parser.parse_exam(args.exam_filename)
+        exam = parser.parse_exam(
+            args.exam_filename, cache_dir=question_cache_dir(args.build_cache)
+        )
         if exam.subject is not None:
             variables["subject"] = exam.subject
         if exam.degree is not None:
@@ -381,44 +417,120 @@ def create_exam():
         produce_pdf = False
     if exam is not None:
         maker.set_exam_questions(exam)
+    if not args.survey_mode:
+        for model in args.models:
+            maker.check_model(model)
+    # Files are compiled while the next ones are being written
+    latex_files = write_latex_files(maker, args, variation)
+    if produce_pdf:
+        compile_pdf_files(latex_files, args.jobs, cache_dir=args.build_cache)
+    else:
+        for produced_filename in latex_files:
+            print("Created file:", produced_filename, file=sys.stderr)
+    if config_filename is not None:
+        maker.save_exam_config()
+
+    # Dump some final warnings
+    for key in maker.empty_variables:
+        print("Warning: empty '%s' variable" % key, file=sys.stderr)
+
+
+def write_latex_files(maker, args, variation):
+    """Writes the LaTeX files of the exam and yields their names.
+
+    The exams of all the models are written first, followed by their
+    solutions.
+
+    """
     if not args.survey_mode:
         for model in args.models:
             produced_filename = maker.create_exam(
                 model,
                 not args.dont_shuffle_again,
                 variation=variation,
-                produce_pdf=produce_pdf,
                 keep_question_order=args.keep_question_order,
             )
             if produced_filename is not None:
-                print("Created file:", produced_filename, file=sys.stderr)
+                yield produced_filename
         if args.output_file_prefix is not None:
             maker.output_file = args.output_file_prefix + "-%s-solutions.tex"
             for model in args.models:
-                produced_filename = maker.create_exam(
+                yield maker.create_exam(
                     model,
                     False,
                     with_solution=True,
                     variation=variation,
-                    produce_pdf=produce_pdf,
                     keep_question_order=args.keep_question_order,
                 )
-                print("Created file:", produced_filename, file=sys.stderr)
     else:
         produced_filename = maker.create_exam(
             None,
             not args.dont_shuffle_again,
             variation=variation,
-            produce_pdf=produce_pdf,
             keep_question_order=args.keep_question_order,
         )
-        print("Created file:", produced_filename, file=sys.stderr)
-    if config_filename is not None:
-        maker.save_exam_config()
+        if produced_filename is not None:
+            yield produced_filename
 
-    # Dump some final warnings
-    for key in maker.empty_variables:
-        print("Warning: empty '%s' variable" % key, file=sys.stderr)
+
+def question_cache_dir(build_cache):
+    if build_cache is not None:
+        return os.path.join(build_cache, "questions")
+    else:
+        return None
+
+
+def compile_pdf_files(latex_files, jobs, cache_dir=None):
+    """Compiles the LaTeX files and reports the result of each one.
+
+    When `cache_dir` is given, PDF files already built from the same
+    text and figures are copied from that build cache.
+
+    Raises EyegradeException, with the output of pdflatex for the
+    first file that fails, if some file cannot be compiled.
+
+    """
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if cache_dir is not None:
+        cache = buildcache.BuildCache(cache_dir)
+    else:
+        cache = None
+    start = time.perf_counter()
+    results = latex.compile_latex_files(
+        latex_files, jobs=jobs, remove_tex=True, cache=cache
+    )
+    elapsed = time.perf_counter() - start
+    for result in results:
+        if result.cached:
+            print(
+                "Created file: {} (cached)".format(result.produced_filename),
+                file=sys.stderr,
+            )
+        elif result.success:
+            print(
+                "Created file: {} ({:.1f} s)".format(
+                    result.produced_filename, result.elapsed
+                ),
+                file=sys.stderr,
+            )
+        else:
+            print(
+                "Error compiling: {} ({:.1f} s)".format(
+                    result.latex_file, result.elapsed
+                ),
+                file=sys.stderr,
+            )
+    failed = [result for result in results if not result.success]
+    num_cached = len([result for result in results if result.cached])
+    print(
+        "Compiled {} of {} files in {:.1f} s ({} from the build cache)".format(
+            len(results) - len(failed), len(results), elapsed, num_cached
+        ),
+        file=sys.stderr,
+    )
+    if failed:
+        raise EyegradeException(failed[0].output.decode("utf-8", errors="replace"))
 
 
 def main():
@@ -16,15 +16,19 @@
 # <https://www.gnu.org/licenses/>.
 #
 
-import re
 import copy
 import sys
+import time
+import shutil
+import tempfile
 import subprocess
+import collections
+import concurrent.futures
 import os
 
 from .. import utils
 from .. import exams
-
+from . import slots
 
 PARAM_MIN_NUM_QUESTIONS = 1
 
@@ -34,7 +38,17 @@ PARAM_TABLE_MARGIN = 0.1
 
 # Numbers of questions in which the number of tables is changed
 PARAM_TABLE_LMITS = [8, 24, 55]
-RE_SPLIT_TEMPLATE = re.compile("{{([^{}]+)}}")
+
+# Maximum number of pdflatex runs for resolving cross references
+PARAM_MAX_LATEX_PASSES = 3
+
+# Result of compiling a LaTeX file: `output` is the output of pdflatex,
+# `elapsed` the wall time of the compilation in seconds and `cached`
+# tells whether the PDF was copied from the build cache.
+CompileResult = collections.namedtuple(
+    "CompileResult",
+    ("latex_file", "success", "output", "produced_filename", "elapsed", "cached"),
+)
 
 # Register user-friendly error messages
 utils.EyegradeException.register_error(
@@ -55,11 +69,19 @@ utils.EyegradeException.register_error(
 )
 utils.EyegradeException.register_error(
     "bad_model_value",
-    "A model must be represented by an uppercase English letter (A-Z).\n"
-    "You can also create an unshuffled version of the exam with the\n"
-    "special '0' model.",
+    "A model must be represented by uppercase English letters (A-Z,\n"
+    "and then AA, AB...). You can also create an unshuffled version\n"
+    "of the exam with the special '0' model.",
     "Bad model value.",
 )
+utils.EyegradeException.register_error(
+    "too_many_models",
+    "The infobits below the answer tables can encode a limited number\n"
+    "of models, which grows with the total number of choices of the\n"
+    "tables (8 models with less than 8 choices, 64 with 8 or more,\n"
+    "512 with 12 or more...).",
+    "Model {} does not fit in the answer tables (maximum: {} models).",
+)
 utils.EyegradeException.register_error(
     "too_few_questions",
     short_message="At least %d question(s) needed" % PARAM_MIN_NUM_QUESTIONS,
@@ -107,7 +129,8 @@ class ExamMaker:
         self.num_questions = num_questions
         self.num_choices = num_choices
         template = utils.read_file(template_filename)
-        self.parts = RE_SPLIT_TEMPLATE.split(template)
+        self.template = slots.SlotText(template)
+        self.parts = self.template.parts
         self.left_to_right_numbering = left_to_right_numbering
         self.survey_mode = survey_mode
         self.output_file = output_file
@@ -177,6 +200,23 @@ class ExamMaker:
             raise Exception("Incorrect number of questions")
         self.exam_questions = exam
 
+    def check_model(self, model):
+        """Raises EyegradeException if the model cannot be created.
+
+        Besides being a valid model name, the model must fit in the
+        infobits of the answer tables.
+
+        """
+        if model is None or (model != "0" and not utils.re_model_name.match(model)):
+            raise utils.EyegradeException("", "bad_model_value")
+        num_bits = sum(choices for choices, _ in self.dimensions)
+        if model != "0" and utils.model_index(model) >= utils.max_models(num_bits):
+            raise utils.EyegradeException(
+                "",
+                "too_many_models",
+                format_params=(model, utils.max_models(num_bits)),
+            )
+
     def create_exam(
         self,
         model,
@@ -194,12 +234,7 @@ class ExamMaker:
 
         """
         if not self.survey_mode:
-            if (
-                model is None
-                or len(model) != 1
-                or ((ord(model) < 65 or ord(model) > 90) and model != "0")
-            ):
-                raise utils.EyegradeException("", "bad_model_value")
+            self.check_model(model)
         else:
             if model is None:
                 model = "A"
@@ -259,11 +294,9 @@ class ExamMaker:
             if selected_variation is not None:
                 replacements["variation"] = str(selected_variation + 1)
 
-        # Replacement keys are in odd positions of self.parts
-        replaced = len(self.parts) * [None]
-        replaced[::2] = self.parts[::2]
-        replaced[1::2] = [self._replace(key, replacements) for key in self.parts[1::2]]
-        exam_text = "".join(replaced)
+        exam_text = self.template.fill_with(
+            lambda key: self._replace(key, replacements)
+        )
         if self.output_file == sys.stdout:
             utils.write_to_stdout(exam_text)
             produced_filename = None
@@ -407,34 +440,144 @@ def check_latex():
     return success
 
 
-def compile_latex(latex_file, remove_tex=False):
+def compile_latex(latex_file, remove_tex=False, cache=None):
+    """Compiles a LaTeX file into PDF with pdflatex.
+
+    pdflatex runs in the directory of the file, so that the paths in
+    it are relative to that directory, but writes its output into a
+    private temporary directory. Therefore, auxiliary files of
+    simultaneous compilations never collide, and the working
+    directory of the process is not changed. The PDF file is moved
+    next to the LaTeX file, as well as the log when the compilation
+    fails.
+
+    pdflatex runs again, up to PARAM_MAX_LATEX_PASSES times, while
+    the `.aux` file changes, which means that cross references are
+    not resolved yet. A first pass that starts without a `.aux` file
+    is repeated only when pdflatex asks for it.
+
+    When a `buildcache.BuildCache` is given, the PDF is copied from
+    it if the same text and referenced files were compiled before.
+
+    Returns the tuple (success, output, produced_filename).
+
+    """
+    return _compile_latex(latex_file, remove_tex, cache)[:3]
+
+
+def _compile_latex(latex_file, remove_tex, cache):
+    # Returns (success, output, produced_filename, cached)
     directory, name = os.path.split(latex_file)
     base_name = os.path.splitext(name)[0]
-    with utils.change_dir(directory):
-        try:
-            output = subprocess.check_output(
-                ["pdflatex", "-interaction=nonstopmode", name], stderr=subprocess.STDOUT
+    pdf_filename = os.path.join(directory, base_name + ".pdf")
+    if cache is not None:
+        key = cache.key(latex_file)
+        if cache.get(key, pdf_filename):
+            if remove_tex:
+                os.remove(latex_file)
+            return True, b"", pdf_filename, True
+    produced_filename = None
+    with tempfile.TemporaryDirectory(prefix="eyegrade-latex-") as build_dir:
+        aux_filename = os.path.join(build_dir, base_name + ".aux")
+        if cache is not None and cache.last_aux(base_name) is not None:
+            shutil.copyfile(cache.last_aux(base_name), aux_filename)
+        success, output = _run_pdflatex_passes(name, directory, build_dir)
+        if success:
+            success = os.path.isfile(os.path.join(build_dir, base_name + ".pdf"))
+        if success:
+            produced_filename = pdf_filename
+            shutil.move(os.path.join(build_dir, base_name + ".pdf"), produced_filename)
+            if cache is not None:
+                cache.put(key, produced_filename)
+                if os.path.isfile(aux_filename):
+                    cache.set_last_aux(base_name, aux_filename)
+            if remove_tex:
+                os.remove(latex_file)
+        elif os.path.isfile(os.path.join(build_dir, base_name + ".log")):
+            shutil.move(
+                os.path.join(build_dir, base_name + ".log"),
+                os.path.join(directory, base_name + ".log"),
             )
-        except subprocess.CalledProcessError as exc:
-            output = exc.output
-            success = False
-            produced_filename = None
-        except OSError:
-            success = False
-            raise utils.EyegradeException("", key="latex_not_found")
-        else:
-            success = True
-            produced_filename = os.path.join(directory, base_name + ".pdf")
-        finally:
-            to_remove = [base_name + ".aux"]
-            if success:
-                to_remove.append(base_name + ".log")
-                if remove_tex:
-                    to_remove.append(name)
-            for filename in to_remove:
-                if os.path.isfile(filename):
-                    os.remove(filename)
-    return success, output, produced_filename
+    return success, output, produced_filename, False
+
+
+def _run_pdflatex_passes(name, directory, build_dir):
+    aux_filename = os.path.join(build_dir, os.path.splitext(name)[0] + ".aux")
+    for _ in range(PARAM_MAX_LATEX_PASSES):
+        previous_aux = _read_aux(aux_filename)
+        success, output = _run_pdflatex(name, directory, build_dir)
+        if not success:
+            break
+        if previous_aux is None:
+            if b"Rerun to get" not in output:
+                break
+        elif _read_aux(aux_filename) == previous_aux:
+            break
+    return success, output
+
+
+def _run_pdflatex(name, directory, build_dir):
+    try:
+        output = subprocess.check_output(
+            [
+                "pdflatex",
+                "-interaction=nonstopmode",
+                "-output-directory",
+                build_dir,
+                name,
+            ],
+            stderr=subprocess.STDOUT,
+            cwd=directory or None,
+        )
+    except subprocess.CalledProcessError as exc:
+        return False, exc.output
+    except OSError:
+        raise utils.EyegradeException("", key="latex_not_found")
+    return True, output
+
+
+def _read_aux(aux_filename):
+    try:
+        with open(aux_filename, mode="rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def compile_latex_files(latex_files, jobs=1, remove_tex=False, cache=None):
+    """Compiles several LaTeX files into PDF, up to `jobs` at the same time.
+
+    Returns a list with a CompileResult for each file, in the same
+    order as `latex_files`. See `compile_latex` for the `cache`
+    parameter.
+
+    `latex_files` can be a generator that writes the files: each file
+    starts compiling as soon as it is produced, while the next ones
+    are being written.
+
+    """
+
+    def compile_file(latex_file):
+        start = time.perf_counter()
+        success, output, produced_filename, cached = _compile_latex(
+            latex_file, remove_tex, cache
+        )
+        return CompileResult(
+            latex_file,
+            success,
+            output,
+            produced_filename,
+            time.perf_counter() - start,
+            cached,
+        )
+
+    if jobs <= 1:
+        return [compile_file(latex_file) for latex_file in latex_files]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(compile_file, latex_file) for latex_file in latex_files
+        ]
+        return [future.result() for future in futures]
 
 
 def latex_declarations(with_solution):
@@ -16,14 +16,11 @@
 # <https://www.gnu.org/licenses/>.
 #
 
-import re
-
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from .. import utils
 from . import questions
-
-_PARAM_REPLACE_RE = re.compile("{{([^{}]+)}}")
+from . import slots
 
 EyegradeException = utils.EyegradeException
 
@@ -43,10 +40,11 @@ class ParametricQuestion(questions.Question):
         super().__init__()
         self.question_pattern = question_pattern
         self.parameter_sets = []
+        self._compiled_pattern = _CompiledVariation(question_pattern)
 
     def add_parameter_set(self, parameter_set: "ParameterSet"):
         self.parameter_sets.append(parameter_set)
-        super().add_variation(parameter_set.apply_to(self.question_pattern))
+        super().add_variation(self._compiled_pattern.apply(parameter_set.parameters))
 
 
 class ParametricGroupCommonComponent(questions.GroupCommonComponent):
@@ -59,12 +57,11 @@ class ParametricGroupCommonComponent(questions.GroupCommonComponent):
         super().__init__()
         self.component_pattern = component_pattern
         self.parameter_sets = []
+        self._compiled_pattern = _CompiledComponent(component_pattern)
 
     def add_parameter_set(self, parameter_set: "ParameterSet"):
         self.parameter_sets.append(parameter_set)
-        super().add_variation(
-            parameter_set.apply_to_question_component(self.component_pattern)
-        )
+        super().add_variation(self._compiled_pattern.apply(parameter_set.parameters))
 
 
 class ParameterSet:
@@ -81,57 +78,89 @@ class ParameterSet:
     def apply_to(
         self, question_pattern: questions.QuestionVariation
     ) -> questions.QuestionVariation:
-        text = self.apply_to_question_component(question_pattern.text)
-        correct_choices = [
-            self.apply_to_question_component(choice)
-            for choice in question_pattern.correct_choices
+        return _CompiledVariation(question_pattern).apply(self.parameters)
+
+    def apply_to_question_component(
+        self, component: questions.QuestionComponent
+    ) -> questions.QuestionComponent:
+        return _CompiledComponent(component).apply(self.parameters)
+
+
+class _CompiledVariation:
+    """Question variation pattern with its texts compiled into slots.
+
+    Patterns are compiled once per question, and then applied to each
+    of its parameter sets.
+
+    """
+
+    def __init__(self, question_pattern: questions.QuestionVariation) -> None:
+        self.question_pattern = question_pattern
+        self.text = _CompiledComponent(question_pattern.text)
+        self.correct_choices = [
+            _CompiledComponent(choice) for choice in question_pattern.correct_choices
         ]
-        incorrect_choices = [
-            self.apply_to_question_component(choice)
-            for choice in question_pattern.incorrect_choices
+        self.incorrect_choices = [
+            _CompiledComponent(choice) for choice in question_pattern.incorrect_choices
         ]
+
+    def apply(self, parameters: Dict[str, str]) -> questions.QuestionVariation:
         return questions.QuestionVariation(
-            text,
-            correct_choices,
-            incorrect_choices,
-            question_pattern.fix_first,
-            question_pattern.fix_last,
+            self.text.apply(parameters),
+            [choice.apply(parameters) for choice in self.correct_choices],
+            [choice.apply(parameters) for choice in self.incorrect_choices],
+            self.question_pattern.fix_first,
+            self.question_pattern.fix_last,
         )
 
-    def apply_to_question_component(
-        self, component: questions.QuestionComponent
-    ) -> questions.QuestionComponent:
-        replaced = questions.QuestionComponent(component.in_choice)
-        replaced.annex_width = component.annex_width
-        replaced.annex_pos = component.annex_pos
-        text = component.text
-        if text is None:
-            replaced.text = None
-        elif isinstance(text, str):
-            replaced.text = self._apply_to_text(text)
-        else:
-            replaced.text = [self._apply_to_text_part(part) for part in text]
-        if component.code is not None:
-            replaced.code = self._apply_to_text(component.code)
-        if component.figure is not None:
-            replaced.figure = self._apply_to_text(component.figure)
-        return replaced
 
-    def _apply_to_text_part(self, part: Tuple[str, str]) -> Tuple[str, str]:
-        if part[0] == "text":
-            return ("text", self._apply_to_text(part[1]))
-        return part
-
-    def _apply_to_text(self, text: str) -> str:
-        replaced: List[str]
-        parts = _PARAM_REPLACE_RE.split(text)
-        # Replacement keys are at odd positions of parts
-        replaced = len(parts) * [""]
-        replaced[::2] = parts[::2]
+class _CompiledComponent:
+    """Question component pattern with its texts compiled into slots."""
+
+    text: Optional[slots.SlotText]
+    text_parts: Optional[List[Tuple[str, str, Optional[slots.SlotText]]]]
+
+    def __init__(self, component: questions.QuestionComponent) -> None:
+        self.in_choice = component.in_choice
+        self.annex_width = component.annex_width
+        self.annex_pos = component.annex_pos
+        self.text = None
+        self.text_parts = None
+        if isinstance(component.text, str):
+            self.text = slots.SlotText(component.text)
+        elif component.text is not None:
+            # Only the text parts have slots, not the code parts
+            self.text_parts = [
+                (kind, value, slots.SlotText(value) if kind == "text" else None)
+                for kind, value in component.text
+            ]
+        self.code = _compile_optional(component.code)
+        self.figure = _compile_optional(component.figure)
+
+    def apply(self, parameters: Dict[str, str]) -> questions.QuestionComponent:
+        replaced = questions.QuestionComponent(self.in_choice)
+        replaced.annex_width = self.annex_width
+        replaced.annex_pos = self.annex_pos
         try:
-            replaced[1::2] = [self.parameters[param_name] for param_name in parts[1::2]]
+            if self.text is not None:
+                replaced.text = self.text.fill(parameters)
+            elif self.text_parts is not None:
+                replaced.text = [
+                    (kind, slot.fill(parameters) if slot is not None else value)
+                    for kind, value, slot in self.text_parts
+                ]
+            if self.code is not None:
+                replaced.code = self.code.fill(parameters)
+            if self.figure is not None:
+                replaced.figure = self.figure.fill(parameters)
         except KeyError as exception:
             raise EyegradeException(
                 "Parameter: {}".format(exception.args[0]), key="undefined_parameter"
             )
-        return "".join(replaced)
+        return replaced
+
+
+def _compile_optional(text: Optional[str]) -> Optional[slots.SlotText]:
+    if text is None:
+        return None
+    return slots.SlotText(text)
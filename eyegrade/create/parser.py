@@ -16,10 +16,14 @@
 # <https://www.gnu.org/licenses/>.
 #
 
-import xml.dom.minidom
+import xml.etree.ElementTree as ElementTree
 import re
+import os
+import pickle
+import hashlib
+import tempfile
 
-from typing import List, Iterable, Optional, Tuple, Union, TYPE_CHECKING
+from typing import List, Iterable, Optional, Tuple, Union
 
 from .. import utils
 from .. import scoring
@@ -27,16 +31,15 @@ from . import questions
 from . import parametric
 from . import words
 
-if TYPE_CHECKING:
-    import xml.dom
-    import xml.dom.minicompat
-
-
 EyegradeException = utils.EyegradeException
 
 EYEGRADE_NAMESPACE = "http://www.it.uc3m.es/jaf/eyegrade/ns/"
 text_norm_re = re.compile(r"[\ \t\n]+")
 
+# Bump it when the parser or the classes of the questions module
+# change, so that banks parsed by older versions are not reused.
+PARSED_BANK_FORMAT = "2"
+
 # Register user-friendly error messages
 EyegradeException.register_error(
     "exam_root_element",
@@ -129,51 +132,131 @@ EyegradeException.register_error(
 EyegradeException.register_error("bad_fix_value", "Bad value for eye:fix attribute")
 
 
-def parse_exam(exam_filename: str) -> questions.ExamQuestions:
-    """Parses the questions of a exam from an XML file."""
-    dom_tree = xml.dom.minidom.parse(exam_filename)
-    # By now, only one parser exists. In the future multiple parsers can
-    # be called from here, to allow multiple data formats.
-    return _parse_tree(dom_tree)
-
-
-def _parse_tree(dom_tree: xml.dom.minidom.Document) -> questions.ExamQuestions:
-    assert dom_tree.nodeType == xml.dom.minidom.Node.DOCUMENT_NODE
-    root = dom_tree.childNodes[0]
-    if get_full_name(root) == (EYEGRADE_NAMESPACE, "exam"):
-        exam = questions.ExamQuestions()
-        exam.subject = get_element_content(root, EYEGRADE_NAMESPACE, "subject")
-        exam.degree = get_element_content(root, EYEGRADE_NAMESPACE, "degree")
-        exam.date = get_element_content(root, EYEGRADE_NAMESPACE, "date")
-        exam.duration = get_element_content(root, EYEGRADE_NAMESPACE, "duration")
-        exam.title = get_element_content(root, EYEGRADE_NAMESPACE, "title")
-        student_id_length, student_id_label = parse_student_id(root)
-        if student_id_length is not None:
-            exam.student_id_length = student_id_length
-        if student_id_label is not None:
-            exam.student_id_label = student_id_label
-        for node in get_children_by_tag_names(
-            root, EYEGRADE_NAMESPACE, ["question", "group"]
-        ):
-            if node.localName == "question":
-                exam.questions.append(parse_question(node))
-            else:
-                exam.questions.append(parse_group(node))
-        scores = parse_scores(root)
-        if isinstance(scores, scoring.AutomaticScore):
-            exam.scores = scores.compute(exam.num_questions(), exam.num_choices())
+def parse_exam(
+    exam_filename: str, cache_dir: Optional[str] = None
+) -> questions.ExamQuestions:
+    """Parses the questions of a exam from an XML file.
+
+    When `cache_dir` is given, the parsed exam is stored in that
+    directory, keyed by a hash of the contents of the file, and
+    loaded from there as long as the file does not change.
+
+    """
+    if cache_dir is None:
+        return _parse_file(exam_filename)
+    cache_file = _cache_filename(exam_filename, cache_dir)
+    exam = _load_parsed_exam(cache_file)
+    if exam is None:
+        exam = _parse_file(exam_filename)
+        _save_parsed_exam(exam, cache_file)
+    return exam
+
+
+def _parse_file(exam_filename: str) -> questions.ExamQuestions:
+    # The file is parsed incrementally: each question or group is
+    # converted as soon as its end tag is read and then dropped from
+    # the tree, so that large question banks are never held in memory
+    # as a whole. Only the short header elements remain in the root.
+    exam = questions.ExamQuestions()
+    root: Optional[ElementTree.Element] = None
+    depth = 0
+    for event, element in ElementTree.iterparse(
+        exam_filename, events=("start", "end"), parser=_xml_parser()
+    ):
+        if event == "start":
+            if root is None:
+                root = element
+                if get_full_name(root) != (EYEGRADE_NAMESPACE, "exam"):
+                    raise EyegradeException(
+                        "Bad root element: " + printable_name(root),
+                        key="exam_root_element",
+                    )
+            depth += 1
         else:
-            exam.scores = scores
-        exam.points_words = parse_points_words(root)
+            depth -= 1
+            if depth == 1 and get_full_name(element) in (
+                (EYEGRADE_NAMESPACE, "question"),
+                (EYEGRADE_NAMESPACE, "group"),
+            ):
+                if get_full_name(element)[1] == "question":
+                    exam.questions.append(parse_question(element))
+                else:
+                    exam.questions.append(parse_group(element))
+                assert root is not None
+                root.remove(element)
+    assert root is not None
+    _parse_header(root, exam)
+    return exam
+
+
+def _xml_parser() -> ElementTree.XMLParser:
+    # Comments are kept in the tree because they split text into
+    # separate parts, like text nodes in DOM.
+    try:
+        builder = ElementTree.TreeBuilder(insert_comments=True)
+    except TypeError:
+        # Python < 3.8
+        builder = ElementTree.TreeBuilder()
+    return ElementTree.XMLParser(target=builder)
+
+
+def _parse_header(root: ElementTree.Element, exam: questions.ExamQuestions) -> None:
+    exam.subject = get_element_content(root, EYEGRADE_NAMESPACE, "subject")
+    exam.degree = get_element_content(root, EYEGRADE_NAMESPACE, "degree")
+    exam.date = get_element_content(root, EYEGRADE_NAMESPACE, "date")
+    exam.duration = get_element_content(root, EYEGRADE_NAMESPACE, "duration")
+    exam.title = get_element_content(root, EYEGRADE_NAMESPACE, "title")
+    student_id_length, student_id_label = parse_student_id(root)
+    if student_id_length is not None:
+        exam.student_id_length = student_id_length
+    if student_id_label is not None:
+        exam.student_id_label = student_id_label
+    scores = parse_scores(root)
+    if isinstance(scores, scoring.AutomaticScore):
+        exam.scores = scores.compute(exam.num_questions(), exam.num_choices())
     else:
-        raise EyegradeException(
-            "Bad root element: " + printable_name(root), key="exam_root_element"
-        )
+        exam.scores = scores
+    exam.points_words = parse_points_words(root)
+
+
+def _cache_filename(exam_filename: str, cache_dir: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(PARSED_BANK_FORMAT.encode("ascii") + b"\0")
+    with open(exam_filename, mode="rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return os.path.join(cache_dir, digest.hexdigest() + ".pickle")
+
+
+def _load_parsed_exam(cache_file: str) -> Optional[questions.ExamQuestions]:
+    try:
+        with open(cache_file, mode="rb") as f:
+            exam = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # A damaged or incompatible entry is just parsed again
+        return None
+    if not isinstance(exam, questions.ExamQuestions):
+        return None
     return exam
 
 
+def _save_parsed_exam(exam: questions.ExamQuestions, cache_file: str) -> None:
+    cache_dir = os.path.dirname(cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            pickle.dump(exam, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
 def parse_student_id(
-    root: xml.dom.minidom.Element,
+    root: ElementTree.Element,
 ) -> Tuple[Optional[int], Optional[str]]:
     student_id_length = None
     student_id_label = None
@@ -193,7 +276,7 @@ def parse_student_id(
 
 
 def parse_scores(
-    root: xml.dom.minidom.Element,
+    root: ElementTree.Element,
 ) -> Optional[Union[scoring.AutomaticScore, scoring.QuestionScores]]:
     scores: Optional[Union[scoring.AutomaticScore, scoring.QuestionScores]] = None
     element_list = get_children_by_tag_name(root, EYEGRADE_NAMESPACE, "scores")
@@ -227,7 +310,7 @@ def parse_scores(
     return scores
 
 
-def parse_points_words(root: xml.dom.minidom.Element) -> Optional[words.PointsWords]:
+def parse_points_words(root: ElementTree.Element) -> Optional[words.PointsWords]:
     element_list = get_children_by_tag_name(root, EYEGRADE_NAMESPACE, "pointsWords")
     if len(element_list) == 1:
         element = element_list[0]
@@ -248,7 +331,7 @@ def parse_points_words(root: xml.dom.minidom.Element) -> Optional[words.PointsWo
     return pointsWords
 
 
-def parse_question(question_node: xml.dom.minidom.Element) -> questions.Question:
+def parse_question(question_node: ElementTree.Element) -> questions.Question:
     question: questions.Question
     variation_nodes = get_children_by_tag_name(
         question_node, EYEGRADE_NAMESPACE, "variation"
@@ -268,7 +351,7 @@ def parse_question(question_node: xml.dom.minidom.Element) -> questions.Question
 
 
 def parse_question_variation(
-    variation_node: xml.dom.minidom.Element,
+    variation_node: ElementTree.Element,
 ) -> questions.QuestionVariation:
     text = parse_question_component(variation_node, False)
     choices_list = get_children_by_tag_name(
@@ -297,7 +380,7 @@ def parse_question_variation(
 
 
 def read_fix_attr(
-    node: xml.dom.minidom.Element, fix_first: List[int], fix_last: List[int], index: int
+    node: ElementTree.Element, fix_first: List[int], fix_last: List[int], index: int
 ) -> None:
     value = get_attribute_text(node, "fix")
     if not value:
@@ -313,7 +396,7 @@ def read_fix_attr(
 
 
 def parse_parametric_question(
-    node: xml.dom.minidom.Element, parameter_sets: List[parametric.ParameterSet]
+    node: ElementTree.Element, parameter_sets: List[parametric.ParameterSet]
 ) -> parametric.ParametricQuestion:
     question = parametric.ParametricQuestion(parse_question_variation(node))
     for parameter_set in parameter_sets:
@@ -322,7 +405,7 @@ def parse_parametric_question(
 
 
 def parse_parameter_sets(
-    parent: xml.dom.minidom.Element,
+    parent: ElementTree.Element,
 ) -> List[parametric.ParameterSet]:
     variation_params_nodes = get_children_by_tag_name(
         parent, EYEGRADE_NAMESPACE, "variation_params"
@@ -334,7 +417,7 @@ def parse_parameter_sets(
     return []
 
 
-def parse_group(group_node: xml.dom.minidom.Element) -> questions.QuestionsGroup:
+def parse_group(group_node: ElementTree.Element) -> questions.QuestionsGroup:
     question_list: List[questions.Question] = []
     common_text: Optional[questions.GroupCommonComponent]
     parameter_sets = parse_parameter_sets(group_node)
@@ -349,7 +432,7 @@ def parse_group(group_node: xml.dom.minidom.Element) -> questions.QuestionsGroup
 
 
 def _parse_group_common(
-    group_node: xml.dom.minidom.Element, parameter_sets: List[parametric.ParameterSet]
+    group_node: ElementTree.Element, parameter_sets: List[parametric.ParameterSet]
 ) -> Optional[questions.GroupCommonComponent]:
     common_text: Optional[questions.GroupCommonComponent]
     element_list = get_children_by_tag_name(group_node, EYEGRADE_NAMESPACE, "common")
@@ -382,7 +465,7 @@ def _parse_group_common(
 
 
 def parse_question_component(
-    parent_node: xml.dom.minidom.Element, is_choice: bool
+    parent_node: ElementTree.Element, is_choice: bool
 ) -> questions.QuestionComponent:
     component = questions.QuestionComponent(is_choice)
     if not is_choice:
@@ -429,7 +512,7 @@ def parse_question_component(
 
 
 def parse_variation_params_node(
-    node: xml.dom.minidom.Element,
+    node: ElementTree.Element,
 ) -> List[parametric.ParameterSet]:
     parameter_sets = []
     for variation_node in get_children_by_tag_name(
@@ -439,7 +522,7 @@ def parse_variation_params_node(
     return parameter_sets
 
 
-def parse_parameter_set(node: xml.dom.minidom.Element) -> parametric.ParameterSet:
+def parse_parameter_set(node: ElementTree.Element) -> parametric.ParameterSet:
     parameter_set = parametric.ParameterSet()
     for parameter_node in get_children_by_tag_name(node, EYEGRADE_NAMESPACE, "param"):
         name = get_attribute_text(parameter_node, "name")
@@ -453,20 +536,24 @@ def parse_parameter_set(node: xml.dom.minidom.Element) -> parametric.ParameterSe
 
 
 def get_question_text_content(
-    parent: xml.dom.minidom.Element, namespace: str
+    parent: ElementTree.Element, namespace: str
 ) -> List[Tuple[str, str]]:
     parts = []
     node_list = get_children_by_tag_name(parent, namespace, "text")
     if len(node_list) == 1:
-        for node in node_list[0].childNodes:
-            if node.nodeType == node.TEXT_NODE:
-                parts.append(("text", node.data.strip()))
-            #                parts.append(('text', text_norm_re.sub(' ', node.data)))
-            elif node.nodeType == node.ELEMENT_NODE:
-                if node.namespaceURI == namespace and node.localName == "code":
-                    parts.append(("code", get_text(node.childNodes, False)))
+        text_element = node_list[0]
+        if text_element.text is not None:
+            parts.append(("text", text_element.text.strip()))
+        for node in text_element:
+            if is_element(node):
+                if get_full_name(node) == (namespace, "code"):
+                    parts.append(("code", get_text(node, False)))
                 else:
-                    raise EyegradeException("Unknown element: " + node.localName)
+                    raise EyegradeException(
+                        "Unknown element: {}".format(get_full_name(node)[1])
+                    )
+            if node.tail is not None:
+                parts.append(("text", node.tail.strip()))
     elif not node_list:
         raise EyegradeException("", key="missing_text")
     else:
@@ -475,25 +562,25 @@ def get_question_text_content(
 
 
 def get_element_content(
-    parent: xml.dom.minidom.Element, namespace: str, local_name: str
+    parent: ElementTree.Element, namespace: str, local_name: str
 ) -> Optional[str]:
     content: Optional[str]
     node_list = get_children_by_tag_name(parent, namespace, local_name)
     if not node_list:
         content = None
     elif len(node_list) == 1:
-        content = get_text(node_list[0].childNodes)
+        content = get_text(node_list[0])
     else:
         raise EyegradeException("Duplicate element: " + local_name)
     return content
 
 
-def get_element_content_node(element_node: xml.dom.minidom.Element) -> Optional[str]:
-    return get_text(element_node.childNodes, False)
+def get_element_content_node(element_node: ElementTree.Element) -> Optional[str]:
+    return get_text(element_node, False)
 
 
 def get_element_content_with_attrs(
-    parent: xml.dom.minidom.Element,
+    parent: ElementTree.Element,
     namespace: str,
     local_name: str,
     attr_names: Iterable[str],
@@ -505,7 +592,7 @@ def get_element_content_with_attrs(
         content = None
         att_vals = []
     elif len(node_list) == 1:
-        content = get_text(node_list[0].childNodes, local_name != "code")
+        content = get_text(node_list[0], local_name != "code")
         att_vals = []
         for att in attr_names:
             att_vals.append(get_attribute_text(node_list[0], att))
@@ -515,41 +602,40 @@ def get_element_content_with_attrs(
 
 
 def get_attribute_text(
-    element: xml.dom.minidom.Element, attribute_name: str
+    element: ElementTree.Element, attribute_name: str
 ) -> Optional[str]:
-    value = element.getAttributeNS(EYEGRADE_NAMESPACE, attribute_name)
+    value = element.get("{%s}%s" % (EYEGRADE_NAMESPACE, attribute_name), "")
     if value != "":
         return text_norm_re.sub(" ", value.strip())
     return None
 
 
 def get_children_by_tag_name(
-    parent: xml.dom.minidom.Element, namespace: str, local_name: str
-) -> List[xml.dom.minidom.Element]:
+    parent: ElementTree.Element, namespace: str, local_name: str
+) -> List[ElementTree.Element]:
     return get_children_by_tag_names(parent, namespace, [local_name])
 
 
 def get_children_by_tag_names(
-    parent: xml.dom.minidom.Element, namespace: str, local_names: Iterable[str]
-) -> List[xml.dom.minidom.Element]:
-    return [
-        e
-        for e in parent.childNodes
-        if (
-            e.nodeType == e.ELEMENT_NODE
-            and e.localName in local_names
-            and e.namespaceURI == namespace
-        )
-    ]
+    parent: ElementTree.Element, namespace: str, local_names: Iterable[str]
+) -> List[ElementTree.Element]:
+    tags = ["{%s}%s" % (namespace, local_name) for local_name in local_names]
+    return [e for e in parent if e.tag in tags]
 
 
-def get_text(
-    node_list: xml.dom.minicompat.NodeList, normalize: bool = True
-) -> Optional[str]:
+def get_text(element: ElementTree.Element, normalize: bool = True) -> Optional[str]:
+    """Returns the text directly contained in the element.
+
+    Like the text nodes that are children of the element in DOM, it
+    excludes the text of descendant elements.
+
+    """
     data = []
-    for node in node_list:
-        if node.nodeType == node.TEXT_NODE:
-            data.append(node.data)
+    if element.text is not None:
+        data.append(element.text)
+    for node in element:
+        if node.tail is not None:
+            data.append(node.tail)
     if data:
         text = "".join(data)
         if normalize:
@@ -558,13 +644,23 @@ def get_text(
     return None
 
 
+def is_element(node: ElementTree.Element) -> bool:
+    """Tells whether the node is an element and not a comment or PI."""
+    return isinstance(node.tag, str)
+
+
 def get_full_name(
-    element: xml.dom.minidom.Element,
+    element: ElementTree.Element,
 ) -> Tuple[Optional[str], Optional[str]]:
     """Returns a tuple with (namespace, local_name) for the given element."""
-    return (element.namespaceURI, element.localName)
+    if not is_element(element):
+        return (None, None)
+    if element.tag.startswith("{"):
+        namespace, local_name = element.tag[1:].split("}", 1)
+        return (namespace, local_name)
+    return (None, element.tag)
 
 
-def printable_name(element: xml.dom.minidom.Element) -> str:
+def printable_name(element: ElementTree.Element) -> str:
     """Returns a string 'namespace:local_name' for the given element."""
-    return "{}:{}".format(element.namespaceURI, element.localName)
+    return "{}:{}".format(*get_full_name(element))
@@ -0,0 +1,506 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Draws answer sheets without LaTeX.
+#
+# The answer tables, infobits and student id box of a sheet are laid
+# out in millimetres by AnswerSheet and drawn through a pen, which
+# can be an ImagePen (raster images at any resolution, with OpenCV)
+# or a PdfPen (vector PDF pages). The layout is the same one that the
+# synthetic captures use, whose detection is covered by the tests.
+#
+import math
+import zlib
+
+import cv2
+import numpy as np
+
+from .. import utils
+
+# Sheet layout, in millimetres:
+CELL_WIDTH = 9.0
+CELL_HEIGHT = 5.0
+NUMBER_WIDTH = 7.0
+ID_CELL_WIDTH = 4.0
+ID_CELL_HEIGHT = 4.5
+ID_LABEL_WIDTH = 9.0
+LINE_WIDTH = 0.3
+
+# Distance from the bottom of the id box to the answer tables,
+# in rows of the tables:
+ID_BOX_DISTANCE = 1.4
+
+# Center of the upper and lower infobit marks below the tables, in
+# rows of the tables, and side of the marks:
+INFOBIT_CENTERS = (0.4, 1.3)
+INFOBIT_SIZE = 0.6
+
+# Paper around the sheet in rendered images and PDF pages, in mm:
+PAGE_MARGIN = 10.0
+
+# Page sizes, in mm:
+A4 = (210.0, 297.0)
+
+MM_PER_INCH = 25.4
+POINTS_PER_MM = 72 / MM_PER_INCH
+
+# Grey levels of the printed elements in rendered images:
+PAPER_GRAY = 255
+INK_GRAY = 0
+LIGHT_INK_GRAY = 170
+
+# Width of the characters of Helvetica (the standard PDF font used
+# for text), in thousandths of the font size, for centering text.
+HELVETICA_WIDTHS = dict(
+    zip(
+        "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789: ",
+        [667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833]
+        + [722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611]
+        + [556] * 10
+        + [278, 278],
+    )
+)
+HELVETICA_DEFAULT_WIDTH = 556
+HELVETICA_CAP_HEIGHT = 0.718
+
+
+class AnswerSheet:
+    """Layout of the answer tables, infobits and id box of a sheet.
+
+    `dimensions` is the list of (num_choices, num_questions) pairs of
+    the answer tables. Coordinates are in millimetres, with the origin
+    at the top of the id box or, without id box, of the row of choice
+    letters, and at the left of the number column of the first table.
+    `cell_letters` draws the letter of its choice, in a light color,
+    inside each cell.
+
+    """
+
+    def __init__(
+        self,
+        dimensions,
+        id_num_digits=0,
+        id_label="ID",
+        infobits=True,
+        left_to_right_numbering=False,
+        cell_letters=True,
+    ):
+        if not dimensions:
+            raise ValueError("No answer tables in dimensions")
+        self.dimensions = [tuple(d) for d in dimensions]
+        self.id_num_digits = id_num_digits
+        self.id_label = id_label
+        self.infobits = infobits
+        self.left_to_right_numbering = left_to_right_numbering
+        self.cell_letters = cell_letters
+        self._compute_layout()
+
+    @property
+    def num_questions(self):
+        return len(self.question_cells)
+
+    @property
+    def num_bits(self):
+        return sum(choices for choices, _ in self.dimensions)
+
+    def models(self):
+        """Returns the models that the infobits can encode."""
+        if not self.infobits:
+            return []
+        num_models = utils.max_models(self.num_bits, extended=False)
+        return [utils.model_name(i) for i in range(num_models)]
+
+    def bits(self, model):
+        """Returns the infobits of the model, or None without infobits.
+
+        Like in the sheets that eyegrade-create produces, the special
+        model "0" sets every bit to False.
+
+        """
+        if not self.infobits or model is None:
+            return None
+        if model == "0":
+            return [False] * self.num_bits
+        return utils.encode_model(model, 1, self.num_bits)
+
+    def corners(self):
+        """Returns the matrix of cell corners of each answer table."""
+        corners = []
+        for vlines, (_, rows) in zip(self.vlines, self.dimensions):
+            corners.append([[(x, y) for x in vlines] for y in self.hlines[: rows + 1]])
+        return corners
+
+    def id_corners(self):
+        """Returns the upper and lower corners of the id box cells."""
+        return [[(x, y) for x in self.id_vlines] for y in self.id_hlines]
+
+    def draw(self, pen, model=None):
+        """Draws the printed elements of the sheet with the pen.
+
+        Infobits are drawn for the given model, if any.
+
+        """
+        self._draw_tables(pen)
+        bits = self.bits(model)
+        if bits is not None:
+            self._draw_infobits(pen, bits)
+        if self.id_num_digits:
+            self._draw_id_box(pen)
+
+    def _compute_layout(self):
+        max_rows = max(rows for _, rows in self.dimensions)
+        if self.id_num_digits:
+            top = ID_CELL_HEIGHT + ID_BOX_DISTANCE * CELL_HEIGHT
+        else:
+            top = CELL_HEIGHT
+        self.hlines = [top + i * CELL_HEIGHT for i in range(max_rows + 1)]
+        self.vlines = []
+        x = 0.0
+        for choices, _ in self.dimensions:
+            x += NUMBER_WIDTH
+            self.vlines.append([x + i * CELL_WIDTH for i in range(choices + 1)])
+            x += choices * CELL_WIDTH
+        tables_width = x
+        left, right = 0.0, tables_width
+        if self.id_num_digits:
+            label_width = max(ID_LABEL_WIDTH, 2.0 * len(self.id_label) + 5.0)
+            id_width = self.id_num_digits * ID_CELL_WIDTH
+            id_left = (tables_width - id_width + label_width) / 2
+            self.id_vlines = [
+                id_left + i * ID_CELL_WIDTH for i in range(self.id_num_digits + 1)
+            ]
+            self.id_hlines = (0.0, ID_CELL_HEIGHT)
+            self._id_label_width = label_width
+            left = min(left, id_left - label_width)
+            right = max(right, id_left + id_width)
+        else:
+            self.id_vlines = []
+            self.id_hlines = ()
+        bottom = self.hlines[-1] + (INFOBIT_CENTERS[1] + 1) * CELL_HEIGHT
+        # (left, top, right, bottom) of the printed elements:
+        self.bounds = (left, 0.0, right, bottom)
+        # (table, row) of each question, in question order
+        if self.left_to_right_numbering:
+            self.question_cells = [
+                (table, row)
+                for row in range(max_rows)
+                for table, (_, rows) in enumerate(self.dimensions)
+                if row < rows
+            ]
+        else:
+            self.question_cells = [
+                (table, row)
+                for table, (_, rows) in enumerate(self.dimensions)
+                for row in range(rows)
+            ]
+
+    def _draw_tables(self, pen):
+        for vlines, (choices, rows) in zip(self.vlines, self.dimensions):
+            for y in self.hlines:
+                pen.line((vlines[0], y), (vlines[-1], y))
+            for x in vlines:
+                pen.line((x, self.hlines[0]), (x, self.hlines[rows]))
+            for i in range(choices):
+                pen.text(
+                    chr(65 + i),
+                    (vlines[i] + CELL_WIDTH / 2, self.hlines[0] - CELL_HEIGHT / 2),
+                    0.6 * CELL_HEIGHT,
+                )
+        for question, (table, row) in enumerate(self.question_cells):
+            vlines = self.vlines[table]
+            pen.text(
+                str(question + 1),
+                (vlines[0] - NUMBER_WIDTH / 2, self.hlines[row] + CELL_HEIGHT / 2),
+                0.55 * CELL_HEIGHT,
+            )
+            if self.cell_letters:
+                for i in range(len(vlines) - 1):
+                    pen.text(
+                        chr(65 + i),
+                        (
+                            vlines[i] + CELL_WIDTH / 2,
+                            self.hlines[row] + CELL_HEIGHT / 2,
+                        ),
+                        0.4 * CELL_HEIGHT,
+                        color=pen.light_ink,
+                    )
+
+    def _draw_infobits(self, pen, bits):
+        side = INFOBIT_SIZE * CELL_HEIGHT
+        bits = iter(bits)
+        for vlines, (choices, rows) in zip(self.vlines, self.dimensions):
+            bottom = self.hlines[rows]
+            for i in range(choices):
+                center = INFOBIT_CENTERS[0] if next(bits) else INFOBIT_CENTERS[1]
+                x = vlines[i] + CELL_WIDTH / 2
+                y = bottom + center * CELL_HEIGHT
+                pen.rectangle(
+                    (x - side / 2, y - side / 2), (x + side / 2, y + side / 2)
+                )
+
+    def _draw_id_box(self, pen):
+        top, bottom = self.id_hlines
+        left, right = self.id_vlines[0], self.id_vlines[-1]
+        pen.line((left, top), (right, top))
+        pen.line((left, bottom), (right, bottom))
+        for x in self.id_vlines:
+            pen.line((x, top), (x, bottom))
+        pen.text(
+            self.id_label + ":",
+            (left - self._id_label_width / 2, (top + bottom) / 2),
+            0.7 * ID_CELL_HEIGHT,
+        )
+
+
+class ImagePen:
+    """Draws on an image with layout coordinates, in mm.
+
+    `ppm` is the resolution in pixels per mm and `offset` the position
+    of the origin of the layout in the image, in mm. Colors are grey
+    levels or BGR tuples, depending on the image.
+
+    """
+
+    # Fixed point precision of the coordinates passed to OpenCV:
+    shift = 4
+
+    def __init__(self, image, ppm, offset, ink=INK_GRAY, light_ink=LIGHT_INK_GRAY):
+        self.image = image
+        self.ppm = ppm
+        self.offset = offset
+        self.ink = ink
+        self.light_ink = light_ink
+
+    def point(self, point):
+        factor = self.ppm * (1 << self.shift)
+        return (
+            int(round((point[0] + self.offset[0]) * factor)),
+            int(round((point[1] + self.offset[1]) * factor)),
+        )
+
+    def width(self, width):
+        return max(1, int(round(width * self.ppm)))
+
+    def line(self, p1, p2, color=None, width=LINE_WIDTH):
+        cv2.line(
+            self.image,
+            self.point(p1),
+            self.point(p2),
+            self.ink if color is None else color,
+            self.width(width),
+            cv2.LINE_AA,
+            self.shift,
+        )
+
+    def rectangle(self, p1, p2, color=None):
+        cv2.rectangle(
+            self.image,
+            self.point(p1),
+            self.point(p2),
+            self.ink if color is None else color,
+            -1,
+            cv2.LINE_AA,
+            self.shift,
+        )
+
+    def text(
+        self,
+        text,
+        center,
+        height,
+        color=None,
+        font=cv2.FONT_HERSHEY_SIMPLEX,
+        thickness=LINE_WIDTH,
+    ):
+        """Draws the text centered at `center`, with the given height (mm)."""
+        (base_width, base_height), _ = cv2.getTextSize(text, font, 1.0, 1)
+        scale = height * self.ppm / base_height
+        x = (center[0] + self.offset[0]) * self.ppm - base_width * scale / 2
+        y = (center[1] + self.offset[1]) * self.ppm + base_height * scale / 2
+        cv2.putText(
+            self.image,
+            text,
+            (int(round(x)), int(round(y))),
+            font,
+            scale,
+            self.ink if color is None else color,
+            self.width(thickness),
+            cv2.LINE_AA,
+        )
+
+
+class PdfPen:
+    """Draws a PDF page with layout coordinates, in mm.
+
+    `page_size` is the (width, height) of the page and `offset` the
+    position of the origin of the layout in the page, both in mm.
+    Colors are grey levels from 0 (black) to 1 (white).
+
+    """
+
+    def __init__(self, page_size, offset, ink=0.0, light_ink=0.65):
+        self.page_size = page_size
+        self.offset = offset
+        self.ink = ink
+        self.light_ink = light_ink
+        self._operations = ["0 J"]
+
+    def content(self):
+        """Returns the content stream of the page."""
+        return "\n".join(self._operations).encode("latin-1")
+
+    def point(self, point):
+        # PDF coordinates are in points, from the bottom left corner
+        return (
+            (point[0] + self.offset[0]) * POINTS_PER_MM,
+            (self.page_size[1] - point[1] - self.offset[1]) * POINTS_PER_MM,
+        )
+
+    def line(self, p1, p2, color=None, width=LINE_WIDTH):
+        x1, y1 = self.point(p1)
+        x2, y2 = self.point(p2)
+        self._operations.append(
+            "{:.3f} G {:.3f} w {:.3f} {:.3f} m {:.3f} {:.3f} l S".format(
+                self._color(color), width * POINTS_PER_MM, x1, y1, x2, y2
+            )
+        )
+
+    def rectangle(self, p1, p2, color=None):
+        x1, y1 = self.point(p1)
+        x2, y2 = self.point(p2)
+        self._operations.append(
+            "{:.3f} g {:.3f} {:.3f} {:.3f} {:.3f} re f".format(
+                self._color(color), x1, y2, x2 - x1, y1 - y2
+            )
+        )
+
+    def text(self, text, center, height, color=None):
+        """Draws the text centered at `center`, with the given height (mm)."""
+        size = height / HELVETICA_CAP_HEIGHT * POINTS_PER_MM
+        text_width = size * _helvetica_width(text) / 1000
+        x, y = self.point(center)
+        self._operations.append(
+            "{:.3f} g BT /F1 {:.3f} Tf {:.3f} {:.3f} Td ({}) Tj ET".format(
+                self._color(color),
+                size,
+                x - text_width / 2,
+                y - height * POINTS_PER_MM / 2,
+                _pdf_string(text),
+            )
+        )
+
+    def _color(self, color):
+        return self.ink if color is None else color
+
+
+def render_image(sheet, model=None, dpi=150, margin=PAGE_MARGIN):
+    """Returns a grey level image of the sheet at the given resolution.
+
+    The sheet gets `margin` millimetres of paper around it.
+
+    """
+    ppm = dpi / MM_PER_INCH
+    left, top, right, bottom = sheet.bounds
+    width = int(math.ceil((right - left + 2 * margin) * ppm))
+    height = int(math.ceil((bottom - top + 2 * margin) * ppm))
+    image = np.full((height, width), PAPER_GRAY, dtype=np.uint8)
+    sheet.draw(ImagePen(image, ppm, (margin - left, margin - top)), model=model)
+    return image
+
+
+def write_image(filename, sheet, model=None, dpi=150, margin=PAGE_MARGIN):
+    """Writes an image of the sheet, in the format of the file extension."""
+    if not cv2.imwrite(filename, render_image(sheet, model, dpi, margin)):
+        raise OSError("Could not write image file: " + filename)
+
+
+def write_pdf(filename, sheet, models, page_size=None, margin=PAGE_MARGIN):
+    """Writes a PDF file with a page of the sheet for each model.
+
+    `models` can contain None for pages without infobits. Pages fit
+    the sheet with `margin` millimetres of paper around it, unless a
+    `page_size` (width, height) in mm such as A4 is given, in which
+    case the sheet is centered at the top of the page.
+
+    """
+    left, top, right, bottom = sheet.bounds
+    if page_size is None:
+        page_size = (right - left + 2 * margin, bottom - top + 2 * margin)
+        offset = (margin - left, margin - top)
+    else:
+        offset = ((page_size[0] - right - left) / 2, margin - top)
+    pages = []
+    for model in models:
+        pen = PdfPen(page_size, offset)
+        sheet.draw(pen, model=model)
+        pages.append(pen.content())
+    with open(filename, mode="wb") as f:
+        f.write(_pdf_document(pages, page_size))
+
+
+def _helvetica_width(text):
+    return sum(HELVETICA_WIDTHS.get(c, HELVETICA_DEFAULT_WIDTH) for c in text.upper())
+
+
+def _pdf_string(text):
+    text = text.encode("cp1252", errors="replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _pdf_document(contents, page_size):
+    """Returns the bytes of a PDF document with the given page contents."""
+    width, height = (size * POINTS_PER_MM for size in page_size)
+    num_pages = len(contents)
+    # Objects 1-3 are the catalog, the page tree and the font, and
+    # each page takes two more objects: the page and its content.
+    kids = " ".join("{} 0 R".format(4 + 2 * i) for i in range(num_pages))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(kids, num_pages).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica"
+        b" /Encoding /WinAnsiEncoding >>",
+    ]
+    for i, content in enumerate(contents):
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {:.3f} {:.3f}]"
+            " /Resources << /Font << /F1 3 0 R >> >> /Contents {} 0 R >>".format(
+                width, height, 5 + 2 * i
+            ).encode()
+        )
+        data = zlib.compress(content)
+        objects.append(
+            "<< /Length {} /Filter /FlateDecode >>\nstream\n".format(len(data)).encode()
+            + data
+            + b"\nendstream"
+        )
+    chunks = [b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"]
+    offsets = []
+    position = len(chunks[0])
+    for number, body in enumerate(objects, start=1):
+        chunk = b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        offsets.append(position)
+        chunks.append(chunk)
+        position += len(chunk)
+    xref = [b"xref\n0 %d\n" % (len(objects) + 1), b"0000000000 65535 f \n"]
+    xref.extend(b"%010d 00000 n \n" % offset for offset in offsets)
+    chunks.extend(xref)
+    chunks.append(
+        b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+        % (len(objects) + 1, position)
+    )
+    return b"".join(chunks)
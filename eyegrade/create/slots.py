@@ -0,0 +1,63 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import re
+
+from typing import Callable, List, Mapping
+
+# Slots are written as {{key}} both in exam templates and in the
+# text of parametric questions.
+RE_SLOT = re.compile("{{([^{}]+)}}")
+
+
+class SlotText:
+    """Text with {{key}} slots, compiled once to be filled many times.
+
+    The text is split just once into a list with the literal pieces at
+    even positions and the keys of the slots at odd positions. Filling
+    it copies that list, puts the values at the odd positions and joins
+    it, so that no pattern matching happens for each output.
+
+    """
+
+    __slots__ = ("text", "parts", "keys")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.parts: List[str] = RE_SLOT.split(text)
+        self.keys: List[str] = self.parts[1::2]
+
+    def fill(self, values: Mapping[str, str]) -> str:
+        """Returns the text with the value of each key in its slots.
+
+        Raises KeyError for keys not in `values`.
+
+        """
+        if not self.keys:
+            return self.text
+        return self._join([values[key] for key in self.keys])
+
+    def fill_with(self, value_function: Callable[[str], str]) -> str:
+        """Returns the text with `value_function(key)` in each slot."""
+        if not self.keys:
+            return self.text
+        return self._join([value_function(key) for key in self.keys])
+
+    def _join(self, values: List[str]) -> str:
+        parts = self.parts[:]
+        parts[1::2] = values
+        return "".join(parts)
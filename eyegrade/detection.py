@@ -18,6 +18,7 @@
 import math
 import copy
 import sys
+import time
 import itertools
 
 import cv2
@@ -25,8 +26,9 @@ import numpy as np
 
 # Local imports
 from . import geometry as g
+from . import clustering
+from . import timing
 from . import capture
-from . import sessiondb
 from . import images
 from . import utils
 from .ocr import classifiers
@@ -54,6 +56,21 @@ param_id_boxes_energy_break = 0.99
 param_id_boxes_min_height = 15
 param_id_boxes_discard_distance = 20
 
+# Parameters for exam removal detection. Similarities at or above the
+# first threshold mean that the exam is still there, and below the
+# second one that it was removed. Hough is used in between.
+param_signature_size = (32, 24)
+param_signature_blur = 1.0
+param_signature_margin = 0.1
+param_signature_same_threshold = 0.85
+param_signature_removed_threshold = 0.5
+
+# Parameters of the frame quality gate: frames are downscaled to this
+# width before measuring motion and sharpness.
+param_quality_gate_width = 320
+param_quality_gate_max_motion = 4.0
+param_quality_gate_min_sharpness = 25.0
+
 # Other parameters
 param_error_log = "eyegrade-errors.log"
 param_error_image_pattern = "error-%s.png"
@@ -62,6 +79,7 @@ param_error_image_pattern = "error-%s.png"
 class ExamDetector:
     default_options = {
         "infobits": True,
+        "extended-models": False,
         "left-to-right-numbering": False,
         "show-lines": False,
         "debug-ocr": False,
@@ -74,6 +92,9 @@ class ExamDetector:
         "capture-proc-ipl": None,
         "error-logging": False,
         "logging-dir": ".",
+        "timing": False,
+        "show-timing": False,
+        "timing-log": None,
     }
 
     @classmethod
@@ -83,17 +104,29 @@ class ExamDetector:
     def __init__(self, dimensions, context, options, image_raw=None):
         self.options = options
         self.context = context
+        if (
+            self.options["timing"]
+            or self.options["show-timing"]
+            or self.options["timing-log"]
+        ):
+            self.timer = timing.StageTimer()
+        else:
+            self.timer = timing.NULL_TIMER
         if image_raw is not None:
             self.image_raw = image_raw
-            self.image_proc = pre_process(self.image_raw)
+            with self.timer.stage("pre_process"):
+                self.image_proc = pre_process(self.image_raw)
         elif not self.options["capture-from-file"]:
-            self.image_raw = self.context.capture()
-            self.image_proc = pre_process(self.image_raw)
+            with self.timer.stage("capture"):
+                self.image_raw = self.context.capture()
+            with self.timer.stage("pre_process"):
+                self.image_proc = pre_process(self.image_raw)
         elif self.options["capture-raw-file"] is not None:
             self.image_raw = images.load_image(self.options["capture-raw-file"])
             if self.image_raw is None:
                 raise utils.EyegradeException("", key="load_image")
-            self.image_proc = pre_process(self.image_raw)
+            with self.timer.stage("pre_process"):
+                self.image_proc = pre_process(self.image_raw)
         elif self.options["capture-proc-file"] is not None:
             self.image_raw = images.load_image(self.options["capture-proc-file"])
             self.image_proc = images.rgb_to_gray(self.image_raw)
@@ -119,6 +152,9 @@ class ExamDetector:
             self.image_to_show = self.image_raw
         self.decisions = None
         self.capture = None
+        # Time in seconds of each stage of the last detection, when
+        # timing is enabled:
+        self.stage_times = None
 
     def detect_safe(self):
         try:
@@ -143,33 +179,40 @@ class ExamDetector:
         id_hlines = None
         success = False
         axes = None
-        lines = detect_lines(self.image_proc, self.context.get_hough_threshold())
+        timer = self.timer
+        with timer.stage("detect_lines"):
+            lines = detect_lines(self.image_proc, self.context.get_hough_threshold())
         if len(lines) >= 2:
             self.status["lines"] = True
-            axes = detect_boxes(lines, self.dimensions)
+            with timer.stage("detect_boxes"):
+                axes = detect_boxes(lines, self.dimensions)
         if axes is None:
             self.context.next_hough_threshold()
         else:
             self.status["boxes"] = True
-            axes = filter_axes(
-                axes,
-                images.get_width(self.image_raw),
-                images.get_height(self.image_raw),
-                self.options["read-id"],
-            )
-            corner_matrixes = cell_corners(
-                axes[1][1],
-                axes[0][1],
-                images.get_width(self.image_raw),
-                images.get_height(self.image_raw),
-                self.dimensions,
-            )
+            with timer.stage("filter_axes"):
+                axes = filter_axes(
+                    axes,
+                    images.get_width(self.image_raw),
+                    images.get_height(self.image_raw),
+                    self.options["read-id"],
+                )
+            with timer.stage("cell_corners"):
+                corner_matrixes = cell_corners(
+                    axes[1][1],
+                    axes[0][1],
+                    images.get_width(self.image_raw),
+                    images.get_height(self.image_raw),
+                    self.dimensions,
+                )
             if len(corner_matrixes) > 0:
                 self.status["cells"] = True
-                answer_cells = self._answer_cells_geometry(corner_matrixes)
-                answers = self._decide_cells(answer_cells)
+                with timer.stage("decide_cells"):
+                    answer_cells = self._answer_cells_geometry(corner_matrixes)
+                    answers = self._decide_cells(answer_cells)
                 if self.options["infobits"]:
-                    bits = read_infobits(self.image_proc, corner_matrixes)
+                    with timer.stage("read_infobits"):
+                        bits = read_infobits(self.image_proc, corner_matrixes)
                     if bits is not None:
                         self.status["infobits"] = True
                         success = True
@@ -178,19 +221,21 @@ class ExamDetector:
                 else:
                     success = True
                 if success and self.options["read-id"]:
-                    id_hlines, id_cells = id_boxes_geometry(
-                        self.image_proc,
-                        self.options["id-num-digits"],
-                        axes[1][1],
-                        self.dimensions,
-                    )
+                    with timer.stage("id_boxes_geometry"):
+                        id_hlines, id_cells = id_boxes_geometry(
+                            self.image_proc,
+                            self.options["id-num-digits"],
+                            axes[1][1],
+                            self.dimensions,
+                        )
                     if id_hlines:
                         self.status["id-box-hlines"] = True
                     if not id_cells:
                         success = False
                     else:
                         self.status["id-box"] = True
-                        detected_id, id_scores = self._detect_id(id_cells)
+                        with timer.stage("detect_id"):
+                            detected_id, id_scores = self._detect_id(id_cells)
                 else:
                     id_cells = []
         if success:
@@ -217,8 +262,16 @@ class ExamDetector:
                         images.draw_point(self.image_to_show, corner)
         if self.options["show-status"]:
             self._draw_status_flags()
+        self._record_timing(success)
+        if self.options["show-timing"]:
+            self._draw_timing()
         self.decisions = capture.ExamDecisions(
-            success, answers, detected_id, id_scores, infobits=bits
+            success,
+            answers,
+            detected_id,
+            id_scores,
+            infobits=bits,
+            extended_models=self.options["extended-models"],
         )
         self.capture = capture.ExamCapture(
             self.image_to_show, answer_cells, id_cells, self._compute_progress()
@@ -248,7 +301,12 @@ class ExamDetector:
         detected_id = None
         id_scores = None
         self.decisions = capture.ExamDecisions(
-            success, answers, detected_id, id_scores, infobits=bits
+            success,
+            answers,
+            detected_id,
+            id_scores,
+            infobits=bits,
+            extended_models=self.options["extended-models"],
         )
         self.capture = capture.ExamCapture(
             self.image_to_show, answer_cells, id_cells, 1.0
@@ -394,6 +452,49 @@ class ExamDetector:
             images.draw_text(self.image_to_show, letter, color, (x, y))
             x += width
 
+    def _record_timing(self, success):
+        """Adds the times of this frame to the statistics of the context.
+
+        They are also appended to the timing log, if it is enabled.
+
+        """
+        times = self.timer.finish()
+        self.stage_times = times
+        if times is None:
+            return
+        self.context.timing.add(times)
+        if self.options["timing-log"]:
+            record = {
+                "time": time.time(),
+                "success": success,
+                "hough_threshold": self.context.get_hough_threshold(),
+                "status": self.status,
+                "stages": times,
+            }
+            self.context.timing.log(self.options["timing-log"], record)
+
+    def _draw_timing(self):
+        """Draws the time of each stage in this frame and its percentiles."""
+        statistics = self.context.timing
+        times = self.stage_times or {}
+        y = 20
+        for name, percentiles in statistics.summary().items():
+            current = times.get(name)
+            text = "{:<18} {:>6} ms  p50 {:.1f}  p90 {:.1f}  p99 {:.1f}".format(
+                name,
+                "{:.1f}".format(1000 * current) if current is not None else "-",
+                *[1000 * p for p in percentiles]
+            )
+            images.draw_text(
+                self.image_to_show,
+                text,
+                color=(255, 0, 0),
+                position=(10, y),
+                scale=0.45,
+                thickness=1,
+            )
+            y += 18
+
     def _draw_hough_threshold(self):
         pos = (images.get_width(self.image_to_show) - 77, 110)
         images.draw_text(
@@ -407,6 +508,115 @@ class ExamDetector:
                     images.draw_point(self.image_to_show, c)
 
 
+class ExamChangeDetector:
+    """Detects that a locked exam has been removed from the camera view.
+
+    It compares a small grayscale signature of the region of the
+    answer tables in the locked capture with the same region of new
+    frames. Only when the similarity is neither clearly high nor
+    clearly low the lines of the frame are detected with Hough
+    (see `ExamDetector.try_to_detect`), which is much slower.
+
+    """
+
+    def __init__(self, exam_capture, dimensions, context, options):
+        self.dimensions = dimensions
+        self.context = context
+        self.options = options
+        image = exam_capture.image_raw
+        self.roi = signature_roi(
+            exam_capture.answer_cells,
+            images.get_width(image),
+            images.get_height(image),
+        )
+        self.reference = image_signature(image, self.roi)
+        self.similarity = None
+        self.used_hough = False
+
+    def exam_present(self, image_raw=None):
+        """Checks whether the exam is still in the frame.
+
+        If `image_raw` is None, a new frame is captured.
+
+        """
+        if image_raw is None:
+            image_raw = self.context.capture()
+        self.similarity = signature_similarity(
+            self.reference, image_signature(image_raw, self.roi)
+        )
+        self.used_hough = False
+        if self.similarity >= param_signature_same_threshold:
+            return True
+        elif self.similarity < param_signature_removed_threshold:
+            return False
+        self.used_hough = True
+        detector = ExamDetector(
+            self.dimensions, self.context, self.options, image_raw=image_raw
+        )
+        detector.try_to_detect()
+        return detector.exam_detected
+
+
+class FrameQualityGate:
+    """Filters out frames not worth running the detector on.
+
+    A frame passes the gate when it is stable and sharp: the mean
+    absolute difference of grey levels with the previous frame
+    (motion energy) must not be above `max_motion`, and the variance
+    of its Laplacian (sharpness) must not be below `min_sharpness`.
+    Both are measured on a grayscale version of the frame downscaled
+    to `param_quality_gate_width` pixels wide. Set a threshold to None
+    in order to disable its check.
+
+    """
+
+    def __init__(
+        self,
+        max_motion=param_quality_gate_max_motion,
+        min_sharpness=param_quality_gate_min_sharpness,
+    ):
+        self.max_motion = max_motion
+        self.min_sharpness = min_sharpness
+        self.frames = 0
+        self.skipped = 0
+        self.motion = None
+        self.sharpness = None
+        self._previous = None
+
+    @property
+    def skipped_fraction(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def reset(self):
+        """Forgets the previous frame, e.g. after a pause in the capture."""
+        self._previous = None
+
+    def check(self, image):
+        """Returns True if the frame should be passed to the detector."""
+        gray = images.rgb_to_gray(image)
+        height = int(
+            round(images.get_height(image) * param_quality_gate_width / gray.shape[1])
+        )
+        small = cv2.resize(
+            gray, (param_quality_gate_width, height), interpolation=cv2.INTER_AREA
+        )
+        self.sharpness = float(cv2.Laplacian(small, cv2.CV_32F).var())
+        # Smoothing keeps the noise of the camera out of the motion energy
+        smooth = cv2.GaussianBlur(small.astype(np.float32), (0, 0), 1.0)
+        if self._previous is not None and self._previous.shape == smooth.shape:
+            self.motion = float(np.mean(cv2.absdiff(smooth, self._previous)))
+        else:
+            self.motion = 0.0
+        self._previous = smooth
+        accepted = (self.max_motion is None or self.motion <= self.max_motion) and (
+            self.min_sharpness is None or self.sharpness >= self.min_sharpness
+        )
+        self.frames += 1
+        if not accepted:
+            self.skipped += 1
+        return accepted
+
+
 class ImageTransformer:
     """Apply transformations to the image captured by the webcam.
 
@@ -467,10 +677,26 @@ class ExamDetectorContext:
         self.failures_in_a_row = 0
         self.camera = None
         self.camera_id = camera_id
+        self.frame_source = None
         self.threshold_locked = False
         self.image_transformer = image_transformer
-        self.ocr = classifiers.DefaultDigitClassifier()
-        self.crosses_classifier = classifiers.DefaultCrossesClassifier()
+        self._ocr = None
+        self._crosses_classifier = None
+        self.timing = timing.StageStatistics()
+
+    @property
+    def ocr(self):
+        """The digit classifier, loaded the first time it is needed."""
+        if self._ocr is None:
+            self._ocr = classifiers.DefaultDigitClassifier()
+        return self._ocr
+
+    @property
+    def crosses_classifier(self):
+        """The crosses classifier, loaded the first time it is needed."""
+        if self._crosses_classifier is None:
+            self._crosses_classifier = classifiers.DefaultCrossesClassifier()
+        return self._crosses_classifier
 
     def open_camera(self, camera_id=None):
         """Initializes the last camera device used, or `camera_id`.
@@ -498,6 +724,18 @@ class ExamDetectorContext:
                         self.camera, self.camera_id = self._try_next_camera(-1)
         return self.camera is not None
 
+    def open_source(self, frame_source):
+        """Captures from a frame source instead of a camera.
+
+        `frame_source` is a file source of the `sources` module. The
+        capture returns None after its last frame. The source is
+        released by close_camera().
+
+        """
+        self.close_camera()
+        self.camera = frame_source
+        self.frame_source = frame_source
+
     def current_camera_id(self):
         """Returns the id (integer) of the current camera or None."""
         if self.camera_id >= 0:
@@ -555,11 +793,14 @@ class ExamDetectorContext:
         """Closes the current camera.
 
         The same camera will be opened again when open_camera() is called.
+        The timing log, if any, is closed too.
 
         """
         if self.camera is not None:
             self.camera.release()
         self.camera = None
+        self.frame_source = None
+        self.timing.close()
 
     def capture(self, clone=False, resize=None):
         """Returns a capture.
@@ -573,6 +814,9 @@ class ExamDetectorContext:
         the image is scaled to that size. Scaling implies a new copy
         regardless the value of `clone`.
 
+        When capturing from a frame source, it returns None after the
+        last frame.
+
         """
         image = None
         if resize is not None:
@@ -581,13 +825,20 @@ class ExamDetectorContext:
         if self.camera is not None:
             image = self.capture_image(clone=clone)
             if image is None:
+                if self.frame_source is not None:
+                    return None
                 image = np.zeros((480, 640, 3), dtype=np.uint8)
             if resize is not None:
                 image = cv2.resize(image, resize, interpolation=cv2.INTER_AREA)
         return self.image_transformer.transform(image)
 
     def dump_buffer(self, delay_suffered):
-        if self.camera is not None and delay_suffered > 0.1:
+        # Frames of files are never dropped: they do not queue up
+        if (
+            self.camera is not None
+            and self.frame_source is None
+            and delay_suffered > 0.1
+        ):
             frames_to_drop = min(8, int(1 + (delay_suffered - 0.1) / 0.04))
             for i in range(0, frames_to_drop):
                 self.capture_image(False)
@@ -625,6 +876,10 @@ class ExamDetectorContext:
 
 class FalseExamDetectorContext(ExamDetectorContext):
     def __init__(self, session_file):
+        # Imported here in order to keep the session and spreadsheet
+        # modules out of detection-only programs:
+        from . import sessiondb
+
         super().__init__()
         self.session = sessiondb.SessionDB(session_file)
         self.camera_id = 99
@@ -663,6 +918,55 @@ class FalseExamDetectorContext(ExamDetectorContext):
             self.next_exam_idx = 0
 
 
+def signature_roi(answer_cells, width, height):
+    """Returns the region (x0, y0, x1, y1) of the image to sign.
+
+    It is the bounding box of the answer cells, enlarged by a margin
+    and clipped to the image. The whole image if there are no cells.
+
+    """
+    if not answer_cells:
+        return (0, 0, width, height)
+    points = np.array(
+        [cell.corners() for row in answer_cells for cell in row], dtype=float
+    ).reshape(-1, 2)
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    margin = param_signature_margin * (high - low)
+    low = np.maximum(low - margin, 0).astype(int)
+    high = np.minimum(high + margin, (width, height)).astype(int)
+    if high[0] - low[0] < 2 or high[1] - low[1] < 2:
+        return (0, 0, width, height)
+    return (low[0], low[1], high[0], high[1])
+
+
+def image_signature(image, roi):
+    """Returns a small normalized grayscale version of a region of the image.
+
+    The region is downscaled to `param_signature_size` and normalized
+    to zero mean and unit variance, so that the signatures of two
+    captures of the same scene are similar even if the brightness
+    changes.
+
+    """
+    x0, y0, x1, y1 = roi
+    gray = images.rgb_to_gray(image)[y0:y1, x0:x1]
+    signature = cv2.resize(
+        gray, param_signature_size, interpolation=cv2.INTER_AREA
+    ).astype(np.float32)
+    signature = cv2.GaussianBlur(signature, (0, 0), param_signature_blur)
+    signature -= signature.mean()
+    std = signature.std()
+    if std > 1e-3:
+        signature /= std
+    return signature
+
+
+def signature_similarity(signature1, signature2):
+    """Returns the correlation of two signatures, from -1 to 1."""
+    return float(np.mean(signature1 * signature2))
+
+
 def pre_process(image):
     gray = images.rgb_to_gray(image)
     thr = cv2.adaptiveThreshold(
@@ -677,14 +981,18 @@ def pre_process(image):
 
 
 def detect_lines(image, hough_threshold):
+    """Returns the lines detected by the Hough transform.
+
+    Lines are returned as an array with a (rho, theta) row per line,
+    sorted by theta.
+
+    """
     raw_lines = cv2.HoughLines(image, 1, 0.01, hough_threshold)
     if raw_lines is None:
-        return []
-    lines = raw_lines
-    if len(lines[0]) > 500:
-        return []
-    lines = [(float(l[0][0]), float(l[0][1])) for l in lines]
-    return sorted(lines, key=lambda x: x[1])
+        return clustering.as_lines_array([])
+    if len(raw_lines[0]) > 500:
+        return clustering.as_lines_array([])
+    return clustering.sort_by_theta(raw_lines)
 
 
 def detect_directions(lines):
@@ -692,40 +1000,28 @@ def detect_directions(lines):
 
     Parameters:
     - lines: a list of tuples (rho, theta) sorted from smaller to bigger
-        value of rho.
+        value of theta.
 
     Returns the list of detected axes where each ax is a tuple of
     (theta, list of lines), being theta the average angle
     of the lines of the ax. Axes are sorted by angle from horizontal
-    to vertical. Lines within each ax are sorted by theta.
+    to vertical. Lines within each ax are sorted by the absolute
+    value of rho.
 
     """
     assert len(lines) >= 2
-    axes = []
-    rho, theta = lines[0]
-    axes.append((theta, [(rho, theta)]))
-    for rho, theta in lines[1:]:
-        if abs(theta - axes[-1][0]) < param_directions_threshold:
-            axes[-1][1].append((rho, theta))
-        else:
-            axes.append((theta, [(rho, theta)]))
-    if abs(axes[0][0] - axes[-1][0] + math.pi) < param_directions_threshold:
-        axes[0][1].extend([(-rho, theta - math.pi) for rho, theta in axes[-1][1]])
-        del axes[-1]
-    for i in range(0, len(axes)):
-        avg = sum([theta for rho, theta in axes[i][1]]) / len(axes[i][1])
-        axes[i] = (avg, sorted(axes[i][1], key=lambda x: abs(x[0])))
-    if abs(axes[-1][0] - math.pi) < abs(axes[0][0]):
-        axes = axes[-1:] + axes[0:-1]
-    return axes
+    axes = clustering.detect_directions(
+        clustering.as_lines_array(lines), param_directions_threshold
+    )
+    return [(theta, clustering.to_line_tuples(ax)) for theta, ax in axes]
 
 
 def detect_boxes(lines, dimensions):
     """Classify lines in two groups: horizontal and vertical lines.
 
     Parameters:
-    - lines: a list of tuples (rho, theta) sorted from smaller to bigger
-        value of rho.
+    - lines: an array of lines (rho, theta) sorted from smaller to bigger
+        value of theta.
     - dimensions: a list of boxes dimensions, where each box is a tuple
         (number-of-choices, number of questions). For example:
         [(3, 10), (3, 9)] means that the left-most box has 10 questions
@@ -734,13 +1030,16 @@ def detect_boxes(lines, dimensions):
 
     Returns None if detection failed or the list of two axes
     [vertical, horizontal] where each ax is a tuple of
-    (theta, list of lines), being theta the average angle
-    of the lines of the ax. Lines within each ax are sorted by theta.
+    (theta, array of lines), being theta the average angle
+    of the lines of the ax. Lines within each ax are sorted by the
+    absolute value of rho.
 
     """
     v_expected = len(dimensions) + sum([box[0] for box in dimensions])
     h_expected = 1 + max([box[1] for box in dimensions])
-    axes = detect_directions(lines)
+    axes = clustering.detect_directions(
+        clustering.as_lines_array(lines), param_directions_threshold
+    )
     axes = [axis for axis in axes if len(axis[1]) >= min(v_expected, h_expected)]
     # If there are spurious axes, try to filter them out:
     if len(axes) == 3:
@@ -776,41 +1075,25 @@ def filter_axes(axes, image_width, image_height, read_id):
 
     """
     # First, filter out lines too close to image borders
-    axes = (
-        (
-            axes[0][0],
-            [
-                l
-                for l in axes[0][1]
-                if (
-                    (abs(l[0]) < 0.97 * image_width and abs(l[0]) > 0.03 * image_width)
-                    or not g.angles_perpendicular(math.pi / 2, l[1])
-                )
-            ],
-        ),
-        (
-            axes[1][0],
-            [
-                l
-                for l in axes[1][1]
-                if (
-                    (
-                        abs(l[0]) < 0.97 * image_height
-                        and abs(l[0]) > 0.03 * image_height
-                    )
-                    or not g.angles_perpendicular(0.0, l[1])
-                )
-            ],
-        ),
-    )
+    vlines = clustering.filter_border_lines(axes[0][1], image_width, math.pi / 2)
+    hlines = clustering.filter_border_lines(axes[1][1], image_height, 0.0)
     # Now, colapse lines that are too close
-    hlines = collapse_lines_angles(axes[1][1], True)
-    if hlines is None:
-        return axes
-    vlines = collapse_lines_angles(axes[0][1], False)
-    if vlines is None:
-        return axes
-    return [(axes[0][0], vlines), (axes[1][0], hlines)]
+    collapsed_hlines = clustering.collapse_lines(
+        hlines, True, param_collapse_lines_maxgap
+    )
+    if collapsed_hlines is not None:
+        collapsed_vlines = clustering.collapse_lines(
+            vlines, False, param_collapse_lines_maxgap
+        )
+    if collapsed_hlines is None or collapsed_vlines is None:
+        return (
+            (axes[0][0], clustering.to_line_tuples(vlines)),
+            (axes[1][0], clustering.to_line_tuples(hlines)),
+        )
+    return [
+        (axes[0][0], clustering.to_line_tuples(collapsed_vlines)),
+        (axes[1][0], clustering.to_line_tuples(collapsed_hlines)),
+    ]
 
 
 def collapse_lines_angles(lines, horizontal):
@@ -823,32 +1106,12 @@ def collapse_lines_angles(lines, horizontal):
     lines is not matched.
 
     """
-    if len(lines) < 2:
+    main_lines = clustering.collapse_lines(
+        clustering.as_lines_array(lines), horizontal, param_collapse_lines_maxgap
+    )
+    if main_lines is None:
         return None
-    main_lines = []
-    sum_rho = lines[0][0]
-    sum_theta = lines[0][1]
-    num_lines = 1
-    last_line = lines[0]
-    for line in lines[1:]:
-        if (
-            (
-                (horizontal and line[1] > last_line[1])
-                or (not horizontal and line[1] < last_line[1])
-            )
-            and abs(line[0] - last_line[0]) >= 5
-        ) or abs(line[0] - last_line[0]) > param_collapse_lines_maxgap:
-            main_lines.append((sum_rho / num_lines, sum_theta / num_lines))
-            sum_rho = line[0]
-            sum_theta = line[1]
-            num_lines = 1
-        else:
-            sum_rho += line[0]
-            sum_theta += line[1]
-            num_lines += 1
-        last_line = line
-    main_lines.append((sum_rho / num_lines, sum_theta / num_lines))
-    return main_lines
+    return clustering.to_line_tuples(main_lines)
 
 
 def cell_corners(hlines, vlines, iwidth, iheight, dimensions):
@@ -0,0 +1,185 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Detection of answer sheets that are graded more than once.
+#
+# The answer area of each capture gets a perceptual hash: the inner
+# part of every answer cell is rectified and its mean brightness is
+# measured, relative to the brightest cell of its question (so that
+# lighting gradients cancel out). The resulting vector is reduced to
+# HASH_BITS bits by random hyperplane projections (SimHash), so that
+# captures of the same sheet get hashes at a small Hamming distance
+# regardless of the position of the sheet, while sheets with other
+# marks get distant hashes.
+#
+import functools
+import collections
+
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+
+# Maximum Hamming distance between the hashes of two captures of the
+# same sheet. In synthetic captures of the same sheet the distance is
+# usually below 8 (and up to 10), whereas sheets with other random
+# answers are at 17 or more.
+MAX_DISTANCE = 12
+
+# Size in pixels of the rectified cells, and fraction of the cell
+# that is left out at each side (in order to exclude its borders):
+_CELL_SIZE = 6
+_CELL_MARGIN = 0.2
+
+# The hashes are split in _NUM_CHUNKS chunks of _CHUNK_BITS bits
+# for indexing them (see HashIndex):
+_NUM_CHUNKS = 4
+_CHUNK_BITS = HASH_BITS // _NUM_CHUNKS
+
+
+def sheet_hash(image, answer_cells):
+    """Returns the perceptual hash of the answer area of a capture.
+
+    `answer_cells` is the list of cells (capture.CellGeometry
+    objects) of each question. The hash is an integer of HASH_BITS
+    bits.
+
+    """
+    if len(image.shape) == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    num_choices = max(len(cells) for cells in answer_cells)
+    brightness = np.zeros((len(answer_cells), num_choices), dtype=np.float64)
+    # The corners of each cell are mapped so that its inner part
+    # fills the rectified cell:
+    outside = _CELL_MARGIN / (1 - 2 * _CELL_MARGIN) * _CELL_SIZE
+    low = -outside
+    high = _CELL_SIZE + outside
+    target = np.array(
+        [[low, low], [high, low], [low, high], [high, high]], dtype=np.float32
+    )
+    for i, cells in enumerate(answer_cells):
+        for j, cell in enumerate(cells):
+            corners = np.array(
+                [cell.plu, cell.pru, cell.pld, cell.prd], dtype=np.float32
+            )
+            transform = cv2.getPerspectiveTransform(corners, target)
+            rectified = cv2.warpPerspective(
+                image, transform, (_CELL_SIZE, _CELL_SIZE), flags=cv2.INTER_LINEAR
+            )
+            brightness[i, j] = rectified.mean()
+    brightness /= np.maximum(brightness.max(axis=1, keepdims=True), 1.0)
+    values = brightness.flatten()
+    values -= values.mean()
+    bits = _projections(values.size) @ values > 0
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(hash_1, hash_2):
+    return bin(hash_1 ^ hash_2).count("1")
+
+
+@functools.lru_cache(maxsize=8)
+def _projections(size):
+    """Returns the HASH_BITS x size matrix of random hyperplanes.
+
+    Its items are +1 or -1. They are computed with a fixed integer
+    hash function instead of a random generator, so that hashes
+    are stable across versions of NumPy.
+
+    """
+    with np.errstate(over="ignore"):
+        seq = np.arange(HASH_BITS * size, dtype=np.uint64)
+        # splitmix64 finalizer:
+        seq += np.uint64(0x9E3779B97F4A7C15)
+        seq = (seq ^ (seq >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        seq = (seq ^ (seq >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        seq ^= seq >> np.uint64(31)
+    signs = (seq >> np.uint64(63)).astype(np.float64) * 2 - 1
+    return signs.reshape((HASH_BITS, size))
+
+
+class HashIndex:
+    """In-memory index for finding the hashes near a given hash.
+
+    It implements multi-index hashing: each hash is split in
+    _NUM_CHUNKS chunks, and each chunk is indexed in its own table.
+    If two hashes are at distance `max_distance` or less, at least
+    one of their chunks is at distance `max_distance // _NUM_CHUNKS`
+    or less, so the candidates are found by probing, in every table,
+    the chunk values within that distance. The number of probes does
+    not depend on the number of hashes in the index.
+
+    """
+
+    def __init__(self, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._hashes = {}
+        self._tables = [collections.defaultdict(set) for _ in range(_NUM_CHUNKS)]
+        self._masks = _masks(_CHUNK_BITS, max_distance // _NUM_CHUNKS)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, key):
+        return key in self._hashes
+
+    def add(self, key, value):
+        if key in self._hashes:
+            self.remove(key)
+        self._hashes[key] = value
+        for table, chunk in zip(self._tables, _chunks(value)):
+            table[chunk].add(key)
+
+    def remove(self, key):
+        value = self._hashes.pop(key, None)
+        if value is not None:
+            for table, chunk in zip(self._tables, _chunks(value)):
+                table[chunk].discard(key)
+                if not table[chunk]:
+                    del table[chunk]
+
+    def find(self, value):
+        """Returns the (distance, key) pairs of the near hashes, nearest first."""
+        candidates = set()
+        for table, chunk in zip(self._tables, _chunks(value)):
+            for mask in self._masks:
+                keys = table.get(chunk ^ mask)
+                if keys:
+                    candidates.update(keys)
+        near = []
+        for key in candidates:
+            distance = hamming_distance(value, self._hashes[key])
+            if distance <= self.max_distance:
+                near.append((distance, key))
+        return sorted(near)
+
+
+def _chunks(value):
+    mask = (1 << _CHUNK_BITS) - 1
+    return [(value >> (i * _CHUNK_BITS)) & mask for i in range(_NUM_CHUNKS)]
+
+
+def _masks(num_bits, max_bits):
+    """Returns the values of `num_bits` bits with `max_bits` bits set at most."""
+    masks = [0]
+    for _ in range(max_bits):
+        masks = list(
+            set(masks)
+            | {mask | (1 << bit) for mask in masks for bit in range(num_bits)}
+        )
+    return sorted(masks)
@@ -26,7 +26,6 @@ from . import utils
 from . import scoring
 from . import students
 
-
 utils.EyegradeException.register_error(
     "exam-config-parse-error",
     "A parsing error occurred in the exam configuration file.",
@@ -171,7 +170,7 @@ class ExamConfig:
     SCORES_MODE_WEIGHTS = 2
     SCORES_MODE_INDIVIDUAL = 3
 
-    re_model = re.compile("model-[0a-zA-Z]")
+    re_model = re.compile("model-(0|[a-zA-Z]+)$")
 
     def __init__(self, filename=None, capture_pattern=None):
         """Loads data from file if 'filename' is not None. Otherwise,
@@ -402,6 +401,11 @@ class ExamConfig:
     def reset_question_weights(self):
         self.scores = {}
 
+    def extended_models(self):
+        """Tells whether some model needs the extended model encoding."""
+        last_classic = utils.model_sort_key("H")
+        return any(utils.model_sort_key(m) > last_classic for m in self.models)
+
     def all_weights_are_one(self):
         """Return True if all the score weights are 1.
 
@@ -493,7 +497,7 @@ class ExamConfig:
                         "Incorrect key in exam config: " + key,
                         key="exam-config-parse-error",
                     )
-                model = key[-1].upper()
+                model = key[len("model-") :].upper()
                 self.set_solutions(model, value)
                 if has_permutations:
                     key = "permutations-" + model
@@ -545,7 +549,7 @@ class ExamConfig:
             self.survey_mode = exam_data.getboolean("exam", "survey-mode")
         else:
             self.survey_mode = False
-        self.models.sort()
+        self.models.sort(key=utils.model_sort_key)
 
     def save(self, filename):
         data = []
@@ -571,14 +575,14 @@ class ExamConfig:
         if self.solutions:
             data.append("")
             data.append("[solutions]")
-            for model in sorted(self.models):
+            for model in sorted(self.models, key=utils.model_sort_key):
                 data.append(
                     "model-{0}: {1}".format(model, self.format_solutions(model))
                 )
         if self.permutations:
             data.append("")
             data.append("[permutations]")
-            for model in sorted(self.models):
+            for model in sorted(self.models, key=utils.model_sort_key):
                 data.append(
                     "permutations-{0}: {1}".format(
                         model, self.format_permutations(model)
@@ -587,7 +591,7 @@ class ExamConfig:
         if self.variations:
             data.append("")
             data.append("[variations]")
-            for model in sorted(self.models):
+            for model in sorted(self.models, key=utils.model_sort_key):
                 data.append(
                     "variations-{0}: {1}".format(model, self.format_variations(model))
                 )
@@ -599,7 +603,7 @@ class ExamConfig:
             # If all the scores are equal, there is no need to specify weights
             data.append("")
             data.append("[question-score-weights]")
-            for model in sorted(self.models):
+            for model in sorted(self.models, key=utils.model_sort_key):
                 data.append(
                     "weights-{0}: {1}".format(model, self.format_weights(model))
                 )
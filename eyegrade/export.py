@@ -19,8 +19,6 @@
 import csv
 import enum
 
-import openpyxl
-
 from . import utils
 
 
@@ -44,13 +42,21 @@ class XLSXWriter:
         self.file_name = file_name
 
     def __enter__(self):
-        self.workbook = openpyxl.Workbook()
-        self.current_sheet = self.workbook.active
+        import openpyxl
+
+        # In write-only mode rows are streamed to disk as they are
+        # appended instead of being kept in memory until saving:
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.current_sheet = self.workbook.create_sheet()
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
         if traceback is None:
             self.workbook.save(self.file_name)
+        else:
+            # Sheets hold open temporary files while not saved:
+            for sheet in self.workbook.worksheets:
+                sheet.close()
         self.current_sheet = None
         self.workbook = None
 
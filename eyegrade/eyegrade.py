@@ -79,8 +79,9 @@ utils.EyegradeException.register_error(
 
 param_fps = 8
 capture_period = 1.0 / param_fps
-capture_change_period = 1.0
-capture_change_period_failure = 0.3
+capture_change_period = 0.1
+capture_change_period_failure = 0.05
+change_failures_threshold = 2
 after_removal_delay = 1.0
 
 
@@ -98,13 +99,12 @@ class ImageDetectTask:
 class ImageChangeTask:
     """Used for running image change detection in another thread."""
 
-    def __init__(self, detector, reference_image):
-        self.detector = detector
-        self.reference_image = reference_image
+    def __init__(self, change_detector):
+        self.change_detector = change_detector
+        self.exam_present = None
 
     def run(self):
-        self.detector.try_to_detect()
-        self.detector = None
+        self.exam_present = self.change_detector.exam_present()
 
 
 class ManualDetectionManager:
@@ -236,9 +236,13 @@ class ProgramManager:
         self.config = utils.config
         self.sessiondb = None
         self.detection_context = self._get_detection_context()
+        self.quality_gate = self._get_quality_gate()
         self.detection_options = None
         self.drop_next_capture = False
         self.dump_buffer = False
+        self.change_detector = None
+        self.current_change_task = None
+        self.declined_change_detector = None
         self._register_listeners()
         self.from_manual_detection = False
         self.manual_detect_manager = None
@@ -256,6 +260,16 @@ class ProgramManager:
         else:
             return detection.FalseExamDetectorContext(false_detector_session)
 
+    def _get_quality_gate(self):
+        if not self.config["quality-gate"]:
+            return None
+        thresholds = {}
+        if self.config["quality-gate-max-motion"] is not None:
+            thresholds["max_motion"] = self.config["quality-gate-max-motion"]
+        if self.config["quality-gate-min-sharpness"] is not None:
+            thresholds["min_sharpness"] = self.config["quality-gate-min-sharpness"]
+        return detection.FrameQualityGate(**thresholds)
+
     def _try_session_file(self, session_file):
         if os.path.isdir(session_file):
             filename = os.path.join(session_file, "session.eyedb")
@@ -281,8 +295,11 @@ class ProgramManager:
         self.latest_graded_exam = None
         self.latest_detector = None
         self.manual_detect_manager = None
+        self.declined_change_detector = None
         self.interface.register_timer(50, self._next_search)
         self.detection_context.dump_buffer(1.0)
+        if self.quality_gate is not None:
+            self.quality_gate.reset()
         self.next_capture = time.time() + 0.05
 
     def _start_review_mode(self):
@@ -322,6 +339,7 @@ class ProgramManager:
     def _start_auto_change_detection(self):
         if not self.from_manual_detection:
             self.change_failures = 0
+            self.change_detector = None
             self.interface.register_timer(1000, self._next_change_detection)
 
     def _start_manual_detect_mode(self):
@@ -341,8 +359,22 @@ class ProgramManager:
         if self.dump_buffer:
             self.dump_buffer = False
             self.detection_context.dump_buffer(after_removal_delay)
+        if self.declined_change_detector is not None:
+            task = ImageChangeTask(self.declined_change_detector)
+            self.current_change_task = task
+            self.interface.run_worker(task, self._after_declined_change_detection)
+            return
+        image = self.detection_context.capture()
+        if self.quality_gate is not None and not self.quality_gate.check(image):
+            # The frame is moving or blurry: skip the detector
+            self.interface.display_capture(image)
+            self._schedule_next_capture(capture_period, self._next_search)
+            return
         detector = detection.ExamDetector(
-            self.exam_data.dimensions, self.detection_context, self.detection_options
+            self.exam_data.dimensions,
+            self.detection_context,
+            self.detection_options,
+            image_raw=image,
         )
         self.current_detector = detector
         task = ImageDetectTask(detector)
@@ -370,8 +402,21 @@ class ProgramManager:
             self._schedule_next_capture(capture_period, self._next_search)
         elif not self.drop_next_capture:
             exam.draw_answers()
-            self.exam = exam
-            self._start_review_mode()
+            if self._confirm_duplicate(exam):
+                self.exam = exam
+                self._start_review_mode()
+            else:
+                # Do not search again until the sheet is removed
+                self.interface.display_capture(detector.capture.image_drawn)
+                self.declined_change_detector = detection.ExamChangeDetector(
+                    exam.capture,
+                    self.exam_data.dimensions,
+                    self.detection_context,
+                    self.detection_options,
+                )
+                self.change_failures = 0
+                self._schedule_next_capture(after_removal_delay, self._next_search)
+                self.dump_buffer = True
         else:
             # Special mode: do not lock until another capture is
             # available.  Used after auto exam removal detection.
@@ -393,12 +438,17 @@ class ProgramManager:
             or not self.interface.is_action_checked(("tools", "auto_change"))
         ):
             return
-        self.detection_context.dump_buffer(1.0)
-        detector = detection.ExamDetector(
-            self.exam_data.dimensions, self.detection_context, self.detection_options
-        )
-        self.current_detector = detector
-        task = ImageChangeTask(detector, self.exam.capture)
+        if self.change_detector is None:
+            # First check: the camera buffer holds frames from before
+            self.detection_context.dump_buffer(1.0)
+            self.change_detector = detection.ExamChangeDetector(
+                self.exam.capture,
+                self.exam_data.dimensions,
+                self.detection_context,
+                self.detection_options,
+            )
+        task = ImageChangeTask(self.change_detector)
+        self.current_change_task = task
         self.interface.run_worker(task, self._after_change_detection)
 
     def _after_change_detection(self):
@@ -408,9 +458,9 @@ class ProgramManager:
         whether the exam has been removed.
 
         """
-        image = self.current_detector
-        self.current_detector = None
-        if image is None:
+        task = self.current_change_task
+        self.current_change_task = None
+        if task is None:
             # This needs to be investigated: this case should never
             # happen, but I saw it happen...
             return
@@ -420,13 +470,13 @@ class ProgramManager:
         ):
             return
         exam_removed = False
-        if image.try_to_detect:
+        if task.exam_present:
             period = capture_change_period
             self.change_failures = 0
         else:
             period = capture_change_period_failure
             self.change_failures += 1
-            if self.change_failures >= 4:
+            if self.change_failures >= change_failures_threshold:
                 exam_removed = True
         if not exam_removed:
             self._schedule_next_capture(period, self._next_change_detection)
@@ -435,6 +485,28 @@ class ProgramManager:
             self.drop_next_capture = True
             self._action_continue()
 
+    def _after_declined_change_detection(self):
+        """Continuation of `_next_search` while a declined sheet is present.
+
+        The search for exams is resumed when the sheet that the user
+        declined to save (see `_confirm_duplicate`) is removed.
+
+        """
+        task = self.current_change_task
+        self.current_change_task = None
+        if task is None or not self.mode.in_search():
+            return
+        if task.exam_present:
+            period = capture_change_period
+            self.change_failures = 0
+        else:
+            period = capture_change_period_failure
+            self.change_failures += 1
+            if self.change_failures >= change_failures_threshold:
+                self.declined_change_detector = None
+                period = capture_period
+        self._schedule_next_capture(period, self._next_search)
+
     def _schedule_next_capture(self, period, function):
         """Schedules the next image capture and registers the timer.
 
@@ -481,6 +553,25 @@ class ProgramManager:
                     self.interface.show_error(msg)
         return exam
 
+    def _confirm_duplicate(self, exam):
+        """Asks before saving an exam that looks already graded.
+
+        Returns True if the exam has to be saved.
+
+        """
+        duplicates = self.sessiondb.find_duplicates(
+            exam.capture, student=exam.decisions.student
+        )
+        if not duplicates:
+            return True
+        return self.interface.show_warning(
+            _(
+                "This sheet looks like the one of exam {0}, which has already "
+                "been graded. Do you want to save it anyway?"
+            ).format(", ".join(str(exam_id) for exam_id in duplicates)),
+            is_question=True,
+        )
+
     def _new_session(self):
         """Callback for when the new session action is selected."""
         values = self.interface.dialog_new_session()
@@ -750,6 +841,9 @@ class ProgramManager:
             self.detection_options["show-status"] = self.interface.is_action_checked(
                 ("tools", "show_status")
             )
+            self.detection_options["show-timing"] = self.interface.is_action_checked(
+                ("tools", "show_timing")
+            )
 
     def _action_auto_change_changed(self):
         """Callback for the checkable 'auto_change' option."""
@@ -872,7 +966,9 @@ class ProgramManager:
         self.detection_options = detection.ExamDetector.get_default_options()
         if self.exam_data.survey_mode:
             self.detection_options["infobits"] = False
+        self.detection_options["extended-models"] = exam_data.extended_models()
         self.detection_options["error-logging"] = self.config["error-logging"]
+        self.detection_options["timing-log"] = self.config["timing-log"]
         if exam_data.id_num_digits and exam_data.id_num_digits > 0:
             self.detection_options["read-id"] = True
             self.detection_options["id-num-digits"] = exam_data.id_num_digits
@@ -937,6 +1033,7 @@ class ProgramManager:
             ("actions", "tools", "lines"): self._action_debug_changed,
             ("actions", "tools", "processed"): self._action_debug_changed,
             ("actions", "tools", "show_status"): self._action_debug_changed,
+            ("actions", "tools", "show_timing"): self._action_debug_changed,
             ("actions", "tools", "auto_change"): self._action_auto_change_changed,
             ("actions", "exams", "export"): self._action_export_grades,
             ("actions", "exams", "students"): self._action_students,
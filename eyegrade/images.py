@@ -98,7 +98,9 @@ def draw_point(image, point, color=(255, 0, 0, 0), radius=2):
         print("draw_point: bad point (%d, %d)" % (x, y))
 
 
-def draw_text(image, text, color=(255, 0, 0), position=(10, 30)):
+def draw_text(
+    image, text, color=(255, 0, 0), position=(10, 30), scale=1.0, thickness=3
+):
     cv2.putText(
-        image, text, position, cv2.FONT_HERSHEY_SIMPLEX, 1.0, color, thickness=3
+        image, text, position, cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness
     )
@@ -0,0 +1,185 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Item analysis of the exams of a session.
+#
+# Statistics are computed from aggregates of the graded exams: for each
+# model, the number of exams and the sum and sum of squares of their
+# scores, and for each question and choice (0 for blank answers) of
+# each model, the number of exams with that answer and the sum of their
+# scores. These aggregates are maintained incrementally by the session
+# database (see SessionDB.read_item_analysis), and are mapped here to the
+# original order of questions and choices through the permutations of
+# each model.
+#
+import math
+
+
+class QuestionStatistics:
+    """Statistics of a question in its original order.
+
+    `choice_counts[c]` is the number of exams that answered choice
+    `c` (1 for the first choice) and `choice_counts[0]` the number of
+    exams with the question blank. `choice_score_sums` holds the sum
+    of the scores of those exams.
+
+    """
+
+    def __init__(self, question, num_choices):
+        self.question = question
+        self.choice_counts = [0] * (num_choices + 1)
+        self.choice_scored = [0] * (num_choices + 1)
+        self.choice_score_sums = [0.0] * (num_choices + 1)
+        self.num_graded = 0
+        self.num_correct = 0
+        self.num_scored = 0
+        self.num_scored_correct = 0
+        self.score_sum_correct = 0.0
+
+    @property
+    def num_exams(self):
+        return sum(self.choice_counts)
+
+    @property
+    def num_blank(self):
+        return self.choice_counts[0]
+
+    def choice_distribution(self):
+        """Returns the fraction of exams that answered each choice.
+
+        The first item is the fraction of blank answers.
+
+        """
+        num_exams = self.num_exams
+        if not num_exams:
+            return [None] * len(self.choice_counts)
+        return [count / num_exams for count in self.choice_counts]
+
+    def choice_mean_scores(self):
+        """Returns the mean score of the exams that answered each choice."""
+        return [
+            score_sum / scored if scored else None
+            for score_sum, scored in zip(self.choice_score_sums, self.choice_scored)
+        ]
+
+
+class ItemAnalysis:
+    """Difficulty and discrimination of the questions of a session.
+
+    The difficulty index of a question is the fraction of exams that
+    answered it correctly. Its discrimination index is the
+    point-biserial correlation between answering it correctly and the
+    score of the exam.
+
+    """
+
+    def __init__(self, exam_config):
+        self.exam_config = exam_config
+        self.num_exams = 0
+        self.num_scored = 0
+        self.score_sum = 0.0
+        self.score_sq_sum = 0.0
+        self.questions = [
+            QuestionStatistics(i, num_choices)
+            for i, num_choices in enumerate(exam_config.num_options)
+        ]
+
+    def add_scores(self, model, num_exams, num_scored, score_sum, score_sq_sum):
+        """Adds the aggregated scores of the exams of a model."""
+        self.num_exams += num_exams
+        self.num_scored += num_scored
+        self.score_sum += score_sum
+        self.score_sq_sum += score_sq_sum
+
+    def add_answers(self, model, question, answer, num_exams, num_scored, score_sum):
+        """Adds the exams of a model that answered a question with a choice.
+
+        `question` and `answer` are in the order of the model, and are
+        mapped to their original order.
+
+        """
+        original_question, original_answer = self._unpermute(model, question, answer)
+        stats = self.questions[original_question]
+        if original_answer >= len(stats.choice_counts):
+            return
+        stats.choice_counts[original_answer] += num_exams
+        stats.choice_scored[original_answer] += num_scored
+        stats.choice_score_sums[original_answer] += score_sum
+        solutions = self._solutions(model)
+        if solutions and solutions[question] is not None:
+            stats.num_graded += num_exams
+            stats.num_scored += num_scored
+            if answer in solutions[question]:
+                stats.num_correct += num_exams
+                stats.num_scored_correct += num_scored
+                stats.score_sum_correct += score_sum
+
+    @property
+    def mean_score(self):
+        if not self.num_scored:
+            return None
+        return self.score_sum / self.num_scored
+
+    @property
+    def score_std(self):
+        """Population standard deviation of the scores."""
+        if not self.num_scored:
+            return None
+        mean = self.score_sum / self.num_scored
+        return math.sqrt(max(0.0, self.score_sq_sum / self.num_scored - mean * mean))
+
+    def difficulty(self, question):
+        stats = self.questions[question]
+        if not stats.num_graded:
+            return None
+        return stats.num_correct / stats.num_graded
+
+    def discrimination(self, question):
+        """Point-biserial correlation of the question with the scores.
+
+        Returns None when it is undefined (no scores, all the exams
+        with the same score or everybody / nobody answering correctly)
+        or when some scored exams have no solution for the question.
+
+        """
+        stats = self.questions[question]
+        num = stats.num_scored
+        num_correct = stats.num_scored_correct
+        if not num or num_correct in (0, num) or num != self.num_scored:
+            return None
+        std = self.score_std
+        if std < 1e-9:
+            return None
+        mean_correct = stats.score_sum_correct / num_correct
+        mean_other = (self.score_sum - stats.score_sum_correct) / (num - num_correct)
+        p = num_correct / num
+        return (mean_correct - mean_other) / std * math.sqrt(p * (1 - p))
+
+    def _unpermute(self, model, question, answer):
+        permutations = self.exam_config.get_permutations(model)
+        if not permutations:
+            return question, answer
+        original_question, choices = permutations[question]
+        if answer > 0:
+            answer = choices[answer - 1]
+        return original_question - 1, answer
+
+    def _solutions(self, model):
+        if model is None:
+            return None
+        return self.exam_config.get_solutions(model)
@@ -0,0 +1,542 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Merging of sessions graded in parallel (e.g. in several rooms) into
+# a single session.
+#
+# The database of each source session is attached to the connection of
+# the target session, and its exams are copied with set-based
+# INSERT ... SELECT statements, with their exam ids shifted past the
+# last exam of the target. Students are matched by their student id;
+# the students not found in the target are added to it. The exams of
+# each source are copied in a single transaction, and verified before
+# committing it. Then, the captures of the exams are hard linked (or
+# copied, when linking is not possible) in parallel.
+#
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import collections
+import concurrent.futures
+
+from . import utils
+from . import students
+from . import sessiondb
+
+# Tables whose rows belong to an exam. They are copied with the exam
+# id shifted.
+_EXAM_TABLES = ("Answers", "AnswerCells", "IdCells", "ExamHashes")
+
+# Columns of the Session table that must be equal in all the sessions
+_SESSION_COLUMNS = (
+    "dimensions",
+    "grading_mode",
+    "scores_mode",
+    "base_score_correct",
+    "base_score_incorrect",
+    "base_score_blank",
+    "id_num_digits",
+    "survey_mode",
+    "left_to_right_numbering",
+)
+
+# Tables that, in addition to Session, must be equal in all the sessions
+_CONFIG_TABLES = ("Questions", "Solutions")
+
+
+class SourceReport:
+    """What has been merged from a source session.
+
+    `tables` maps the name of each table to the number of rows of the
+    source and the number of rows copied to the target. `captures`
+    counts the capture files by outcome: "linked", "copied",
+    "missing" (in the source), "exists" (in the target, so that it is
+    not overwritten) and "found" (in dry runs).
+
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.num_exams = 0
+        self.exam_ids = None
+        self.offset = 0
+        self.tables = collections.OrderedDict()
+        self.score_sums = (0.0, 0.0)
+        self.students_matched = 0
+        self.students_added = 0
+        self.processed_files = 0
+        self.foreign_key_errors = 0
+        self.captures = collections.Counter()
+
+    @property
+    def consistent(self):
+        """True if every row has been copied and checked."""
+        return (
+            all(source == copied for source, copied in self.tables.values())
+            and abs(self.score_sums[0] - self.score_sums[1]) < 1e-6
+            and not self.foreign_key_errors
+            and not self.captures["exists"]
+        )
+
+    def format(self):
+        lines = [self.source]
+        if self.exam_ids is not None:
+            first, last = self.exam_ids
+            lines.append(
+                "  exam ids {}-{}: {}-{} in the target".format(
+                    first, last, first + self.offset, last + self.offset
+                )
+            )
+        for table, (source, copied) in self.tables.items():
+            mark = "" if source == copied else "  MISMATCH"
+            lines.append("  {}: {} of {} rows{}".format(table, copied, source, mark))
+        lines.append(
+            "  score sum: {:.4f} of {:.4f}".format(
+                self.score_sums[1], self.score_sums[0]
+            )
+        )
+        lines.append(
+            "  students: {} matched, {} added".format(
+                self.students_matched, self.students_added
+            )
+        )
+        if self.processed_files:
+            lines.append("  processed files: {}".format(self.processed_files))
+        if self.foreign_key_errors:
+            lines.append("  foreign key errors: {}".format(self.foreign_key_errors))
+        lines.append(
+            "  captures: "
+            + ", ".join(
+                "{} {}".format(count, outcome)
+                for outcome, count in sorted(self.captures.items())
+            )
+        )
+        return "\n".join(lines)
+
+
+class SessionMerger:
+    """Merges source sessions into a target session.
+
+    With `dry_run`, everything is done and verified, but the
+    transactions are rolled back and no capture is linked or copied.
+
+    """
+
+    def __init__(self, target, jobs=4, dry_run=False):
+        self.session = sessiondb.SessionDB(target)
+        self.jobs = jobs
+        self.dry_run = dry_run
+        self._next_exam_id = self.session.next_exam_id()
+        cursor = self.session.conn.cursor()
+        cursor.execute(sessiondb.SessionDB._table_exam_hashes)
+        cursor.execute(sessiondb.SessionDB._index_exam_hashes)
+        cursor.execute(sessiondb.SessionDB._table_processed_files)
+        self.session.conn.commit()
+
+    def close(self):
+        self.session.close()
+
+    def check(self, source):
+        """Raises EyegradeException if `source` cannot be merged.
+
+        The source must have the schema version of the target, and the
+        same exam configuration (dimensions, solutions, permutations
+        and scores).
+
+        """
+        source_dir, db_file = self._open_source(source)
+        with self._attached(db_file):
+            cursor = self.session.conn.cursor()
+            cursor.execute("SELECT db_schema_version FROM src.Session")
+            if cursor.fetchone()[0] != self.session.schema_version:
+                raise utils.EyegradeException(
+                    "The schema version of {} differs from the one of the "
+                    "target session".format(source)
+                )
+            differences = []
+            columns = ", ".join(_SESSION_COLUMNS)
+            if self._differ(cursor, "Session", columns):
+                differences.append("exam configuration")
+            for table in _CONFIG_TABLES:
+                if self._differ(cursor, table, "*"):
+                    differences.append(table.lower())
+            if differences:
+                raise utils.EyegradeException(
+                    "Incompatible session {}: different {}".format(
+                        source, ", ".join(differences)
+                    )
+                )
+        return source_dir
+
+    def merge(self, source):
+        """Merges a source session. Returns its SourceReport."""
+        source_dir = self.check(source)
+        report = SourceReport(source)
+        with self._attached(os.path.join(source_dir, "session.eyedb")):
+            conn = self.session.conn
+            cursor = conn.cursor()
+            try:
+                captures = self._copy_exams(cursor, report)
+                if report.consistent and not self.dry_run:
+                    conn.commit()
+            finally:
+                conn.rollback()
+        if report.exam_ids is not None and report.consistent:
+            first, last = report.exam_ids
+            self._next_exam_id += last - first + 1
+            self._copy_captures(source_dir, captures, report)
+        return report
+
+    def _copy_exams(self, cursor, report):
+        cursor.execute("SELECT MIN(exam_id), MAX(exam_id), TOTAL(score) FROM src.Exams")
+        first, last, score_sum = cursor.fetchone()
+        if first is None:
+            return []
+        offset = self._next_exam_id - first
+        report.exam_ids = (first, last)
+        report.offset = offset
+        self._map_students(cursor, report)
+        cursor.execute(
+            "INSERT INTO main.Exams "
+            "(exam_id, student, model, correct, incorrect, blank, score) "
+            "SELECT e.exam_id + ?, m.db_id, e.model, e.correct, e.incorrect, "
+            "e.blank, e.score "
+            "FROM src.Exams e LEFT JOIN temp.StudentMap m ON e.student = m.source_id",
+            (offset,),
+        )
+        tables = ("Exams",) + tuple(
+            table for table in _EXAM_TABLES if self._source_has_table(cursor, table)
+        )
+        for table in tables[1:]:
+            self._copy_table(cursor, table, offset)
+        for table in tables:
+            cursor.execute("SELECT COUNT(*) FROM src.{}".format(table))
+            source_rows = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT COUNT(*) FROM main.{} WHERE exam_id BETWEEN ? AND ?".format(
+                    table
+                ),
+                (first + offset, last + offset),
+            )
+            report.tables[table] = (source_rows, cursor.fetchone()[0])
+        report.num_exams = report.tables["Exams"][1]
+        cursor.execute(
+            "SELECT TOTAL(score) FROM main.Exams WHERE exam_id BETWEEN ? AND ?",
+            (first + offset, last + offset),
+        )
+        report.score_sums = (score_sum, cursor.fetchone()[0])
+        if self._source_has_table(cursor, "ProcessedFiles"):
+            report.processed_files = self._copy_table(
+                cursor, "ProcessedFiles", offset, or_ignore=True
+            )
+        cursor.execute("PRAGMA main.foreign_key_check")
+        report.foreign_key_errors = len(cursor.fetchall())
+        self.session.rebuild_item_stats(commit=False)
+        cursor.execute("SELECT capture_pattern FROM src.Session")
+        pattern = cursor.fetchone()[0]
+        target_pattern = self.session.exam_config.capture_pattern
+        captures = []
+        for exam_id, student_id in cursor.execute(
+            "SELECT e.exam_id, s.student_id FROM src.Exams e "
+            "LEFT JOIN src.Students s ON e.student = s.db_id"
+        ).fetchall():
+            if student_id is not None:
+                student = students.Student(student_id, None, None, None, None)
+            else:
+                student = None
+            captures.append(
+                (
+                    os.path.join("internal", "raw-{}.png".format(exam_id)),
+                    os.path.join("internal", "raw-{}.png".format(exam_id + offset)),
+                )
+            )
+            captures.append(
+                (
+                    os.path.join(
+                        "captures", utils.capture_name(pattern, exam_id, student)
+                    ),
+                    os.path.join(
+                        "captures",
+                        utils.capture_name(target_pattern, exam_id + offset, student),
+                    ),
+                )
+            )
+        return captures
+
+    def _map_students(self, cursor, report):
+        """Maps the students of the exams of the source to the target.
+
+        Students are matched by student id, or by name and email
+        when they have no student id. The rest are added to the target.
+
+        """
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS StudentMap ("
+            "source_id INTEGER PRIMARY KEY NOT NULL, db_id INTEGER NOT NULL)"
+        )
+        cursor.execute("DELETE FROM temp.StudentMap")
+        cursor.execute(
+            "INSERT OR IGNORE INTO temp.StudentMap "
+            "SELECT s.db_id, t.db_id FROM src.Students s "
+            "JOIN main.Students t ON s.student_id = t.student_id "
+            "WHERE s.db_id IN (SELECT student FROM src.Exams)"
+        )
+        cursor.execute(
+            "INSERT OR IGNORE INTO temp.StudentMap "
+            "SELECT s.db_id, t.db_id FROM src.Students s "
+            "JOIN main.Students t ON s.student_id IS NULL "
+            "AND t.student_id IS NULL AND s.full_name IS t.full_name "
+            "AND s.first_name IS t.first_name AND s.last_name IS t.last_name "
+            "AND s.email IS t.email "
+            "WHERE s.db_id IN (SELECT student FROM src.Exams)"
+        )
+        cursor.execute("SELECT COUNT(*) FROM temp.StudentMap")
+        report.students_matched = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT * FROM src.Students "
+            "WHERE db_id IN (SELECT student FROM src.Exams) "
+            "AND db_id NOT IN (SELECT source_id FROM temp.StudentMap)"
+        )
+        for row in cursor.fetchall():
+            cursor.execute(
+                "INSERT OR IGNORE INTO main.StudentGroups "
+                "SELECT * FROM src.StudentGroups WHERE group_id = ?",
+                (row["group_id"],),
+            )
+            cursor.execute(
+                "INSERT INTO main.Students "
+                "(student_id, full_name, first_name, last_name, email, "
+                "group_id, sequence_num) "
+                "SELECT ?, ?, ?, ?, ?, ?, COALESCE(MAX(sequence_num), 0) + 1 "
+                "FROM main.Students WHERE group_id = ?",
+                (
+                    row["student_id"],
+                    row["full_name"],
+                    row["first_name"],
+                    row["last_name"],
+                    row["email"],
+                    row["group_id"],
+                    row["group_id"],
+                ),
+            )
+            cursor.execute(
+                "INSERT INTO temp.StudentMap VALUES (?, ?)",
+                (row["db_id"], cursor.lastrowid),
+            )
+            report.students_added += 1
+
+    def _copy_table(self, cursor, table, offset, or_ignore=False):
+        """Copies the rows of a table with their exam ids shifted.
+
+        Returns the number of rows inserted.
+
+        """
+        cursor.execute("PRAGMA main.table_info({})".format(table))
+        columns = [row["name"] for row in cursor.fetchall()]
+        cursor.execute(
+            "INSERT {} INTO main.{} ({}) SELECT {} FROM src.{}".format(
+                "OR IGNORE" if or_ignore else "",
+                table,
+                ", ".join(columns),
+                ", ".join(
+                    "exam_id + ?" if column == "exam_id" else column
+                    for column in columns
+                ),
+                table,
+            ),
+            (offset,),
+        )
+        return cursor.rowcount
+
+    def _copy_captures(self, source_dir, captures, report):
+        target_dir = self.session.session_dir
+        pairs = [
+            (os.path.join(source_dir, source), os.path.join(target_dir, target))
+            for source, target in captures
+        ]
+        if self.dry_run:
+            for source, _ in pairs:
+                report.captures["found" if os.path.exists(source) else "missing"] += 1
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.jobs
+            ) as executor:
+                report.captures.update(executor.map(_link_or_copy, *zip(*pairs)))
+
+    def _open_source(self, source):
+        session = sessiondb.SessionDB(source)
+        source_dir = session.session_dir
+        session.close()
+        if os.path.samefile(source_dir, self.session.session_dir):
+            raise utils.EyegradeException(
+                "The source session is the target session: {}".format(source)
+            )
+        return source_dir, os.path.join(source_dir, "session.eyedb")
+
+    def _attached(self, db_file):
+        return _AttachedDatabase(self.session.conn, db_file)
+
+    @staticmethod
+    def _differ(cursor, table, columns):
+        for first, second in (("main", "src"), ("src", "main")):
+            cursor.execute(
+                "SELECT COUNT(*) FROM ("
+                "SELECT {0} FROM {1}.{3} EXCEPT SELECT {0} FROM {2}.{3})".format(
+                    columns, first, second, table
+                )
+            )
+            if cursor.fetchone()[0]:
+                return True
+        return False
+
+    @staticmethod
+    def _source_has_table(cursor, table):
+        cursor.execute(
+            "SELECT COUNT(*) FROM src.sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+        )
+        return cursor.fetchone()[0] > 0
+
+
+class _AttachedDatabase:
+    """Context manager that attaches a database as "src"."""
+
+    def __init__(self, conn, db_file):
+        self.conn = conn
+        self.db_file = db_file
+
+    def __enter__(self):
+        # ATTACH is not allowed within a transaction
+        self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS src", (self.db_file,))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.conn.rollback()
+        self.conn.execute("DETACH DATABASE src")
+        return False
+
+
+def _link_or_copy(source, target):
+    if not os.path.exists(source):
+        return "missing"
+    if os.path.exists(target):
+        return "exists"
+    try:
+        os.link(source, target)
+        return "linked"
+    except OSError:
+        shutil.copy2(source, target)
+        return "copied"
+
+
+def create_target(target, source):
+    """Creates a target session with the configuration of `source`.
+
+    The students of the source are copied as well.
+
+    """
+    session = sessiondb.SessionDB(source)
+    try:
+        sessiondb.create_session_directory(
+            target, session.exam_config, session.student_listings
+        )
+    finally:
+        session.close()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Merge the exams of several sessions into one session."
+    )
+    parser.add_argument(
+        "target",
+        help="session directory to merge into; if it does not exist, "
+        "it is created with the configuration of the first source",
+    )
+    parser.add_argument("sources", nargs="+", help="session directories to merge")
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="check and report the merge without changing anything",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help="number of captures linked or copied in parallel",
+    )
+    return parser.parse_args()
+
+
+def _print_reports(reports, dry_run):
+    """Prints the reports. Returns True if all of them are consistent."""
+    for report in reports:
+        print(report.format())
+    consistent = all(report.consistent for report in reports)
+    print(
+        "{}: {} exams from {} sessions{}".format(
+            "Dry run" if dry_run else "Merged",
+            sum(report.num_exams for report in reports),
+            len(reports),
+            "" if consistent else "; VERIFICATION FAILED",
+        )
+    )
+    return consistent
+
+
+def main():
+    args = _parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target = args.target
+        created = not os.path.exists(target)
+        try:
+            if created:
+                if args.dry_run:
+                    target = os.path.join(temp_dir, "session")
+                create_target(target, args.sources[0])
+            merger = SessionMerger(target, jobs=args.jobs, dry_run=args.dry_run)
+        except utils.EyegradeException as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        try:
+            for source in args.sources:
+                merger.check(source)
+        except utils.EyegradeException as e:
+            merger.close()
+            if created:
+                shutil.rmtree(target)
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        try:
+            reports = [merger.merge(source) for source in args.sources]
+        except utils.EyegradeException as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        finally:
+            merger.close()
+    if not _print_reports(reports, args.dry_run):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
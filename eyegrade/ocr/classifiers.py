@@ -17,11 +17,13 @@
 #
 import json
 import os
+from typing import Dict, Optional
 
 import cv2
 import numpy as np
 
 from . import preprocessing
+from . import features
 from .. import utils
 
 DEFAULT_DIG_CLASS_FILE = "digit_classifier.dat.gz"
@@ -32,9 +34,15 @@ DEFAULT_DIR = "svm"
 
 
 class SVMClassifier:
+    # Parameters (C and gamma of the RBF kernel) used when training
+    # without explicit parameters. None means choosing them with
+    # the internal cross-validation of `trainAuto`.
+    default_params: Optional[Dict[str, float]] = None
+
     def __init__(self, num_classes, features_extractor, load_from_file=None):
         self.num_classes = num_classes
         self.features_extractor = features_extractor
+        self.feature_store = None
         if not load_from_file:
             self.svm = cv2.ml.SVM_create()
         else:
@@ -44,13 +52,31 @@ class SVMClassifier:
     def features_len(self):
         return self.features_extractor.features_len
 
-    def train(self, samples, params=None):
-        features = np.ndarray(shape=(len(samples), self.features_len), dtype="float32")
-        labels = np.ndarray(shape=(len(samples), 1), dtype="int32")
+    def use_feature_store(self, directory):
+        """Cache the features of the samples in the given directory.
+
+        From now on, features of samples loaded from files are
+        extracted once and reused in later training and classification
+        calls, also across runs.
+
+        """
+        self.feature_store = features.FeatureStore(directory, self.features_extractor)
+
+    def features(self, samples):
+        """Returns the matrix of feature vectors of the given samples."""
+        if self.feature_store is not None:
+            return self.feature_store.features(samples)
+        matrix = np.ndarray(shape=(len(samples), self.features_len), dtype="float32")
         for i, sample in enumerate(samples):
-            features[i, :] = self.features_extractor.extract(sample)
-            labels[i] = sample.label
-        self.svm.trainAuto(features, cv2.ml.ROW_SAMPLE, labels)
+            matrix[i, :] = self.features_extractor.extract(sample)
+        return matrix
+
+    def train(self, samples, params=None):
+        if params is None:
+            params = self.default_params
+        matrix = self.features(samples)
+        labels = np.array([sample.label for sample in samples], dtype="int32")
+        self.svm = train_svm(matrix, labels, params)
 
     def classify(self, sample):
         features = np.ndarray(shape=(1, self.features_len), dtype="float32")
@@ -58,6 +84,13 @@ class SVMClassifier:
         retval, prediction = self.svm.predict(features)
         return int(prediction[0, 0])
 
+    def classify_samples(self, samples):
+        """Classifies a list of samples at once and returns their labels."""
+        if not samples:
+            return []
+        retval, predictions = self.svm.predict(self.features(samples))
+        return [int(label) for label in predictions[:, 0]]
+
     def reset(self):
         self.svm = cv2.ml.SVM_create()
 
@@ -93,6 +126,8 @@ class SVMDigitClassifier(SVMClassifier):
 
 
 class DefaultDigitClassifier(SVMDigitClassifier):
+    default_params = dict(C=3.16227766, gamma=0.01)
+
     def __init__(
         self,
         load_from_file=DEFAULT_DIG_CLASS_FILE,
@@ -104,9 +139,6 @@ class DefaultDigitClassifier(SVMDigitClassifier):
             confusion_matrix_from_file=confusion_matrix_from_file,
         )
 
-    def train(self, samples, params=None):
-        super().train(samples, dict(C=3.16227766, gamma=0.01))
-
 
 class SVMCrossesClassifier(SVMClassifier):
     def __init__(self, features_extractor, load_from_file=None):
@@ -117,10 +149,29 @@ class SVMCrossesClassifier(SVMClassifier):
 
 
 class DefaultCrossesClassifier(SVMCrossesClassifier):
+    default_params = dict(C=100, gamma=0.01)
+
     def __init__(self, load_from_file=DEFAULT_CROSS_CLASS_FILE):
         super().__init__(
             preprocessing.CrossesFeatureExtractor(), load_from_file=load_from_file
         )
 
-    def train(self, samples, params=None):
-        super().train(samples, dict(C=100, gamma=0.01))
+
+def train_svm(features, labels, params=None):
+    """Returns a new SVM trained with the given features and labels.
+
+    `params` is a dictionary with the values of C and gamma of the
+    RBF kernel. If it is None, they are chosen by `trainAuto`.
+
+    """
+    svm = cv2.ml.SVM_create()
+    labels = np.asarray(labels, dtype="int32").reshape(-1, 1)
+    if params is None:
+        svm.trainAuto(features, cv2.ml.ROW_SAMPLE, labels)
+    else:
+        svm.setType(cv2.ml.SVM_C_SVC)
+        svm.setKernel(cv2.ml.SVM_RBF)
+        svm.setC(params["C"])
+        svm.setGamma(params["gamma"])
+        svm.train(features, cv2.ml.ROW_SAMPLE, labels)
+    return svm
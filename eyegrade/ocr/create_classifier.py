@@ -19,6 +19,7 @@ import json
 import argparse
 
 from . import sample
+from . import dataset
 from . import classifiers
 from . import evaluation
 
@@ -28,10 +29,13 @@ def save_metadata(filename, metadata):
         json.dump(metadata, f, indent=4, sort_keys=True)
 
 
-def k_fold_cross_evaluation(classifier, sample_set, rounds):
+def k_fold_cross_evaluation(classifier, sample_set, rounds, num_workers=1):
     classifier.reset()
     partitions = sample_set.partition(rounds)
-    e = evaluation.KFoldCrossEvaluation(classifier, partitions)
+    with evaluation.FoldEvaluator(
+        classifier, partitions, num_workers=num_workers
+    ) as evaluator:
+        e = evaluation.KFoldCrossEvaluation(classifier, partitions, evaluator=evaluator)
     return e
 
 
@@ -40,11 +44,13 @@ def train_with_all(classifier, sample_set):
     classifier.train(sample_set.samples())
 
 
-def create_digit_classifier(sample_set, rounds):
+def create_digit_classifier(sample_set, rounds, features_cache=None, num_workers=1):
     classifier = classifiers.DefaultDigitClassifier(
         load_from_file=None, confusion_matrix_from_file=None
     )
-    e = k_fold_cross_evaluation(classifier, sample_set, rounds)
+    if features_cache:
+        classifier.use_feature_store(features_cache)
+    e = k_fold_cross_evaluation(classifier, sample_set, rounds, num_workers)
     metadata = {
         "performance": {
             "success_rate": e.success_rate,
@@ -64,9 +70,11 @@ def create_digit_classifier(sample_set, rounds):
     classifier.save(classifiers.DEFAULT_DIG_CLASS_FILE)
 
 
-def create_crosses_classifier(sample_set, rounds):
+def create_crosses_classifier(sample_set, rounds, features_cache=None, num_workers=1):
     classifier = classifiers.DefaultCrossesClassifier(load_from_file=None)
-    e = k_fold_cross_evaluation(classifier, sample_set, rounds)
+    if features_cache:
+        classifier.use_feature_store(features_cache)
+    e = k_fold_cross_evaluation(classifier, sample_set, rounds, num_workers)
     print(
         "Success rate: {} (balanced: {})".format(
             e.success_rate, e.success_rate_balanced
@@ -97,7 +105,7 @@ def _parse_args():
         "sample_files",
         metavar="sample file",
         nargs="+",
-        help="index file with the samples for training/evaluation",
+        help="index file or packed dataset with the samples for training/evaluation",
     )
     parser.add_argument(
         "--rounds",
@@ -105,6 +113,20 @@ def _parse_args():
         default=10,
         help="number of rounds for k-fold cross evaluation (default 100)",
     )
+    parser.add_argument(
+        "--features-cache",
+        metavar="DIR",
+        default=None,
+        help="directory in which extracted features are cached across runs",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes for the evaluation"
+        " (default 1, 0 for one per CPU)",
+    )
     return parser.parse_args()
 
 
@@ -114,13 +136,15 @@ def main():
     # Load the sample set:
     sample_set = sample.SampleSet()
     for filename in args.sample_files:
-        sample_set.load_from_loader(sample.SampleLoader(filename))
+        sample_set.load_from_loader(dataset.open_loader(filename))
 
     # Perform a k-fold cross-evaluation and create the classifier:
     if args.classifier == "digits":
-        create_digit_classifier(sample_set, args.rounds)
+        create_digit_classifier(sample_set, args.rounds, args.features_cache, args.jobs)
     else:
-        create_crosses_classifier(sample_set, args.rounds)
+        create_crosses_classifier(
+            sample_set, args.rounds, args.features_cache, args.jobs
+        )
 
 
 if __name__ == "__main__":
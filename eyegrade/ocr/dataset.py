@@ -0,0 +1,266 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Packed datasets of OCR samples.
+#
+# A dataset is a shard file or a directory of shard files. Shards
+# are uncompressed .npz files with the following arrays:
+#
+# - pixels: the pre-cropped uint8 images of all the samples of the
+#           shard, flattened and concatenated.
+# - offsets: (N,) position of the image of each sample in `pixels`.
+# - shapes: (N, 2) height and width of the image of each sample.
+# - corners: (N, 4, 2) corners of each sample within its image.
+# - labels: (N,) label of each sample, or -1 for unlabelled samples.
+# - version: version of the format.
+#
+# The `pixels` array is memory-mapped when a shard is loaded.
+#
+import os
+import glob
+import zipfile
+import argparse
+
+import numpy as np
+
+from . import sample
+
+FORMAT_VERSION = 1
+DEFAULT_SHARD_SIZE = 50000
+SHARD_EXTENSION = ".npz"
+
+
+class PackedSample(sample.Sample):
+    """Sample whose image is stored in a shard of a packed dataset."""
+
+    def __init__(self, corners, image, label, shard_file, index):
+        super().__init__(corners, image=image, label=label)
+        self.shard_file = shard_file
+        self.index = index
+
+    @property
+    def source(self):
+        return (self.shard_file, self.index)
+
+
+class Shard:
+    def __init__(self, filename):
+        self.filename = filename
+        with np.load(filename) as data:
+            version = int(data["version"])
+            if version != FORMAT_VERSION:
+                raise ValueError(
+                    "Unsupported dataset format version {} in {}".format(
+                        version, filename
+                    )
+                )
+            self.offsets = data["offsets"]
+            self.shapes = data["shapes"]
+            self.corners = data["corners"]
+            self.labels = data["labels"]
+        self.pixels = _load_npz_member(filename, "pixels")
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sample(i)
+
+    def sample(self, i):
+        height, width = self.shapes[i]
+        start = self.offsets[i]
+        image = self.pixels[start : start + height * width].reshape(height, width)
+        label = int(self.labels[i])
+        return PackedSample(
+            self.corners[i],
+            image,
+            label if label >= 0 else None,
+            self.filename,
+            i,
+        )
+
+
+class PackedSampleLoader:
+    """Loads the samples of a packed dataset.
+
+    `path` is either a shard file or a directory with shard files,
+    which are loaded in alphabetical order. It can be used instead of
+    `sample.SampleLoader`.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path):
+            self.shard_files = sorted(
+                glob.glob(os.path.join(path, "*" + SHARD_EXTENSION))
+            )
+        else:
+            self.shard_files = [path]
+
+    def samples(self):
+        return [sample for sample in self.iterate_samples()]
+
+    def iterate_samples(self):
+        for shard_file in self.shard_files:
+            for samp in Shard(shard_file):
+                yield samp
+
+
+def open_loader(path):
+    """Returns the appropriate loader for a sample index file or dataset."""
+    if os.path.isdir(path) or path.endswith(SHARD_EXTENSION):
+        return PackedSampleLoader(path)
+    else:
+        return sample.SampleLoader(path)
+
+
+def write_shard(filename, samples):
+    """Writes the samples to a new shard file.
+
+    Images are cropped to the bounding box of the corners of each
+    sample. Returns the number of samples written.
+
+    """
+    images = []
+    corners = []
+    labels = []
+    for samp in samples:
+        cropped = samp.crop()
+        images.append(np.ascontiguousarray(cropped.image, dtype=np.uint8))
+        corners.append(cropped.corners)
+        labels.append(samp.label if samp.label is not None else -1)
+    shapes = np.array([image.shape for image in images], dtype=np.int32)
+    shapes = shapes.reshape(-1, 2)
+    sizes = shapes.prod(axis=1, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+    if images:
+        pixels = np.concatenate([image.ravel() for image in images])
+    else:
+        pixels = np.zeros(0, dtype=np.uint8)
+    with open(filename, mode="wb") as f:
+        np.savez(
+            f,
+            version=np.array(FORMAT_VERSION),
+            pixels=pixels,
+            offsets=offsets,
+            shapes=shapes,
+            corners=np.array(corners, dtype=np.int32).reshape(-1, 4, 2),
+            labels=np.array(labels, dtype=np.int32),
+        )
+    return len(images)
+
+
+def write_dataset(directory, samples, shard_size=DEFAULT_SHARD_SIZE):
+    """Writes the samples as a packed dataset in the given directory.
+
+    Samples are split into shards of at most `shard_size` samples.
+    Returns the list of shard files.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    shard_files = []
+    batch = []
+    for samp in samples:
+        batch.append(samp)
+        if len(batch) == shard_size:
+            shard_files.append(_write_next_shard(directory, len(shard_files), batch))
+            batch = []
+    if batch or not shard_files:
+        shard_files.append(_write_next_shard(directory, len(shard_files), batch))
+    return shard_files
+
+
+def _write_next_shard(directory, num, samples):
+    filename = os.path.join(directory, "shard-{:05d}{}".format(num, SHARD_EXTENSION))
+    write_shard(filename, samples)
+    return filename
+
+
+def _load_npz_member(filename, name):
+    """Memory-maps an array of an uncompressed .npz file.
+
+    Falls back to reading it into memory if the array is compressed.
+
+    """
+    with zipfile.ZipFile(filename) as zip_file:
+        info = zip_file.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(filename) as data:
+            return data[name]
+    with open(filename, mode="rb") as f:
+        # The array starts after the local header of the zip entry,
+        # whose length depends on its file name and extra fields:
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        else:
+            header = np.lib.format.read_array_header_2_0(f)
+        shape, fortran_order, dtype = header
+        offset = f.tell()
+    if not shape or 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+        filename,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert sample index files into a packed dataset."
+    )
+    parser.add_argument("output_dir", help="directory for the dataset shards")
+    parser.add_argument(
+        "sample_files",
+        metavar="sample file",
+        nargs="+",
+        help="index file with the samples to convert",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help="maximum number of samples per shard (default {})".format(
+            DEFAULT_SHARD_SIZE
+        ),
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    samples = (
+        samp
+        for filename in args.sample_files
+        for samp in open_loader(filename).iterate_samples()
+    )
+    shard_files = write_dataset(args.output_dir, samples, shard_size=args.shard_size)
+    print("Wrote {} shards".format(len(shard_files)))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,28 +15,70 @@
 # along with this program.  If not, see
 # <https://www.gnu.org/licenses/>.
 #
+import csv
 import argparse
 import math
 
 import numpy as np
 
+from .. import utils
 from . import sample
+from . import dataset
 from . import classifiers
 from . import evaluation
 
 
-def decide_params(classifier, sample_set, c_values, gamma_values, threshold=None, k=10):
+def decide_params(
+    classifier,
+    sample_set,
+    c_values,
+    gamma_values,
+    threshold=None,
+    k=10,
+    num_workers=1,
+    seed=0,
+):
+    """Grid search of the C and gamma parameters by k-fold cross evaluation.
+
+    Returns a list of tuples (success rate, balanced success rate, C,
+    gamma, training time) and the matrix of success rates. With
+    `num_workers` other than 1, the folds of all the grid points are
+    run in a pool of processes. Results do not depend on the number
+    of processes for the same `seed`.
+
+    """
     results = []
     rmat = np.zeros(shape=(len(c_values), len(gamma_values)), dtype="float32")
-    partitions = sample_set.partition(k)
-    for i, c in enumerate(c_values):
-        for j, gamma in enumerate(gamma_values):
-            params = dict(C=c, gamma=gamma)
+    partitions = sample_set.partition(k, seed=seed)
+    grid = [
+        (i, j, dict(C=c, gamma=gamma))
+        for i, c in enumerate(c_values)
+        for j, gamma in enumerate(gamma_values)
+    ]
+    with evaluation.FoldEvaluator(
+        classifier, partitions, seed=seed, num_workers=num_workers
+    ) as evaluator:
+        # Queue every grid point in advance to keep all the workers busy:
+        for _, _, params in grid:
+            evaluator.submit(params)
+        for i, j, params in grid:
+            c = params["C"]
+            gamma = params["gamma"]
             print("C: {}, gamma: {}".format(c, gamma))
             e = evaluation.KFoldCrossEvaluation(
-                classifier, partitions, training_params=params, threshold=threshold
+                classifier,
+                partitions,
+                training_params=params,
+                threshold=threshold,
+                evaluator=evaluator,
+            )
+            result = (
+                e.success_rate,
+                e.success_rate_balanced,
+                c,
+                gamma,
+                e.training_time,
             )
-            result = (e.success_rate, e.success_rate_balanced, c, gamma)
             results.append(result)
             rmat[i, j] = e.success_rate
             print(result)
@@ -44,6 +86,16 @@ def decide_params(classifier, sample_set, c_values, gamma_values, threshold=None
     return results, rmat
 
 
+def write_results(results, file_):
+    """Writes the results of `decide_params` as a table."""
+    writer = csv.writer(file_, dialect=utils.csv_tabs_dialect)
+    writer.writerow(("C", "gamma", "balanced_success_rate", "training_time"))
+    for success_rate, balanced_rate, c, gamma, training_time in results:
+        writer.writerow(
+            (c, gamma, "{:.6f}".format(balanced_rate), "{:.3f}".format(training_time))
+        )
+
+
 def _parse_args():
     parser = argparse.ArgumentParser(description="Look for the best SVM parameters.")
     parser.add_argument(
@@ -53,7 +105,7 @@ def _parse_args():
         "sample_files",
         metavar="sample file",
         nargs="+",
-        help="index file with the samples for training/evaluation",
+        help="index file or packed dataset with the samples for training/evaluation",
     )
     parser.add_argument(
         "--rounds",
@@ -61,6 +113,32 @@ def _parse_args():
         default=10,
         help="number of rounds for k-fold cross evaluation (default 10)",
     )
+    parser.add_argument(
+        "--features-cache",
+        metavar="DIR",
+        default=None,
+        help="directory in which extracted features are cached across runs",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes (default 1, 0 for one per CPU)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed for the random partition of samples (default 0)",
+    )
+    parser.add_argument(
+        "--results",
+        metavar="FILE",
+        default="decide_params_results.csv",
+        help="file in which the table of results is written"
+        " (default decide_params_results.csv)",
+    )
     return parser.parse_args()
 
 
@@ -68,7 +146,7 @@ def main():
     args = _parse_args()
     sample_set = sample.SampleSet()
     for filename in args.sample_files:
-        sample_set.load_from_loader(sample.SampleLoader(filename))
+        sample_set.load_from_loader(dataset.open_loader(filename))
     if args.classifier == "digits":
         classifier = classifiers.DefaultDigitClassifier(
             load_from_file=None, confusion_matrix_from_file=None
@@ -77,12 +155,23 @@ def main():
     else:
         classifier = classifiers.DefaultCrossesClassifier(load_from_file=None)
         threshold = 0.99
+    if args.features_cache:
+        classifier.use_feature_store(args.features_cache)
     c_values = [math.pow(10, i) for i in np.linspace(0, 4, 9)]
     gamma_values = [math.pow(10, i) for i in np.linspace(-3, -1, 5)]
-    r = decide_params(
-        classifier, sample_set, c_values, gamma_values, threshold=threshold
+    results, rmat = decide_params(
+        classifier,
+        sample_set,
+        c_values,
+        gamma_values,
+        threshold=threshold,
+        k=args.rounds,
+        num_workers=args.jobs,
+        seed=args.seed,
     )
-    print(r)
+    with open(args.results, mode="w", newline="") as f:
+        write_results(results, f)
+    print(rmat)
 
 
 if __name__ == "__main__":
@@ -15,9 +15,16 @@
 # along with this program.  If not, see
 # <https://www.gnu.org/licenses/>.
 #
+import os
+import random
+import time
+import tempfile
+import multiprocessing
+import concurrent.futures
+
 import numpy as np
 
-from . import sample
+from . import classifiers
 
 
 class Evaluation:
@@ -39,16 +46,31 @@ class Evaluation:
 
     def _evaluate(self):
         num_classes = self.classifier.num_classes
-        self.results = np.zeros(len(self.samples), dtype=bool)
+        samples = list(self.samples)
+        self.results = np.zeros(len(samples), dtype=bool)
         self.confusion_matrix = np.zeros(shape=(num_classes, num_classes), dtype="int")
-        for i, samp in enumerate(self.samples):
-            detected = self.classifier.classify(samp)
+        detected_labels = self.classifier.classify_samples(samples)
+        for i, (samp, detected) in enumerate(zip(samples, detected_labels)):
             self.confusion_matrix[samp.label, detected] += 1
             self.results[i] = samp.check_label(detected)
         self.success_rate = sum(self.results) / len(self.results)
 
 
 class KFoldCrossEvaluation(Evaluation):
+    """K-fold cross evaluation of a classifier.
+
+    Each of the `sample_sets` is evaluated with a classifier trained
+    with the rest of them. When `threshold` is given, the evaluation
+    stops at the first round after which the accumulated success
+    rate is below it.
+
+    Folds are run by a `FoldEvaluator`. A new one that runs in the
+    calling process is created unless `evaluator` is given, which
+    allows sharing a pool of processes between several evaluations
+    (its oversampling setting is used in that case).
+
+    """
+
     def __init__(
         self,
         classifier,
@@ -56,29 +78,241 @@ class KFoldCrossEvaluation(Evaluation):
         oversampling=False,
         training_params=None,
         threshold=None,
+        evaluator=None,
     ):
         self.classifier = classifier
         self.sample_sets = sample_sets
         self.training_params = training_params
         self.threshold = threshold
-        self._evaluate(oversampling=oversampling)
+        if evaluator is None:
+            evaluator = FoldEvaluator(
+                classifier, sample_sets, oversampling=oversampling
+            )
+        self._evaluate(evaluator)
 
-    def _evaluate(self, oversampling=False):
+    def _evaluate(self, evaluator):
         num_classes = self.classifier.num_classes
         self.confusion_matrix = np.zeros(shape=(num_classes, num_classes), dtype="int")
-        for i, evaluation_set in enumerate(self.sample_sets):
-            training_set = sample.SampleSet()
-            training_set.load_from_sample_sets(self.sample_sets[:i])
-            training_set.load_from_sample_sets(self.sample_sets[i + 1 :])
-            if oversampling:
-                training_set = training_set.oversample()
-            self.classifier.train(training_set.samples(), params=self.training_params)
-            evaluation = Evaluation(self.classifier, evaluation_set)
-            self.confusion_matrix += evaluation.confusion_matrix
-            self.classifier.reset()
-            total = self.confusion_matrix.sum()
-            correct = self.confusion_matrix.diagonal().sum()
-            self.success_rate = correct / total
-            print("Round {}: {}".format(i, self.success_rate))
-            if self.threshold is not None and self.success_rate < self.threshold:
-                break
+        self.training_time = 0.0
+        self.rounds = 0
+        results = evaluator.fold_results(self.training_params)
+        try:
+            for i, (confusion_matrix, training_time) in enumerate(results):
+                self.confusion_matrix += confusion_matrix
+                self.training_time += training_time
+                self.rounds = i + 1
+                total = self.confusion_matrix.sum()
+                correct = self.confusion_matrix.diagonal().sum()
+                self.success_rate = correct / total
+                print("Round {}: {}".format(i, self.success_rate))
+                if self.threshold is not None and self.success_rate < self.threshold:
+                    break
+        finally:
+            results.close()
+
+
+class FoldEvaluator:
+    """Trains and evaluates SVMs on the folds of a k-fold partition.
+
+    Features of the samples are extracted once, when the evaluator is
+    created. Each fold is evaluated with an SVM trained with the
+    samples of the rest of the folds.
+
+    With `num_workers` other than 1, folds are run in a pool of
+    processes (as many as CPUs when it is None or 0), which read the
+    features from memory-mapped files. Oversampling of training sets
+    is seeded with `seed` and the fold number, so that results do
+    not depend on the number of processes. Call `close` (or use the
+    evaluator as a context manager) to stop the pool.
+
+    """
+
+    def __init__(
+        self, classifier, sample_sets, oversampling=False, seed=0, num_workers=1
+    ):
+        self.num_folds = len(sample_sets)
+        self.default_params = classifier.default_params
+        samples = []
+        fold_ids = []
+        for i, sample_set in enumerate(sample_sets):
+            fold_samples = list(sample_set)
+            samples.extend(fold_samples)
+            fold_ids.extend([i] * len(fold_samples))
+        data = _FoldData(
+            classifier.features(samples),
+            np.array([samp.label for samp in samples], dtype="int32"),
+            np.array(fold_ids, dtype="int32"),
+            classifier.num_classes,
+            oversampling,
+            seed,
+        )
+        self._futures = {}
+        if num_workers == 1:
+            self._data = data
+            self._executor = None
+            self._tmp_dir = None
+        else:
+            self._data = None
+            self._tmp_dir = tempfile.TemporaryDirectory()
+            data.save(self._tmp_dir.name)
+            # Forking a process that has already used OpenCV may
+            # deadlock, hence the "spawn" start method:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_workers or None,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(
+                    self._tmp_dir.name,
+                    classifier.num_classes,
+                    oversampling,
+                    seed,
+                ),
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, params=None):
+        """Queues the evaluation of all the folds with the given parameters.
+
+        Their results are later returned by `fold_results`. It does
+        nothing when folds are run in the calling process, because
+        they are evaluated on demand.
+
+        """
+        if self._executor is None:
+            return
+        if params is None:
+            params = self.default_params
+        key = _params_key(params)
+        if key not in self._futures:
+            self._futures[key] = [
+                self._executor.submit(_evaluate_fold_in_worker, fold, params)
+                for fold in range(self.num_folds)
+            ]
+
+    def fold_results(self, params=None):
+        """Returns an iterator over the results of the folds, in fold order.
+
+        Each result is a tuple (confusion matrix, training time).
+        `params` is a dictionary with C and gamma. The default
+        parameters of the classifier are used if it is None. Folds
+        not yet evaluated when the iterator is closed are cancelled.
+
+        """
+        if params is None:
+            params = self.default_params
+        if self._executor is None:
+            data = self._data
+            return (data.evaluate(fold, params) for fold in range(self.num_folds))
+        self.submit(params)
+        return _future_results(self._futures.pop(_params_key(params)))
+
+    def close(self):
+        if self._executor is not None:
+            for futures in self._futures.values():
+                for future in futures:
+                    future.cancel()
+            self._futures = {}
+            self._executor.shutdown()
+            self._executor = None
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+
+class _FoldData:
+    def __init__(self, features, labels, fold_ids, num_classes, oversampling, seed):
+        self.features = features
+        self.labels = labels
+        self.fold_ids = fold_ids
+        self.num_classes = num_classes
+        self.oversampling = oversampling
+        self.seed = seed
+
+    def save(self, directory):
+        np.save(os.path.join(directory, "features.npy"), self.features)
+        np.save(os.path.join(directory, "labels.npy"), self.labels)
+        np.save(os.path.join(directory, "fold_ids.npy"), self.fold_ids)
+
+    @staticmethod
+    def load(directory, num_classes, oversampling, seed):
+        return _FoldData(
+            np.load(os.path.join(directory, "features.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "labels.npy")),
+            np.load(os.path.join(directory, "fold_ids.npy")),
+            num_classes,
+            oversampling,
+            seed,
+        )
+
+    def evaluate(self, fold, params):
+        training = np.flatnonzero(self.fold_ids != fold)
+        evaluation = np.flatnonzero(self.fold_ids == fold)
+        if self.oversampling:
+            rnd = random.Random("{}-{}".format(self.seed, fold))
+            training = _oversample(training, self.labels, rnd)
+        start = time.perf_counter()
+        svm = classifiers.train_svm(
+            self.features[training], self.labels[training], params
+        )
+        training_time = time.perf_counter() - start
+        confusion_matrix = np.zeros(
+            shape=(self.num_classes, self.num_classes), dtype="int"
+        )
+        if evaluation.size:
+            retval, predictions = svm.predict(self.features[evaluation])
+            detected = predictions[:, 0].astype(int)
+            np.add.at(confusion_matrix, (self.labels[evaluation], detected), 1)
+        return confusion_matrix, training_time
+
+
+def _oversample(indices, labels, rnd):
+    """Returns the indices with all the classes as frequent as the largest.
+
+    It replicates the samples of each class the same way
+    `SampleSet.oversample` does.
+
+    """
+    groups = [indices[labels[indices] == label] for label in np.unique(labels[indices])]
+    max_num = max(len(group) for group in groups)
+    parts = []
+    for group in groups:
+        parts.extend([group] * (max_num // len(group)))
+        parts.append(
+            np.array(
+                rnd.sample(group.tolist(), max_num % len(group)), dtype=group.dtype
+            )
+        )
+    return np.concatenate(parts)
+
+
+def _params_key(params):
+    if params is None:
+        return None
+    return tuple(sorted(params.items()))
+
+
+def _future_results(futures):
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+# Data of the worker processes of FoldEvaluator
+_worker_data = None
+
+
+def _init_worker(directory, num_classes, oversampling, seed):
+    global _worker_data
+    _worker_data = _FoldData.load(directory, num_classes, oversampling, seed)
+
+
+def _evaluate_fold_in_worker(fold, params):
+    return _worker_data.evaluate(fold, params)
@@ -0,0 +1,153 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import os
+import json
+import hashlib
+
+import numpy as np
+
+
+class FeatureStore:
+    """Persistent store of the feature vectors of samples.
+
+    Feature vectors are stored as the rows of a matrix in a `.npy`
+    file, which is memory-mapped when loaded. Each row is keyed by
+    the image file of the sample (path, size and modification time),
+    its corners and the configuration of the feature extractor, so
+    that samples are extracted just once across runs. Samples that
+    are not loaded from a file (see `Sample.source`) are extracted
+    every time.
+
+    A store directory can be shared by several feature extractors:
+    each extractor configuration gets its own matrix.
+
+    """
+
+    def __init__(self, directory, features_extractor):
+        self.directory = directory
+        self.features_extractor = features_extractor
+        config_id = _config_id(features_extractor.config)
+        self.matrix_file = os.path.join(directory, config_id + ".npy")
+        self.keys_file = os.path.join(directory, config_id + ".keys")
+        self.num_extractions = 0
+        self._sample_keys = {}
+        self._load()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def features_len(self):
+        return self.features_extractor.features_len
+
+    def features(self, samples):
+        """Returns the matrix of feature vectors of the given samples.
+
+        Samples not in the store yet are extracted and stored.
+
+        """
+        keys = [self._sample_key(sample) for sample in samples]
+        missing = {}
+        for key, sample in zip(keys, samples):
+            if key is not None and key not in self._rows:
+                missing[key] = sample
+        if missing:
+            self._append(missing)
+        features = np.empty((len(samples), self.features_len), dtype=np.float32)
+        stored = [i for i, key in enumerate(keys) if key is not None]
+        if stored:
+            rows = [self._rows[keys[i]] for i in stored]
+            features[stored] = self._matrix[rows]
+        for i, key in enumerate(keys):
+            if key is None:
+                features[i] = self._extract(samples[i])
+        return features
+
+    def _extract(self, sample):
+        self.num_extractions += 1
+        return self.features_extractor.extract(sample)
+
+    def _sample_key(self, sample):
+        source = sample.source
+        if source is None:
+            return None
+        filename, part = source
+        corners = np.asarray(sample.corners, dtype=np.int64).tobytes()
+        memo_key = (filename, part, corners)
+        key = self._sample_keys.get(memo_key)
+        if key is None:
+            stat = os.stat(filename)
+            digest = hashlib.sha1()
+            digest.update(os.path.abspath(filename).encode("utf-8"))
+            digest.update(
+                "\t{}\t{}\t".format(stat.st_size, stat.st_mtime_ns).encode("ascii")
+            )
+            if part is not None:
+                digest.update("{}\t".format(part).encode("ascii"))
+            digest.update(corners)
+            key = digest.hexdigest()
+            self._sample_keys[memo_key] = key
+        return key
+
+    def _load(self):
+        self._rows = {}
+        self._matrix = np.empty((0, self.features_len), dtype=np.float32)
+        if not os.path.exists(self.matrix_file) or not os.path.exists(self.keys_file):
+            return
+        matrix = np.load(self.matrix_file, mmap_mode="r")
+        with open(self.keys_file, mode="r") as f:
+            keys = [line.strip() for line in f]
+        # A crash while appending may leave the matrix with more rows
+        # than keys. Those rows are ignored.
+        num_rows = min(len(keys), matrix.shape[0])
+        if matrix.shape[1:] != (self.features_len,):
+            return
+        self._matrix = matrix
+        self._rows = {key: i for i, key in enumerate(keys[:num_rows])}
+
+    def _append(self, new_samples):
+        os.makedirs(self.directory, exist_ok=True)
+        num_old = len(self._rows)
+        keys = sorted(self._rows, key=self._rows.get)
+        tmp_file = self.matrix_file + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(
+            tmp_file,
+            mode="w+",
+            dtype=np.float32,
+            shape=(num_old + len(new_samples), self.features_len),
+        )
+        matrix[:num_old] = self._matrix[:num_old]
+        for i, (key, sample) in enumerate(new_samples.items()):
+            matrix[num_old + i] = self._extract(sample)
+            keys.append(key)
+        matrix.flush()
+        # The memory maps must be released before replacing the file
+        # (Windows does not allow replacing mapped files):
+        del matrix
+        self._matrix = None
+        os.replace(tmp_file, self.matrix_file)
+        with open(self.keys_file + ".tmp", mode="w") as f:
+            for key in keys:
+                print(key, file=f)
+        os.replace(self.keys_file + ".tmp", self.keys_file)
+        self._load()
+
+
+def _config_id(config):
+    data = json.dumps(config, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()[:16]
@@ -45,6 +45,11 @@ class FeatureExtractor:
     def features_len(self):
         return self.dim * self.dim
 
+    @property
+    def config(self):
+        """Parameters that determine the features this extractor computes."""
+        return {"extractor": type(self).__name__, "dim": self.dim}
+
     @staticmethod
     def _project_to_rectangle(sample, width, height):
         p = sample.corners
@@ -87,6 +92,15 @@ class OpenCVExampleExtractor:
         )
         self.features_len = 64
 
+    @property
+    def config(self):
+        """Parameters that determine the features this extractor computes."""
+        return {
+            "extractor": type(self).__name__,
+            "dim": self.dim,
+            "threshold": self.threshold,
+        }
+
     def extract(self, sample):
         corners = np.array(sample.corners, dtype="float32")
         h = cv2.findHomography(corners, self._corners_dst)
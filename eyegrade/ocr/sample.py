@@ -45,6 +45,18 @@ class Sample:
                 raise ValueError("Cannot load image: {}".format(self.image_filename))
         return self._image
 
+    @property
+    def source(self):
+        """Returns the (file, part) tuple the image is loaded from, or None.
+
+        `part` identifies the image within the file, or is None when
+        the file holds just the image of this sample.
+
+        """
+        if self.image_filename:
+            return (self.image_filename, None)
+        return None
+
     def check_label(self, label):
         return self.label == label
 
@@ -128,19 +140,25 @@ class SampleSet:
             iterator = self._iterate_samples()
         return iterator
 
-    def partition(self, num_groups):
+    def partition(self, num_groups, seed=None):
+        """Splits the samples randomly into `num_groups` sample sets.
+
+        The partition is reproducible when a `seed` is given.
+
+        """
         total_samples = len(self)
         partition_lens = [total_samples // num_groups] * num_groups
         for i in range(total_samples % num_groups):
             partition_lens[i] += 1
         partitions = []
-        samples = set(self.samples())
+        samples = self.samples()
+        random.Random(seed).shuffle(samples)
+        start = 0
         for partition_len in partition_lens:
-            partition = random.sample(samples, partition_len)
-            samples -= set(partition)
             sample_set = SampleSet()
-            sample_set.load_from_samples(partition)
+            sample_set.load_from_samples(samples[start : start + partition_len])
             partitions.append(sample_set)
+            start += partition_len
         return partitions
 
     def oversample(self):
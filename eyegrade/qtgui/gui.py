@@ -161,6 +161,7 @@ class ActionsManager:
         ("+show_status", None, _("Show &status"), []),
         ("+lines", None, _("Show &lines"), []),
         ("+processed", None, _("Show &processed image"), []),
+        ("+show_timing", None, _("Show &timing"), []),
     ]
 
     _actions_experimental: List[Tuple[str, Optional[str], Optional[str], List[int]]] = [
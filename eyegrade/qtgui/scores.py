@@ -62,7 +62,7 @@ class ScoreWeightsTableModel(QAbstractTableModel):
 
     def data_reset(self) -> None:
         self.beginResetModel()
-        self.models = sorted(self.exam_config.models)
+        self.models = sorted(self.exam_config.models, key=utils.model_sort_key)
         self.has_permutations = False
         if not self.models:
             self.models = ["A"]
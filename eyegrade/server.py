@@ -0,0 +1,474 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# HTTP grading service.
+#
+# Images of exams are POSTed to /grade and the service answers with
+# a JSON object with the detected answers, model, ranking of students
+# and score. Requests are accepted by an asyncio server and graded by
+# a pool of worker threads, each with its own detection context. The
+# queue of pending images is bounded: when it is full, requests are
+# rejected with 503 so that clients back off. GET /metrics returns
+# counters and latency histograms in the Prometheus text format.
+#
+import sys
+import json
+import time
+import queue
+import asyncio
+import argparse
+import threading
+import concurrent.futures
+
+import cv2
+import numpy as np
+
+from . import utils
+from . import detection
+from . import stations
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_HEADER_LINES = 100
+MAX_BODY_SIZE = 20 * 1024 * 1024
+MAX_RANKED_STUDENTS = 5
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Saturated(Exception):
+    """Raised when the queue of the worker pool is full."""
+
+
+class GradingFailed(Exception):
+    """Raised when an image cannot be graded."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WorkerPool:
+    """Threads that grade the images submitted to a bounded queue.
+
+    Each worker has its own detection context, which keeps the Hough
+    threshold that worked for the last image. If `store` is True,
+    graded exams are stored in the session through the writer
+    (stations.SessionWriter).
+
+    """
+
+    def __init__(
+        self, writer, detection_options, num_workers=2, queue_size=8, store=False
+    ):
+        self.writer = writer
+        self.detection_options = detection_options
+        self.store = store
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._workers = [
+            threading.Thread(target=self._run, name="grading-worker-{}".format(i))
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def queued(self):
+        return self._jobs.qsize()
+
+    def submit(self, data, processed_file=None):
+        """Queues an encoded image (PNG, JPEG...) for grading.
+
+        Returns a `concurrent.futures.Future` whose result is the
+        tuple (result, queue time, grading time), where result is the
+        dictionary returned by `exam_result`. Raises Saturated if the
+        queue is full. `processed_file` is passed to the writer when
+        the exam is stored (see SessionWriter.store_exam).
+
+        """
+        future = concurrent.futures.Future()
+        try:
+            self._jobs.put_nowait((future, data, processed_file, time.perf_counter()))
+        except queue.Full:
+            raise Saturated()
+        return future
+
+    def close(self):
+        """Stops the workers after their current job.
+
+        The jobs still in the queue are cancelled.
+
+        """
+        while True:
+            try:
+                future = self._jobs.get_nowait()[0]
+            except queue.Empty:
+                break
+            future.cancel()
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self):
+        context = detection.ExamDetectorContext()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, data, processed_file, queued_at = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                result = self._grade(context, data, processed_file)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                end = time.perf_counter()
+                future.set_result((result, start - queued_at, end - start))
+        context.close_camera()
+
+    def _grade(self, context, data, processed_file):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise GradingFailed(400, "The request body is not an image")
+        # Try every Hough threshold, starting with the last one that worked
+        detector = stations.detect(
+            image,
+            self.writer.exam_config.dimensions,
+            context,
+            self.detection_options,
+            len(context.hough_thresholds),
+        )
+        if detector is None:
+            raise GradingFailed(422, "No exam detected in the image")
+        exam = stations.grade(detector, self.writer, self.detection_options)
+        if exam is None:
+            raise GradingFailed(
+                422, "Unknown model: {}".format(detector.decisions.model)
+            )
+        if self.store:
+            exam.exam_id = self.writer.reserve_exam_id()
+            exam.draw_answers()
+            self.writer.store_exam(exam, processed_file=processed_file).result()
+            self.writer.save_captures(exam)
+        return exam_result(exam)
+
+
+def exam_result(exam):
+    """Returns the JSON-serializable dictionary that describes the exam."""
+    decisions = exam.decisions
+    score = exam.score
+    return {
+        "exam_id": exam.exam_id,
+        "model": decisions.model,
+        "answers": decisions.answers,
+        "detected_id": decisions.detected_id,
+        "students": [
+            {"id": student.student_id, "name": student.name}
+            for student in decisions.students_rank[:MAX_RANKED_STUDENTS]
+        ],
+        "score": {
+            "correct": score.correct,
+            "incorrect": score.incorrect,
+            "blank": score.blank,
+            "score": score.score,
+            "max_score": score.max_score,
+        },
+    }
+
+
+class LatencyHistogram:
+    """Histogram of latencies with the buckets of LATENCY_BUCKETS."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append("{}_sum {}".format(self.name, self.sum))
+        lines.append("{}_count {}".format(self.name, self.count))
+        return lines
+
+
+class Metrics:
+    """Metrics of the service.
+
+    They are updated only from the thread of the event loop.
+
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.request_latency = LatencyHistogram(
+            "eyegrade_request_seconds", "Time to answer the grading requests accepted."
+        )
+        self.queue_latency = LatencyHistogram(
+            "eyegrade_queue_seconds", "Time images wait for a worker."
+        )
+        self.grading_latency = LatencyHistogram(
+            "eyegrade_grading_seconds", "Time to decode, detect and grade images."
+        )
+
+    def count_request(self, path, status):
+        key = (path, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self, queued):
+        lines = [
+            "# HELP eyegrade_requests_total Requests by path and status.",
+            "# TYPE eyegrade_requests_total counter",
+        ]
+        for (path, status), count in sorted(self.requests.items()):
+            lines.append(
+                'eyegrade_requests_total{{path="{}",status="{}"}} {}'.format(
+                    path, status, count
+                )
+            )
+        lines.extend(
+            [
+                "# HELP eyegrade_queued_images Images waiting for a worker.",
+                "# TYPE eyegrade_queued_images gauge",
+                "eyegrade_queued_images {}".format(queued),
+            ]
+        )
+        for histogram in (
+            self.request_latency,
+            self.queue_latency,
+            self.grading_latency,
+        ):
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+class GradingServer:
+    """Minimal HTTP/1.1 server in front of a WorkerPool."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.metrics = Metrics()
+        self.server = None
+
+    async def start(self, host, port):
+        """Starts listening. Returns the port, useful when `port` is 0."""
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, content_type, content = await self._dispatch(method, path, body)
+                self.metrics.count_request(path, status)
+                _write_response(writer, status, content_type, content, keep_alive)
+                await writer.drain()
+        except _BadRequest as e:
+            _write_response(writer, e.status, "application/json", _error(e), False)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        if path == "/grade":
+            if method != "POST":
+                return 405, "application/json", _error("Use POST")
+            return await self._grade(body)
+        elif path == "/metrics":
+            if method != "GET":
+                return 405, "application/json", _error("Use GET")
+            return (
+                200,
+                "text/plain; version=0.0.4",
+                self.metrics.render(self.pool.queued),
+            )
+        else:
+            return 404, "application/json", _error("Not found")
+
+    async def _grade(self, body):
+        start = time.perf_counter()
+        try:
+            future = self.pool.submit(body)
+        except Saturated:
+            return 503, "application/json", _error("The server is busy")
+        try:
+            result, queue_time, grading_time = await asyncio.wrap_future(future)
+        except GradingFailed as e:
+            status, content = e.status, _error(e)
+        except Exception as e:
+            status, content = 500, _error(e)
+        else:
+            self.metrics.queue_latency.observe(queue_time)
+            self.metrics.grading_latency.observe(grading_time)
+            status, content = 200, json.dumps(result)
+        self.metrics.request_latency.observe(time.perf_counter() - start)
+        return status, "application/json", content
+
+
+class _BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_request(reader):
+    """Reads a request. Returns None when the client closes the connection."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise _BadRequest(400, "Malformed request line")
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise _BadRequest(400, "Too many headers")
+    body = b""
+    if method == "POST":
+        if "content-length" not in headers:
+            raise _BadRequest(411, "Content-Length is required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise _BadRequest(400, "Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise _BadRequest(413, "The image is too large")
+        body = await reader.readexactly(length)
+    return method, target.split("?")[0], headers, body
+
+
+def _write_response(writer, status, content_type, content, keep_alive):
+    data = content.encode("utf-8")
+    head = [
+        "HTTP/1.1 {} {}".format(status, HTTP_REASONS[status]),
+        "Content-Type: {}".format(content_type),
+        "Content-Length: {}".format(len(data)),
+        "Connection: {}".format("keep-alive" if keep_alive else "close"),
+    ]
+    if status == 503:
+        head.append("Retry-After: 1")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+
+
+def _error(message):
+    return json.dumps({"error": str(message)})
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Grade exam images over HTTP.")
+    parser.add_argument("session", help="session directory or database file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument(
+        "-w", "--workers", type=int, default=2, help="number of grading workers"
+    )
+    parser.add_argument(
+        "-q",
+        "--queue-size",
+        type=int,
+        default=8,
+        help="images that can wait for a worker before rejecting requests",
+    )
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help="store the graded exams in the session",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    try:
+        writer = stations.SessionWriter(args.session)
+    except utils.EyegradeException as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    options = stations.detection_options(writer.exam_config, utils.config)
+    pool = WorkerPool(
+        writer,
+        options,
+        num_workers=args.workers,
+        queue_size=args.queue_size,
+        store=args.store,
+    )
+    server = GradingServer(pool)
+    loop = asyncio.new_event_loop()
+    try:
+        port = loop.run_until_complete(server.start(args.host, args.port))
+        print("Listening on http://{}:{}/grade".format(args.host, port))
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Closing the pool cancels the requests still in the queue
+        pool.close()
+        loop.run_until_complete(server.stop())
+        loop.close()
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
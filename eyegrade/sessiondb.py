@@ -17,6 +17,7 @@
 #
 import sqlite3
 import os
+import time
 from typing import Optional
 
 from . import utils
@@ -26,6 +27,11 @@ from . import students
 from . import capture
 from . import images
 from . import export
+from . import item_analysis
+from . import duplicates
+
+# Number of rows fetched at once by the iterators that export data:
+FETCH_CHUNK_SIZE = 500
 
 
 class SessionDB:
@@ -151,6 +157,55 @@ class SessionDB:
             FOREIGN KEY(exam_id) REFERENCES Exams(exam_id)
         )"""
 
+    # Ledger of the files graded by eyegrade-watch. Older sessions get
+    # it the first time it is used.
+    _table_processed_files = """
+        CREATE TABLE IF NOT EXISTS ProcessedFiles (
+            digest TEXT PRIMARY KEY NOT NULL,
+            file_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            exam_id INTEGER,
+            message TEXT,
+            processed_time REAL NOT NULL
+        )"""
+
+    # Running aggregates for the item analysis of the session, updated
+    # as exams are stored, modified or removed. Older sessions get
+    # them, built from the exams already graded, the first time they
+    # are used.
+    _table_score_stats = """
+        CREATE TABLE IF NOT EXISTS ScoreStats (
+            model INTEGER PRIMARY KEY NOT NULL,
+            num_exams INTEGER NOT NULL,
+            num_scored INTEGER NOT NULL,
+            score_sum REAL NOT NULL,
+            score_sq_sum REAL NOT NULL
+        )"""
+
+    _table_item_stats = """
+        CREATE TABLE IF NOT EXISTS ItemStats (
+            model INTEGER NOT NULL,
+            question INTEGER NOT NULL,
+            answer INTEGER NOT NULL,
+            num_exams INTEGER NOT NULL,
+            num_scored INTEGER NOT NULL,
+            score_sum REAL NOT NULL,
+            PRIMARY KEY (model, question, answer)
+        )"""
+
+    # Perceptual hashes of the answer area of the exams (see the
+    # duplicates module). Older sessions get the table the first time
+    # it is used; their exams graded before have no hash.
+    _table_exam_hashes = """
+        CREATE TABLE IF NOT EXISTS ExamHashes (
+            exam_id INTEGER PRIMARY KEY NOT NULL,
+            sheet_hash INTEGER NOT NULL,
+            FOREIGN KEY(exam_id) REFERENCES Exams(exam_id)
+        )"""
+
+    _index_exam_hashes = """
+        CREATE INDEX IF NOT EXISTS idx_sheet_hash ON ExamHashes(sheet_hash)"""
+
     _index_student_id = """
         CREATE UNIQUE INDEX idx_student_id ON Students(student_id)"""
 
@@ -176,6 +231,8 @@ class SessionDB:
         self._compute_num_questions_and_choices()
         self.capture_save_func = lambda name: None
         self._student_listings = None
+        self._item_stats_checked = False
+        self._hash_index = None
 
     @property
     def student_listings(self):
@@ -189,7 +246,26 @@ class SessionDB:
     def close(self):
         self.conn.close()
 
-    def store_exam(self, exam_id, exam_capture, decisions, score, store_captures=True):
+    def rollback(self):
+        """Discards the changes not committed yet.
+
+        The in-memory index of sheet hashes is discarded too, because
+        it may hold hashes of exams that were not committed.
+
+        """
+        self.conn.rollback()
+        self._hash_index = None
+
+    def store_exam(
+        self,
+        exam_id,
+        exam_capture,
+        decisions,
+        score,
+        store_captures=True,
+        commit=True,
+    ):
+        self._check_item_stats()
         student_db_id = self._student_db_id(decisions.student)
         cursor = self.conn.cursor()
         cursor.execute(
@@ -209,26 +285,70 @@ class SessionDB:
             self._store_answer_cells(exam_id, exam_capture.answer_cells, commit=False)
         if exam_capture.id_cells:
             self._store_id_cells(exam_id, exam_capture.id_cells, commit=False)
-        self.conn.commit()
+        self._update_item_stats(
+            _enc_model(decisions.model), decisions.answers, score.score, 1
+        )
+        self._store_sheet_hash(exam_id, exam_capture)
+        if commit:
+            self.conn.commit()
         if store_captures:
             self.save_raw_capture(exam_id, exam_capture)
             self.save_drawn_capture(exam_id, exam_capture, decisions.student)
 
     def remove_exam(self, exam_id):
+        self._check_item_stats()
+        sheet_hashes = self._sheet_hashes()
         cursor = self.conn.cursor()
         student = self._read_student_by_exam(exam_id)
+        model, score = self._read_model_and_score(exam_id)
+        self._update_item_stats(model, self._read_stored_answers(exam_id), score, -1)
         cursor.execute("DELETE FROM Answers WHERE exam_id=?", (exam_id,))
         cursor.execute("DELETE FROM AnswerCells WHERE exam_id=?", (exam_id,))
         cursor.execute("DELETE FROM IdCells WHERE exam_id=?", (exam_id,))
+        cursor.execute("DELETE FROM ExamHashes WHERE exam_id=?", (exam_id,))
         cursor.execute("DELETE FROM Exams WHERE exam_id=?", (exam_id,))
         self.conn.commit()
+        sheet_hashes.remove(exam_id)
         self.remove_drawn_capture(exam_id, student)
         self.remove_raw_capture(exam_id)
 
+    def find_duplicates(self, exam_capture, student=None):
+        """Returns the ids of the exams that look like the same sheet.
+
+        The answer area of `exam_capture` is compared with the one of
+        the exams of the session, nearest first. If `student` is
+        given, exams of other students are not reported.
+
+        """
+        sheet_hash = exam_capture.sheet_hash()
+        if sheet_hash is None:
+            return []
+        exam_ids = [exam_id for _, exam_id in self._sheet_hashes().find(sheet_hash)]
+        if student is not None and student.db_id is not None:
+            cursor = self.conn.cursor()
+            same_student = []
+            for exam_id in exam_ids:
+                cursor.execute(
+                    "SELECT student FROM Exams WHERE exam_id = ?", (exam_id,)
+                )
+                db_id = cursor.fetchone()["student"]
+                if db_id is None or db_id == student.db_id:
+                    same_student.append(exam_id)
+            exam_ids = same_student
+        return exam_ids
+
     def update_answer(
         self, exam_id, question, exam_capture, decisions, score, store_captures=True
     ):
+        self._check_item_stats()
         new_answer = decisions.answers[question]
+        old_model, old_score = self._read_model_and_score(exam_id)
+        old_answers = list(decisions.answers)
+        old_answers[question] = self._read_answer(exam_id, question)
+        self._update_item_stats(old_model, old_answers, old_score, -1)
+        self._update_item_stats(
+            _enc_model(decisions.model), decisions.answers, score.score, 1
+        )
         self._update_answer(exam_id, question, new_answer, commit=False)
         self._update_score(exam_id, score, commit=False)
         self.conn.commit()
@@ -236,6 +356,12 @@ class SessionDB:
             self.save_drawn_capture(exam_id, exam_capture, decisions.student)
 
     def update_score(self, exam: exams.Exam, commit: bool = True):
+        self._check_item_stats()
+        model, old_score = self._read_model_and_score(exam.exam_id)
+        if exam.score.score != old_score:
+            answers = exam.decisions.answers
+            self._update_item_stats(model, answers, old_score, -1)
+            self._update_item_stats(model, answers, exam.score.score, 1)
         self._update_score(exam.exam_id, exam.score, commit=commit)
 
     def update_exam_config_scores(self, exam_data, commit=True):
@@ -426,6 +552,31 @@ class SessionDB:
         else:
             return 1
 
+    def processed_files(self):
+        """Returns the ledger of processed files.
+
+        It is a dictionary that maps the digest of the contents of
+        each file to its row (with the keys digest, file_name, status,
+        exam_id, message and processed_time).
+
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(SessionDB._table_processed_files)
+        cursor.execute("SELECT * FROM ProcessedFiles")
+        return {row["digest"]: dict(row) for row in cursor}
+
+    def record_processed_file(
+        self, digest, file_name, status, exam_id=None, message=None, commit=True
+    ):
+        cursor = self.conn.cursor()
+        cursor.execute(SessionDB._table_processed_files)
+        cursor.execute(
+            "INSERT OR REPLACE INTO ProcessedFiles VALUES (?, ?, ?, ?, ?, ?)",
+            (digest, file_name, status, exam_id, message, time.time()),
+        )
+        if commit:
+            self.conn.commit()
+
     def save_legacy_answers(self):
         file_name = os.path.join(self.session_dir, "eyegrade-answers.csv")
         file_format = export.FileFormat.CSV_TABS
@@ -464,18 +615,19 @@ class SessionDB:
                     writer.append_row(export_helper.data(exam))
 
     def exams_iterator(self):
-        cursor = self.conn.cursor()
-        for row in cursor.execute(
+        query = (
             "SELECT "
             "exam_id, student_id, model, "
-            "correct, incorrect, score "
+            "correct, incorrect, score, answer_list "
             "FROM Exams "
             "LEFT JOIN Students ON student = db_id "
+            "{} "
             "ORDER BY exam_id"
-        ):
+        ).format(self._answers_join)
+        for row in self._iter_rows(query):
             exam = dict(row)
             exam["model"] = _dec_model(exam["model"])
-            exam["answers"] = self.read_answers(exam["exam_id"])
+            exam["answers"] = self._parse_answer_list(exam.pop("answer_list"))
             yield exam
 
     def _grades_iterator_query(self, all_students, sort_key, student_group):
@@ -501,9 +653,10 @@ class SessionDB:
             "* "
             "FROM Students "
             "{0} JOIN Exams ON student = db_id "
-            "{1}"
+            "{1} "
             "{2}"
-        ).format(join_type, where_clause, sort_clause)
+            "{3}"
+        ).format(join_type, self._answers_join, where_clause, sort_clause)
 
     def grades_iterator(
         self,
@@ -518,23 +671,54 @@ class SessionDB:
                 "* "
                 "FROM Exams "
                 "LEFT JOIN Students ON student = db_id "
+                "{} "
                 "ORDER BY exam_id"
-            )
+            ).format(self._answers_join)
         else:
             query = self._grades_iterator_query(all_students, sort_key, student_group)
-        cursor = self.conn.cursor()
-        for row in cursor.execute(query):
+        for row in self._iter_rows(query):
             student = self._student_from_row(row)
             exam = {"student": student}
             for key in ("exam_id", "model", "correct", "incorrect", "score"):
                 exam[key] = row[key]
             exam["model"] = _dec_model(exam["model"])
-            exam["answers"] = self.read_answers(exam["exam_id"])
+            exam["answers"] = self._parse_answer_list(row["answer_list"])
             for key, value in exam.items():
                 if value is None:
                     exam[key] = ""
             yield exam
 
+    # The answers of all the exams are read along with the exams by
+    # joining them, aggregated per exam as a "question:answer,..."
+    # string, instead of querying them exam by exam. The Answers table
+    # has no index on exam_id, which made every per-exam query a full
+    # scan of the table.
+    _answers_join = (
+        "LEFT JOIN ("
+        "SELECT exam_id AS answers_exam_id, "
+        "group_concat(question || ':' || answer) AS answer_list "
+        "FROM Answers GROUP BY exam_id"
+        ") ON answers_exam_id = exam_id"
+    )
+
+    def _parse_answer_list(self, answer_list):
+        answers = [0] * self.exam_config.num_questions
+        if answer_list:
+            for item in answer_list.split(","):
+                question, answer = item.split(":")
+                answers[int(question)] = int(answer)
+        return answers
+
+    def _iter_rows(self, query, params=()):
+        """Iterates over the rows of a query, fetched in chunks."""
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+            if not rows:
+                break
+            yield from rows
+
     def read_answers(self, exam_id):
         answers = [0] * self.exam_config.num_questions
         cursor = self.conn.cursor()
@@ -544,6 +728,35 @@ class SessionDB:
             answers[row["question"]] = row["answer"]
         return answers
 
+    def read_item_analysis(self):
+        """Returns the item analysis of the exams graded in the session.
+
+        It is computed from running aggregates, without reading the
+        answers of every exam.
+
+        """
+        self._check_item_stats()
+        analysis = item_analysis.ItemAnalysis(self.exam_config)
+        cursor = self.conn.cursor()
+        for row in cursor.execute("SELECT * FROM ScoreStats"):
+            analysis.add_scores(
+                _dec_model(row["model"]),
+                row["num_exams"],
+                row["num_scored"],
+                row["score_sum"],
+                row["score_sq_sum"],
+            )
+        for row in cursor.execute("SELECT * FROM ItemStats WHERE num_exams > 0"):
+            analysis.add_answers(
+                _dec_model(row["model"]),
+                row["question"],
+                row["answer"],
+                row["num_exams"],
+                row["num_scored"],
+                row["score_sum"],
+            )
+        return analysis
+
     def read_exams(self):
         cursor = self.conn.cursor()
         exam_list = []
@@ -827,6 +1040,125 @@ class SessionDB:
         solutions = [s if s else None for s in solutions]
         return solutions
 
+    def _read_model_and_score(self, exam_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT model, score FROM Exams WHERE exam_id = ?", (exam_id,))
+        row = cursor.fetchone()
+        return row["model"], row["score"]
+
+    def _read_stored_answers(self, exam_id):
+        """Like read_answers, but None for exams stored without answers."""
+        answers = [0] * self.exam_config.num_questions
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT question, answer FROM Answers WHERE exam_id = ?", (exam_id,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        for row in rows:
+            answers[row["question"]] = row["answer"]
+        return answers
+
+    def _read_answer(self, exam_id, question):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT answer FROM Answers WHERE exam_id = ? AND question = ?",
+            (exam_id, question),
+        )
+        return cursor.fetchone()["answer"]
+
+    def _sheet_hashes(self):
+        if self._hash_index is None:
+            cursor = self.conn.cursor()
+            cursor.execute(SessionDB._table_exam_hashes)
+            cursor.execute(SessionDB._index_exam_hashes)
+            self._hash_index = duplicates.HashIndex()
+            for row in cursor.execute("SELECT * FROM ExamHashes"):
+                self._hash_index.add(row["exam_id"], _dec_hash(row["sheet_hash"]))
+        return self._hash_index
+
+    def _store_sheet_hash(self, exam_id, exam_capture):
+        sheet_hash = exam_capture.sheet_hash()
+        if sheet_hash is not None:
+            index = self._sheet_hashes()
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "INSERT OR REPLACE INTO ExamHashes VALUES (?, ?)",
+                (exam_id, _enc_hash(sheet_hash)),
+            )
+            index.add(exam_id, sheet_hash)
+
+    def _check_item_stats(self):
+        if self._item_stats_checked:
+            return
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'ItemStats'"
+        )
+        if not cursor.fetchone()[0]:
+            self.rebuild_item_stats()
+        self._item_stats_checked = True
+
+    def rebuild_item_stats(self, commit=True):
+        """Computes again the item-analysis aggregates from the exams.
+
+        It is needed after exams are inserted in bulk, bypassing
+        `store_exam` (e.g. when sessions are merged).
+
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(SessionDB._table_score_stats)
+        cursor.execute(SessionDB._table_item_stats)
+        cursor.execute("DELETE FROM ScoreStats")
+        cursor.execute("DELETE FROM ItemStats")
+        cursor.execute(
+            "INSERT INTO ScoreStats "
+            "SELECT model, COUNT(*), COUNT(score), "
+            "TOTAL(score), TOTAL(score * score) "
+            "FROM Exams GROUP BY model"
+        )
+        cursor.execute(
+            "INSERT INTO ItemStats "
+            "SELECT model, question, answer, COUNT(*), COUNT(score), "
+            "TOTAL(score) "
+            "FROM Answers JOIN Exams ON Answers.exam_id = Exams.exam_id "
+            "GROUP BY model, question, answer"
+        )
+        if commit:
+            self.conn.commit()
+
+    def _update_item_stats(self, model, answers, score, sign):
+        """Adds (sign 1) or subtracts (sign -1) an exam to the aggregates."""
+        cursor = self.conn.cursor()
+        scored = 0 if score is None else 1
+        score = 0.0 if score is None else float(score)
+        cursor.execute(
+            "INSERT OR IGNORE INTO ScoreStats VALUES (?, 0, 0, 0.0, 0.0)", (model,)
+        )
+        cursor.execute(
+            "UPDATE ScoreStats SET "
+            "num_exams = num_exams + ?, num_scored = num_scored + ?, "
+            "score_sum = score_sum + ?, score_sq_sum = score_sq_sum + ? "
+            "WHERE model = ?",
+            (sign, sign * scored, sign * score, sign * score * score, model),
+        )
+        if answers:
+            keys = [
+                (model, question, answer) for question, answer in enumerate(answers)
+            ]
+            cursor.executemany(
+                "INSERT OR IGNORE INTO ItemStats VALUES (?, ?, ?, 0, 0, 0.0)", keys
+            )
+            cursor.executemany(
+                "UPDATE ItemStats SET "
+                "num_exams = num_exams + ?, num_scored = num_scored + ?, "
+                "score_sum = score_sum + ? "
+                "WHERE model = ? AND question = ? AND answer = ?",
+                [(sign, sign * scored, sign * score) + key for key in keys],
+            )
+
     def _update_answer(self, exam_id, question, new_answer, commit=True):
         cursor = self.conn.cursor()
         cursor.execute(
@@ -1041,7 +1373,7 @@ def _enc_model(model_letter: str) -> int:
     elif model_letter is None or model_letter == "?":
         return -1
     else:
-        return ord(model_letter) - 64
+        return utils.model_index(model_letter) + 1
 
 
 def _dec_model(model_number: int) -> Optional[str]:
@@ -1050,7 +1382,20 @@ def _dec_model(model_number: int) -> Optional[str]:
     elif model_number == -1 or model_number is None:
         return None
     else:
-        return chr(64 + model_number)
+        return utils.model_name(model_number - 1)
+
+
+def _enc_hash(sheet_hash: int) -> int:
+    # SQLite integers are signed 64-bit integers:
+    if sheet_hash >= 1 << 63:
+        return sheet_hash - (1 << 64)
+    return sheet_hash
+
+
+def _dec_hash(value: int) -> int:
+    if value < 0:
+        return value + (1 << 64)
+    return value
 
 
 def check_file_is_sqlite(filename):
@@ -1101,6 +1446,11 @@ def _create_tables(conn):
     cursor.execute(SessionDB._table_answers)
     cursor.execute(SessionDB._table_answer_cells)
     cursor.execute(SessionDB._table_id_cells)
+    cursor.execute(SessionDB._table_processed_files)
+    cursor.execute(SessionDB._table_score_stats)
+    cursor.execute(SessionDB._table_item_stats)
+    cursor.execute(SessionDB._table_exam_hashes)
+    cursor.execute(SessionDB._index_exam_hashes)
     cursor.execute(SessionDB._index_student_id)
 
 
@@ -0,0 +1,174 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Frame sources other than cameras.
+#
+# Frame sources read the frames of multi-page TIFF files (as produced
+# by document scanners), video files and lists of image files. They
+# have the read/release interface of cv2.VideoCapture, so that they
+# can replace the camera of a detection context (see
+# ExamDetectorContext.open_source), and can also be iterated. Frames
+# are decoded one at a time, as fast as they are read, so that memory
+# does not grow with the length of the file.
+#
+import os
+
+import cv2
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp") + TIFF_EXTENSIONS
+
+
+class FrameSource:
+    """Base class of frame sources.
+
+    Subclasses implement `_read_frame`, which returns the next image
+    or None at the end. `pages` tells whether each frame shows a
+    different sheet (scanned pages) or the frames are a continuous
+    recording of sheets being shown to the camera (video).
+
+    """
+
+    pages = False
+
+    def __init__(self, name):
+        self.name = name
+        self.position = 0
+
+    def read(self):
+        """Returns the tuple (success, image) as cv2.VideoCapture.read."""
+        image = self._read_frame()
+        if image is None:
+            return False, None
+        self.position += 1
+        return True, image
+
+    def release(self):
+        pass
+
+    def frame_name(self, position):
+        """Returns a name for the frame at the given position."""
+        return "{}#{}".format(self.name, position)
+
+    def __iter__(self):
+        while True:
+            success, image = self.read()
+            if not success:
+                break
+            yield image
+
+    def _read_frame(self):
+        raise NotImplementedError()
+
+
+class TiffPages(FrameSource):
+    """The pages of a multi-page TIFF file, decoded one at a time."""
+
+    pages = True
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.num_pages = cv2.imcount(filename)
+        if self.num_pages <= 0:
+            raise ValueError("Cannot read TIFF file: {}".format(filename))
+
+    def _read_frame(self):
+        if self.position >= self.num_pages:
+            return None
+        success, images = cv2.imreadmulti(
+            self.name, self.position, 1, flags=cv2.IMREAD_COLOR
+        )
+        return images[0] if success and images else None
+
+
+class VideoFrames(FrameSource):
+    """The frames of a video file, decoded as fast as they are read.
+
+    Only one of every `step` frames is returned. The rest are grabbed
+    but not converted to images.
+
+    """
+
+    def __init__(self, filename, step=1):
+        super().__init__(filename)
+        self.step = step
+        self._video = cv2.VideoCapture(filename)
+        if not self._video.isOpened():
+            raise ValueError("Cannot open video file: {}".format(filename))
+        self._num_read = 0
+
+    def frame_name(self, position):
+        return "{}#{}".format(self.name, position * self.step)
+
+    def release(self):
+        self._video.release()
+
+    def _read_frame(self):
+        if self._num_read > 0:
+            for _ in range(self.step - 1):
+                if not self._video.grab():
+                    return None
+        success, image = self._video.read()
+        if not success:
+            return None
+        self._num_read += 1
+        return image
+
+
+class ImageFiles(FrameSource):
+    """The images of a list of files, one page each."""
+
+    pages = True
+
+    def __init__(self, filenames, name=None):
+        super().__init__(name if name is not None else "images")
+        self.filenames = list(filenames)
+
+    def frame_name(self, position):
+        return self.filenames[position]
+
+    def _read_frame(self):
+        while self.position < len(self.filenames):
+            image = cv2.imread(self.filenames[self.position], cv2.IMREAD_COLOR)
+            if image is not None:
+                return image
+            # Not an image: skip it
+            del self.filenames[self.position]
+        return None
+
+
+def open_source(path):
+    """Returns the frame source for a file or a directory of images.
+
+    TIFF files are read as multi-page images and the rest of files as
+    videos. Directories are read as their image files, sorted by name.
+
+    """
+    if os.path.isdir(path):
+        filenames = sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        return ImageFiles(filenames, name=path)
+    elif not os.path.isfile(path):
+        raise ValueError("File not found: {}".format(path))
+    elif path.lower().endswith(TIFF_EXTENSIONS):
+        return TiffPages(path)
+    else:
+        return VideoFrames(path)
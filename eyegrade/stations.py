@@ -0,0 +1,495 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Grading with several cameras into the same session.
+#
+# Each camera is driven by a station: a thread with its own detection
+# context that searches for exams, grades them, waits until they are
+# removed from under the camera and starts again. Stations share a
+# single session writer, which owns the connection to the session
+# database, allocates exam ids and applies the writes in order. The
+# images of the exams are saved by the stations themselves, because
+# each one goes to a different file. Stations can also grade the
+# pages of a multi-page TIFF or the frames of a video file.
+#
+import os
+import sys
+import queue
+import argparse
+import threading
+import concurrent.futures
+
+from . import utils
+from . import exams
+from . import detection
+from . import sources
+from . import sessiondb
+
+# Consecutive checks without the exam for considering it removed
+change_failures_threshold = 2
+
+
+class SessionWriter:
+    """Serializes the access of the stations to a session database.
+
+    The database is opened by a dedicated thread, which is the only
+    one that uses the connection. Writes are queued and applied in
+    order by that thread. Exam ids are allocated atomically by
+    `reserve_exam_id`, so that several stations never get the same
+    id. The exam configuration and student listings are loaded once
+    and can be read from any thread, holding `listings_lock` for the
+    listings (storing an exam of an unknown student adds it to them).
+
+    """
+
+    def __init__(self, session_file):
+        self.listings_lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, args=(session_file,), name="session-writer"
+        )
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+
+    def reserve_exam_id(self):
+        """Returns a new exam id, different from all the previous ones."""
+        with self._lock:
+            exam_id = self._next_exam_id
+            self._next_exam_id += 1
+        return exam_id
+
+    def store_exam(self, exam, processed_file=None):
+        """Queues the storage of the exam in the database.
+
+        Returns a `concurrent.futures.Future` that is done when the
+        exam has been committed. The captures of the exam are not
+        saved: see `save_captures`. If `processed_file` is a tuple
+        (digest, file name), the file is recorded as graded in the
+        ledger of processed files, in the same transaction.
+
+        """
+        return self._submit(self._store_exam, exam, processed_file)
+
+    def record_processed_file(self, digest, file_name, status, message=None):
+        """Queues a record in the ledger of processed files."""
+        return self._submit(
+            self.session.record_processed_file,
+            digest,
+            file_name,
+            status,
+            message=message,
+        )
+
+    def processed_files(self):
+        """Returns the ledger of processed files (see SessionDB)."""
+        return self._submit(self.session.processed_files).result()
+
+    def save_captures(self, exam):
+        """Saves the raw and drawn captures of the exam.
+
+        It is run in the thread of the caller, because it does not
+        access the database.
+
+        """
+        self.session.save_raw_capture(exam.exam_id, exam.capture)
+        self.session.save_drawn_capture(
+            exam.exam_id, exam.capture, exam.decisions.student
+        )
+
+    def close(self):
+        """Applies the pending writes and closes the database."""
+        self._requests.put(None)
+        self._thread.join()
+
+    def _store_exam(self, exam, processed_file):
+        with self.listings_lock:
+            self.session.store_exam(
+                exam.exam_id,
+                exam.capture,
+                exam.decisions,
+                exam.score,
+                store_captures=False,
+                commit=processed_file is None,
+            )
+        if processed_file is not None:
+            digest, file_name = processed_file
+            self.session.record_processed_file(
+                digest, file_name, "graded", exam_id=exam.exam_id
+            )
+
+    def _submit(self, function, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self._requests.put((future, function, args, kwargs))
+        return future
+
+    def _run(self, session_file):
+        try:
+            self.session = sessiondb.SessionDB(session_file)
+            # Drawn captures are saved from the image of the capture:
+            self.session.capture_save_func = None
+            self.exam_config = self.session.exam_config
+            self.student_listings = self.session.student_listings
+            self._next_exam_id = self.session.next_exam_id()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            future, function, args, kwargs = request
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args, **kwargs))
+                except Exception as e:
+                    # Do not let the next write commit a half-done one
+                    self.session.rollback()
+                    future.set_exception(e)
+        self.session.close()
+
+
+class GradingStation:
+    """Grades the exams shown to a camera, without user interaction.
+
+    The station searches for an exam in the frames of its detection
+    context, stores it through the session writer once it is graded
+    and waits until it is removed before searching for the next
+    one. The work is done in a thread of its own: call `start`, and
+    then `stop` and `join` to finish. The thread also finishes when
+    the context returns no image. `on_exam` is called from the thread
+    of the station with the station and each exam stored.
+
+    When the context captures from a source of pages (see
+    sources.FrameSource), each frame is a different sheet: every Hough
+    threshold is tried on it, and the names of the pages that cannot
+    be graded are appended to `failed_pages`.
+
+    """
+
+    def __init__(
+        self,
+        name,
+        detection_context,
+        writer,
+        detection_options,
+        quality_gate=None,
+        on_exam=None,
+    ):
+        self.name = name
+        self.detection_context = detection_context
+        self.writer = writer
+        self.exam_config = writer.exam_config
+        self.detection_options = detection_options
+        self.quality_gate = quality_gate
+        self.on_exam = on_exam
+        self.num_exams = 0
+        self.failed_pages = []
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="station-" + name)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Asks the station to finish after the current frame."""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                exam = self._search()
+                if exam is None:
+                    break
+                exam.draw_answers()
+                self.writer.store_exam(exam).result()
+                self.writer.save_captures(exam)
+                self.num_exams += 1
+                if self.on_exam is not None:
+                    self.on_exam(self, exam)
+                if not self._pages and not self._wait_for_removal(exam):
+                    break
+        except Exception as e:
+            self.error = e
+
+    @property
+    def _pages(self):
+        source = self.detection_context.frame_source
+        return source is not None and source.pages
+
+    def _search(self):
+        """Returns the next exam graded, or None if there are no more frames."""
+        pages = self._pages
+        if self.quality_gate is not None:
+            self.quality_gate.reset()
+        while not self._stop.is_set():
+            image = self.detection_context.capture()
+            if image is None:
+                return None
+            if pages:
+                exam = self._grade(image, len(self.detection_context.hough_thresholds))
+                if exam is None:
+                    source = self.detection_context.frame_source
+                    self.failed_pages.append(source.frame_name(source.position - 1))
+            elif self.quality_gate is None or self.quality_gate.check(image):
+                exam = self._grade(image, 1)
+            else:
+                exam = None
+            if exam is not None:
+                exam.exam_id = self.writer.reserve_exam_id()
+                return exam
+        return None
+
+    def _grade(self, image, attempts):
+        """Detects and grades the image, trying up to `attempts` thresholds."""
+        detector = detect(
+            image,
+            self.exam_config.dimensions,
+            self.detection_context,
+            self.detection_options,
+            attempts,
+        )
+        if detector is None:
+            return None
+        return grade(detector, self.writer, self.detection_options)
+
+    def _wait_for_removal(self, exam):
+        """Returns when the exam is removed, or False if there are no more frames."""
+        change_detector = detection.ExamChangeDetector(
+            exam.capture,
+            self.exam_config.dimensions,
+            self.detection_context,
+            self.detection_options,
+        )
+        failures = 0
+        while not self._stop.is_set():
+            image = self.detection_context.capture()
+            if image is None:
+                return False
+            if change_detector.exam_present(image_raw=image):
+                failures = 0
+            else:
+                failures += 1
+                if failures >= change_failures_threshold:
+                    return True
+        return False
+
+
+def detect(image, dimensions, context, detection_options, attempts):
+    """Returns a successful detector for the image, or None.
+
+    Up to `attempts` Hough thresholds are tried, starting with the
+    current one of the context. `ExamDetector.detect` moves to the next
+    threshold by itself when it finds no boxes, so the threshold is
+    only moved here when detection fails after having found them.
+
+    """
+    for _ in range(attempts):
+        detector = detection.ExamDetector(
+            dimensions, context, detection_options, image_raw=image
+        )
+        if detector.detect_safe():
+            return detector
+        if attempts > 1 and detector.status["boxes"]:
+            context.next_hough_threshold()
+    return None
+
+
+def grade(detector, writer, detection_options):
+    """Returns the exam graded from a successful detection.
+
+    Returns None if the model of the exam is unknown or the session
+    has no solutions for it. The exam has no id yet (it is None).
+
+    """
+    exam_config = writer.exam_config
+    if not detection_options["infobits"]:
+        detector.decisions.model = "A"
+    model = detector.decisions.model
+    if model is None or (
+        model not in exam_config.solutions and not exam_config.survey_mode
+    ):
+        return None
+    with writer.listings_lock:
+        return exams.Exam(
+            detector.capture,
+            detector.decisions,
+            exam_config.get_solutions(model),
+            writer.student_listings,
+            None,
+            exam_config.scores.get(model),
+        )
+
+
+def detection_options(exam_config, config):
+    """Returns the options of the detector for the exams of the session."""
+    options = detection.ExamDetector.get_default_options()
+    if exam_config.survey_mode:
+        options["infobits"] = False
+    options["extended-models"] = exam_config.extended_models()
+    options["error-logging"] = config["error-logging"]
+    options["timing-log"] = config["timing-log"]
+    if exam_config.id_num_digits and exam_config.id_num_digits > 0:
+        options["read-id"] = True
+        options["id-num-digits"] = exam_config.id_num_digits
+    options["left-to-right-numbering"] = exam_config.left_to_right_numbering
+    return options
+
+
+def quality_gate(config):
+    """Returns the frame quality gate configured, or None if disabled."""
+    if not config["quality-gate"]:
+        return None
+    thresholds = {}
+    if config["quality-gate-max-motion"] is not None:
+        thresholds["max_motion"] = config["quality-gate-max-motion"]
+    if config["quality-gate-min-sharpness"] is not None:
+        thresholds["min_sharpness"] = config["quality-gate-min-sharpness"]
+    return detection.FrameQualityGate(**thresholds)
+
+
+def run_stations(stations):
+    """Runs the stations until they finish or the user presses Ctrl-C."""
+    for station in stations:
+        station.start()
+    try:
+        for station in stations:
+            while station.is_alive():
+                station.join(0.5)
+    except KeyboardInterrupt:
+        for station in stations:
+            station.stop()
+        for station in stations:
+            station.join()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Grade exams from several cameras into the same session."
+    )
+    parser.add_argument("session", help="session directory or database file")
+    parser.add_argument(
+        "-c",
+        "--camera",
+        type=int,
+        action="append",
+        default=[],
+        help="camera device of a station (repeat it for each station)",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        action="append",
+        default=[],
+        help="multi-page TIFF, video file or directory of images to grade"
+        " in a station (repeat it for each station)",
+    )
+    args = parser.parse_args()
+    if not args.camera and not args.file:
+        parser.error("at least a camera or a file is required")
+    return args
+
+
+def main():
+    args = _parse_args()
+    config = utils.config
+    try:
+        writer = SessionWriter(args.session)
+    except utils.EyegradeException as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print_lock = threading.Lock()
+
+    def report(station, exam):
+        with print_lock:
+            print(
+                "[{}] exam {}: {} {}".format(
+                    station.name,
+                    exam.exam_id,
+                    exam.get_student_id_and_name() or "-",
+                    exam.score.score if exam.score.score is not None else "",
+                )
+            )
+
+    stations = []
+    options = detection_options(writer.exam_config, config)
+    for path in args.file:
+        context = detection.ExamDetectorContext()
+        try:
+            context.open_source(sources.open_source(path))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            writer.close()
+            sys.exit(1)
+        stations.append(
+            GradingStation(
+                os.path.basename(path.rstrip(os.sep)),
+                context,
+                writer,
+                options,
+                quality_gate=quality_gate(config),
+                on_exam=report,
+            )
+        )
+    for camera_id in args.camera:
+        context = detection.ExamDetectorContext(camera_id=camera_id)
+        if not context.open_camera() or context.camera_id != camera_id:
+            print("Camera {} not available".format(camera_id), file=sys.stderr)
+            writer.close()
+            sys.exit(1)
+        stations.append(
+            GradingStation(
+                str(camera_id),
+                context,
+                writer,
+                options,
+                quality_gate=quality_gate(config),
+                on_exam=report,
+            )
+        )
+    try:
+        run_stations(stations)
+    finally:
+        for station in stations:
+            station.detection_context.close_camera()
+            for page in station.failed_pages:
+                print("[{}] not graded: {}".format(station.name, page), file=sys.stderr)
+            if station.error is not None:
+                print(
+                    "[{}] error: {}".format(station.name, station.error),
+                    file=sys.stderr,
+                )
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
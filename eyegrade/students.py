@@ -21,8 +21,6 @@ import csv
 import itertools
 import enum
 
-import openpyxl
-
 from . import utils
 
 re_email = r"^[a-zA-Z0-9._%-\+]+@[a-zA-Z0-9._%-]+.[a-zA-Z]{2,6}$"
@@ -349,6 +347,8 @@ class XLSXStudentReader(StudentReader):
         self.iterator = None
 
     def __enter__(self):
+        import openpyxl
+
         self.workbook = openpyxl.load_workbook(self.file_name, read_only=True)
         self.iterator = self.iter_rows(self.workbook.active)
         return self
@@ -0,0 +1,167 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+import json
+import time
+import collections
+
+import numpy as np
+
+# Number of frames over which rolling statistics are computed
+DEFAULT_WINDOW = 300
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    """Measures the time spent in each stage of a process.
+
+    A stage is timed with a monotonic clock by using the object that
+    `stage` returns as a context manager. The times of stages with
+    the same name are added up.
+
+    """
+
+    def __init__(self):
+        self.times = {}
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        return _TimedStage(self.times, name)
+
+    def finish(self):
+        """Records the total time since the timer was created.
+
+        Returns the dictionary that maps stage names to their time
+        in seconds.
+
+        """
+        self.times["total"] = time.perf_counter() - self._start
+        return self.times
+
+
+class NullStageTimer:
+    """Timer that does nothing, for when timing is disabled."""
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def finish(self):
+        return None
+
+
+class StageStatistics:
+    """Rolling statistics of the time of each stage.
+
+    Only the last `window` times of each stage are kept (all of them
+    if it is None). Stages that do not run in a frame (e.g. reading
+    the student id when the boxes are not detected) do not add
+    values for that frame.
+
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self._times = {}
+        self._log_file = None
+        self._log_filename = None
+
+    def __len__(self):
+        return len(self._times.get("total", ()))
+
+    def add(self, times):
+        for name, value in times.items():
+            values = self._times.get(name)
+            if values is None:
+                values = collections.deque(maxlen=self.window)
+                self._times[name] = values
+            values.append(value)
+
+    def percentiles(self, name, percentiles=DEFAULT_PERCENTILES):
+        """Returns the list of percentiles of the time of a stage.
+
+        Returns None if the stage has not been timed yet.
+
+        """
+        values = self._times.get(name)
+        if not values:
+            return None
+        return np.percentile(values, percentiles).tolist()
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """Returns a dictionary with the percentiles of every stage.
+
+        Stages are in the order they were first timed, with the total
+        time at the end.
+
+        """
+        names = [name for name in self._times if name != "total"]
+        if "total" in self._times:
+            names.append("total")
+        return {name: self.percentiles(name, percentiles) for name in names}
+
+    def log(self, filename, record):
+        """Appends `record` as a JSON line to the given file."""
+        if filename != self._log_filename:
+            self.close()
+            self._log_file = open(filename, mode="a", buffering=1)
+            self._log_filename = filename
+        print(json.dumps(record, sort_keys=True), file=self._log_file)
+
+    def close(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+            self._log_filename = None
+
+
+def read_log(filename):
+    """Returns an iterator over the records of a JSON lines timing log."""
+    with open(filename, mode="r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class _TimedStage:
+    __slots__ = ("times", "name", "start")
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.times[self.name] = self.times.get(self.name, 0.0) + elapsed
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+NULL_TIMER = NullStageTimer()
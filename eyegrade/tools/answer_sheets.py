@@ -0,0 +1,124 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Renders answer sheets without LaTeX.
+#
+# A PDF output file gets a page per model. Any other extension
+# (e.g. .png) produces an image per model, whose name is the output
+# file name with the model appended to it (sheet-A.png, sheet-B.png...).
+#
+import os
+import sys
+import time
+import argparse
+
+from .. import utils
+from ..create import sheets
+
+
+def write_sheets(filename, sheet, models, dpi=150, page_size=None):
+    """Writes the sheets of the models and returns the files written."""
+    if filename.lower().endswith(".pdf"):
+        sheets.write_pdf(filename, sheet, models, page_size=page_size)
+        return [filename]
+    stem, extension = os.path.splitext(filename)
+    filenames = []
+    for model in models:
+        if model is None:
+            model_filename = filename
+        else:
+            model_filename = "{}-{}{}".format(stem, model, extension)
+        sheets.write_image(model_filename, sheet, model=model, dpi=dpi)
+        filenames.append(model_filename)
+    return filenames
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Render answer sheets.")
+    parser.add_argument("output", help="output file (.pdf, .png, .jpg...)")
+    parser.add_argument(
+        "-d",
+        "--dimensions",
+        required=True,
+        help='answer box dimensions (e.g. "3,5;3,5")',
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        default=None,
+        help="models to render (e.g. ABCD or A,B,AA); A-H by default",
+    )
+    parser.add_argument(
+        "-i",
+        "--id-num-digits",
+        type=int,
+        default=0,
+        help="number of digits of the student id box (none by default)",
+    )
+    parser.add_argument("--id-label", default="ID", help="label of the id box")
+    parser.add_argument(
+        "--survey", action="store_true", help="do not draw the model infobits"
+    )
+    parser.add_argument(
+        "--left-to-right",
+        action="store_true",
+        help="number questions from left to right",
+    )
+    parser.add_argument(
+        "--dpi", type=float, default=150, help="resolution of the images"
+    )
+    parser.add_argument(
+        "--a4", action="store_true", help="use A4 pages instead of fitted ones"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    dimensions, _ = utils.parse_dimensions(args.dimensions)
+    sheet = sheets.AnswerSheet(
+        dimensions,
+        id_num_digits=args.id_num_digits,
+        id_label=args.id_label,
+        infobits=not args.survey,
+        left_to_right_numbering=args.left_to_right,
+    )
+    if args.survey:
+        models = [None]
+    elif args.models:
+        models = utils.parse_models(args.models)
+    else:
+        models = sheet.models()
+    start = time.monotonic()
+    filenames = write_sheets(
+        args.output,
+        sheet,
+        models,
+        dpi=args.dpi,
+        page_size=sheets.A4 if args.a4 else None,
+    )
+    print(
+        "{} sheets written to {} file(s) in {:.3f}s".format(
+            len(models), len(filenames), time.monotonic() - start
+        ),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -61,6 +61,11 @@ def _cmd_options():
         default=0,
         help=("Detect student id with the given " "number of digits"),
     )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="Print the time spent in each detection stage",
+    )
     return parser.parse_args()
 
 
@@ -75,6 +80,7 @@ def main():
     if args.id_num_digits:
         options["read-id"] = True
         options["id-num-digits"] = 9
+    options["timing"] = args.timing
     dimensions, _ = utils.parse_dimensions(args.dimensions)
     detector = detection.ExamDetector(dimensions, context, options)
     success = detector.detect()
@@ -83,6 +89,9 @@ def main():
     else:
         print("Detection failed :(")
         print(detector.status)
+    if args.timing:
+        for stage, seconds in detector.stage_times.items():
+            print("{:<20}{:>8.2f} ms".format(stage, 1000 * seconds))
     if args.draw_lines_to is not None:
         detector.capture.save_image_drawn(args.draw_lines_to)
     if args.image_proc_to:
@@ -0,0 +1,220 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Measures the time and memory of exporting grades.
+#
+# A synthetic session (graded exams of students spread over several
+# groups, with their answers) is created unless an existing session
+# is given. Each export runs in a new Python process: once for
+# measuring its time and once more, with tracemalloc, for measuring
+# the peak of memory allocated while exporting.
+#
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+from .. import exams
+from .. import export
+from .. import students
+from .. import sessiondb
+
+FORMATS = {"csv": export.FileFormat.CSV_TABS, "xlsx": export.FileFormat.XLSX}
+
+COLUMNS = ("student_id", "name", "model", "correct", "incorrect", "score", "answers")
+
+
+def create_session(directory, num_exams, num_groups=10, dimensions="4,20;4,20", seed=0):
+    """Creates a session with `num_exams` graded exams.
+
+    Each student of the session has an exam, and exams have random
+    answers.
+
+    """
+    rnd = random.Random(seed)
+    exam_config = exams.ExamConfig()
+    exam_config.set_dimensions(dimensions)
+    num_questions = exam_config.num_questions
+    num_choices = exam_config.num_options[0]
+    for model in "AB":
+        exam_config.set_solutions(
+            model, [{rnd.randint(1, num_choices)} for _ in range(num_questions)]
+        )
+    listings = students.StudentListings()
+    per_group = (num_exams + num_groups - 1) // num_groups
+    for i in range(num_groups):
+        group = students.StudentGroup(i + 1, "Group {}".format(i + 1))
+        first = i * per_group
+        listing = students.GroupListing(group, [])
+        listing.add_students(
+            [
+                students.Student(
+                    "{:08d}".format(n), None, "First", "Last {}".format(n), ""
+                )
+                for n in range(first, min(first + per_group, num_exams))
+            ]
+        )
+        listings.add_listing(listing)
+    sessiondb.create_session_directory(directory, exam_config, listings)
+    session = sessiondb.SessionDB(directory)
+    cursor = session.conn.cursor()
+    cursor.execute("SELECT db_id FROM Students ORDER BY db_id")
+    db_ids = [row[0] for row in cursor.fetchall()]
+    exam_rows = []
+    answer_rows = []
+    for exam_id, db_id in enumerate(db_ids, start=1):
+        answers = [rnd.randint(0, num_choices) for _ in range(num_questions)]
+        correct = rnd.randint(0, num_questions)
+        exam_rows.append(
+            (exam_id, db_id, rnd.randint(1, 2), correct, 0, 0, float(correct))
+        )
+        answer_rows.extend((exam_id, q, a) for q, a in enumerate(answers))
+    cursor.executemany("INSERT INTO Exams VALUES (?, ?, ?, ?, ?, ?, ?)", exam_rows)
+    cursor.executemany("INSERT INTO Answers VALUES (?, ?, ?)", answer_rows)
+    session.conn.commit()
+    session.close()
+
+
+def _child(args):
+    session = sessiondb.SessionDB(args.session)
+    helper = export.GradesExportHelper(
+        session.exam_config, session.get_student_groups()
+    )
+    helper.file_name = args.output
+    helper.file_format = FORMATS[args.format]
+    helper.export_all_groups(args.one_sheet)
+    helper.sort_by = export.SortBy.STUDENT_LIST
+    helper.all_students = True
+    helper.add_column_headers = True
+    helper.export_columns(COLUMNS)
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    session.export_grades(helper)
+    result = {"time": time.perf_counter() - start}
+    if args.memory:
+        result["memory"] = tracemalloc.get_traced_memory()[1]
+    print(json.dumps(result))
+
+
+def _run(args, file_format, output, memory):
+    command = [
+        sys.executable,
+        "-m",
+        "eyegrade.tools.export_benchmark",
+        "--child",
+        "--session",
+        args.session,
+        "--format",
+        file_format,
+        "--output",
+        output,
+    ]
+    if memory:
+        command.append("--memory")
+    if args.one_sheet:
+        command.append("--one-sheet")
+    output = subprocess.run(
+        command, check=True, stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def benchmark(args, directory):
+    """Returns the time, memory and file size of each export format."""
+    results = {}
+    for file_format in args.formats.split(","):
+        output = os.path.join(directory, "grades." + file_format)
+        results[file_format] = {
+            "time": _run(args, file_format, output, False)["time"],
+            "memory": _run(args, file_format, output, True)["memory"],
+            "size": os.path.getsize(output),
+        }
+    return results
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the time and memory of exporting grades."
+    )
+    parser.add_argument(
+        "--session",
+        default=None,
+        help="session directory (a synthetic session is created by default)",
+    )
+    parser.add_argument(
+        "--num-exams",
+        type=int,
+        default=20000,
+        help="number of exams of the synthetic session (default 20000)",
+    )
+    parser.add_argument(
+        "--formats", default="csv,xlsx", help='formats to export (default "csv,xlsx")'
+    )
+    parser.add_argument(
+        "--one-sheet",
+        action="store_true",
+        help="export all the groups in one sheet",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--format", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    parser.add_argument("--memory", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    if args.child:
+        _child(args)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        if args.session is None:
+            args.session = os.path.join(directory, "session")
+            start = time.perf_counter()
+            create_session(args.session, args.num_exams)
+            print(
+                "Session with {} exams created in {:.1f} s".format(
+                    args.num_exams, time.perf_counter() - start
+                ),
+                file=sys.stderr,
+            )
+        results = benchmark(args, directory)
+    print(
+        "{:<8}{:>10}{:>14}{:>12}".format(
+            "format", "time (s)", "memory (MB)", "size (MB)"
+        )
+    )
+    for file_format, result in results.items():
+        print(
+            "{:<8}{:>10.2f}{:>14.1f}{:>12.1f}".format(
+                file_format,
+                result["time"],
+                result["memory"] / 2**20,
+                result["size"] / 2**20,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Load test client for the HTTP grading service (eyegrade.server).
+#
+# Images are POSTed to /grade by several concurrent clients, each
+# with a persistent connection, and the throughput, status codes and
+# latency percentiles of the requests are reported.
+#
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+import urllib.parse
+import collections
+
+import numpy as np
+
+from .. import timing
+
+LoadResults = collections.namedtuple(
+    "LoadResults", ("requests", "elapsed", "statuses", "latencies")
+)
+
+
+def load_test(url, images, num_requests, concurrency=4):
+    """Sends `num_requests` grading requests with the given images.
+
+    `images` is a list of encoded images, sent in turns. Returns a
+    LoadResults object with the count of each HTTP status and the
+    latency of each request, in seconds.
+
+    """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path if parsed.path not in ("", "/") else "/grade"
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+    statuses = collections.Counter()
+    latencies = []
+
+    def client():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            try:
+                connection.request(
+                    "POST",
+                    path,
+                    body=images[i % len(images)],
+                    headers={"Content-Type": "application/octet-stream"},
+                )
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = "error"
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                latencies.append(elapsed)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return LoadResults(
+        num_requests, time.perf_counter() - start, dict(statuses), latencies
+    )
+
+
+def summary(results, percentiles=timing.DEFAULT_PERCENTILES):
+    """Returns a JSON-serializable summary of the results."""
+    successes = results.statuses.get(200, 0)
+    return {
+        "requests": results.requests,
+        "statuses": {str(key): value for key, value in results.statuses.items()},
+        "throughput": successes / results.elapsed if results.elapsed else 0.0,
+        "latency_percentiles": (
+            dict(
+                zip(
+                    [str(p) for p in percentiles],
+                    np.percentile(results.latencies, percentiles).tolist(),
+                )
+            )
+            if results.latencies
+            else {}
+        ),
+    }
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Load test the HTTP grading service.")
+    parser.add_argument("images", nargs="+", help="image files to send")
+    parser.add_argument(
+        "-u",
+        "--url",
+        default="http://127.0.0.1:8080/grade",
+        help="URL of the grading endpoint",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=100, help="number of requests"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=4, help="concurrent clients"
+    )
+    parser.add_argument(
+        "--json", metavar="FILE", default=None, help="write the results as JSON"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    images = []
+    for filename in args.images:
+        if not os.path.isfile(filename):
+            print("File not found: {}".format(filename), file=sys.stderr)
+            sys.exit(1)
+        with open(filename, mode="rb") as f:
+            images.append(f.read())
+    results = load_test(args.url, images, args.requests, args.concurrency)
+    report = summary(results)
+    print("Requests: {} in {:.2f} s".format(results.requests, results.elapsed))
+    print("Statuses: {}".format(report["statuses"]))
+    print("Throughput: {:.1f} graded/s".format(report["throughput"]))
+    for percentile, value in report["latency_percentiles"].items():
+        print("Latency p{}: {:.1f} ms".format(percentile, 1000 * value))
+    if args.json is not None:
+        with open(args.json, mode="w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
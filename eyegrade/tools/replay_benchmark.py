@@ -0,0 +1,474 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Replays recorded frames through the detection pipeline.
+#
+# Frames come from the raw captures of a session, the images of a
+# directory, a multi-page TIFF or a video file, and are processed one
+# after the other as fast as possible. Frames are retried with the
+# same detection context, as the grading loop does with camera
+# frames, until they lock (detection succeeds) or a maximum number of
+# attempts is reached. For sessions, the answers detected in locked frames are
+# compared to the answers stored in the session (including the
+# corrections made by the user).
+#
+import os
+import sys
+import json
+import time
+import argparse
+import collections
+
+from .. import utils
+from .. import images
+from .. import timing
+from .. import sources
+from .. import detection
+from . import synthetic_captures
+
+# Each frame: its name, image and the answers and model stored for it
+# (None when they are unknown).
+Frame = collections.namedtuple("Frame", ("name", "image", "answers", "model"))
+
+
+class Corpus:
+    """A sequence of frames and the exam configuration to detect them."""
+
+    def __init__(
+        self,
+        frames,
+        dimensions,
+        id_num_digits=0,
+        infobits=True,
+        left_to_right_numbering=False,
+    ):
+        self.frames = frames
+        self.dimensions = dimensions
+        self.id_num_digits = id_num_digits
+        self.infobits = infobits
+        self.left_to_right_numbering = left_to_right_numbering
+
+
+def session_corpus(session_dir):
+    """Returns the corpus of the raw captures of a session.
+
+    Exams whose raw capture is missing are skipped.
+
+    """
+    from .. import sessiondb
+
+    session = sessiondb.SessionDB(session_dir)
+    exam_config = session.exam_config
+    return Corpus(
+        _session_frames(session),
+        exam_config.dimensions,
+        id_num_digits=exam_config.id_num_digits or 0,
+        infobits=not exam_config.survey_mode,
+        left_to_right_numbering=exam_config.left_to_right_numbering,
+    )
+
+
+def _session_frames(session):
+    try:
+        for exam in session.exams_iterator():
+            filename = os.path.join(
+                session.session_dir, "internal", "raw-{}.png".format(exam["exam_id"])
+            )
+            if os.path.isfile(filename):
+                yield Frame(
+                    filename,
+                    images.load_image(filename),
+                    exam["answers"],
+                    exam["model"],
+                )
+    finally:
+        session.close()
+
+
+def directory_frames(directory):
+    """Yields the images of a directory, in alphabetical order.
+
+    The answers and model of each image are taken from the ground
+    truth file of the directory, if any (see `synthetic_captures`).
+
+    """
+    truth = synthetic_captures.read_ground_truth(directory)
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in sources.IMAGE_EXTENSIONS:
+            filename = os.path.join(directory, name)
+            record = truth.get(name, {})
+            yield Frame(
+                filename,
+                images.load_image(filename),
+                record.get("answers"),
+                record.get("model"),
+            )
+
+
+def source_frames(source):
+    """Yields the frames of a frame source (see the sources module)."""
+    try:
+        for image in source:
+            yield Frame(source.frame_name(source.position - 1), image, None, None)
+    finally:
+        source.release()
+
+
+def video_frames(filename):
+    """Yields the frames of a video file."""
+    return source_frames(sources.VideoFrames(filename))
+
+
+class ReplayResults:
+    def __init__(self):
+        self.frames = 0
+        self.attempts = 0
+        self.locked = 0
+        self.skipped = 0
+        self.detection_time = 0.0
+        self.gate_time = 0.0
+        self.time_to_first_lock = None
+        self.frames_to_first_lock = None
+        self.compared_exams = 0
+        self.agreeing_exams = 0
+        self.compared_questions = 0
+        self.agreeing_questions = 0
+        self.compared_models = 0
+        self.agreeing_models = 0
+        self.disagreements = []
+        self.stage_percentiles = {}
+
+    @property
+    def fps(self):
+        """Detection attempts per second."""
+        return self.attempts / self.detection_time if self.detection_time else 0.0
+
+    @property
+    def lock_rate(self):
+        return self.locked / self.frames if self.frames else 0.0
+
+    @property
+    def skipped_fraction(self):
+        """Fraction of the frames rejected by the quality gate."""
+        return self.skipped / self.frames if self.frames else 0.0
+
+    @property
+    def answer_agreement(self):
+        """Fraction of the compared questions with the stored answer."""
+        if not self.compared_questions:
+            return None
+        return self.agreeing_questions / self.compared_questions
+
+    @property
+    def exam_agreement(self):
+        """Fraction of the compared exams with all the answers right."""
+        if not self.compared_exams:
+            return None
+        return self.agreeing_exams / self.compared_exams
+
+    @property
+    def model_agreement(self):
+        if not self.compared_models:
+            return None
+        return self.agreeing_models / self.compared_models
+
+    def add_comparison(self, frame, decisions):
+        answers = decisions.answers
+        agreeing = sum(1 for a, b in zip(answers, frame.answers) if a == b)
+        self.compared_exams += 1
+        self.compared_questions += len(frame.answers)
+        self.agreeing_questions += agreeing
+        if agreeing == len(frame.answers) and len(answers) == len(frame.answers):
+            self.agreeing_exams += 1
+        else:
+            self.disagreements.append(frame.name)
+        if frame.model is not None and decisions.model is not None:
+            self.compared_models += 1
+            if frame.model == decisions.model:
+                self.agreeing_models += 1
+
+    def as_dict(self):
+        return {
+            "frames": self.frames,
+            "attempts": self.attempts,
+            "locked": self.locked,
+            "detection_time": self.detection_time,
+            "fps": self.fps,
+            "lock_rate": self.lock_rate,
+            "skipped": self.skipped,
+            "skipped_fraction": self.skipped_fraction,
+            "gate_time": self.gate_time,
+            "time_to_first_lock": self.time_to_first_lock,
+            "frames_to_first_lock": self.frames_to_first_lock,
+            "answer_agreement": self.answer_agreement,
+            "exam_agreement": self.exam_agreement,
+            "model_agreement": self.model_agreement,
+            "disagreements": self.disagreements,
+            "stage_percentiles": self.stage_percentiles,
+        }
+
+
+def replay(corpus, max_attempts=None, read_id=True, quality_gate=None, context=None):
+    """Runs the frames of the corpus through ExamDetector.detect.
+
+    Each frame is retried until it locks, at most `max_attempts`
+    times (by default, the number of Hough thresholds the detection
+    context cycles through), with the next Hough threshold each time.
+    If a `quality_gate` (detection.FrameQualityGate) is given, the
+    frames it rejects are skipped. A detection `context` can be
+    given; a new one is used otherwise. Returns a ReplayResults
+    object.
+
+    """
+    if max_attempts is None:
+        max_attempts = len(detection.param_hough_thresholds)
+    elif max_attempts < 1:
+        raise ValueError("max_attempts must be at least 1")
+    if context is None:
+        context = detection.ExamDetectorContext()
+    context.timing = timing.StageStatistics(window=None)
+    options = detection.ExamDetector.get_default_options()
+    options["timing"] = True
+    options["infobits"] = corpus.infobits
+    options["left-to-right-numbering"] = corpus.left_to_right_numbering
+    if read_id and corpus.id_num_digits:
+        options["read-id"] = True
+        options["id-num-digits"] = corpus.id_num_digits
+    results = ReplayResults()
+    for frame in corpus.frames:
+        results.frames += 1
+        if quality_gate is not None:
+            start = time.perf_counter()
+            accepted = quality_gate.check(frame.image)
+            results.gate_time += time.perf_counter() - start
+            if not accepted:
+                results.skipped += 1
+                continue
+        detector = _detect(frame, corpus, context, options, max_attempts, results)
+        if detector.success:
+            results.locked += 1
+            if results.time_to_first_lock is None:
+                results.time_to_first_lock = results.detection_time + results.gate_time
+                results.frames_to_first_lock = results.frames
+            if frame.answers is not None:
+                results.add_comparison(frame, detector.decisions)
+    results.stage_percentiles = context.timing.summary()
+    return results
+
+
+def _detect(frame, corpus, context, options, max_attempts, results):
+    """Detects a frame, trying up to `max_attempts` Hough thresholds.
+
+    Returns the detector of the last attempt.
+
+    """
+    for _ in range(max_attempts):
+        start = time.perf_counter()
+        detector = detection.ExamDetector(
+            corpus.dimensions, context, options, image_raw=frame.image
+        )
+        detector.detect_safe()
+        results.detection_time += time.perf_counter() - start
+        results.attempts += 1
+        if detector.success:
+            break
+        # detect() only moves to the next threshold when it finds no
+        # boxes (as in stations.detect):
+        if max_attempts > 1 and detector.status["boxes"]:
+            context.next_hough_threshold()
+    return detector
+
+
+def print_report(results, file_=sys.stdout):
+    print("Frames: {}".format(results.frames), file=file_)
+    print(
+        "Attempts: {} ({:.1f} frames/s)".format(results.attempts, results.fps),
+        file=file_,
+    )
+    print("Lock rate: {:.3f}".format(results.lock_rate), file=file_)
+    if results.skipped:
+        print(
+            "Skipped by the quality gate: {} ({:.3f})".format(
+                results.skipped, results.skipped_fraction
+            ),
+            file=file_,
+        )
+    if results.time_to_first_lock is not None:
+        print(
+            "First lock: frame {} after {:.1f} ms".format(
+                results.frames_to_first_lock, 1000 * results.time_to_first_lock
+            ),
+            file=file_,
+        )
+    for name, value in (
+        ("Answer agreement", results.answer_agreement),
+        ("Exam agreement", results.exam_agreement),
+        ("Model agreement", results.model_agreement),
+    ):
+        if value is not None:
+            print("{}: {:.3f}".format(name, value), file=file_)
+    print("Stage latency (ms):", file=file_)
+    print("    {:<20}{:>9}{:>9}{:>9}".format("stage", "p50", "p90", "p99"), file=file_)
+    for name, percentiles in results.stage_percentiles.items():
+        print(
+            "    {:<20}{:>9.2f}{:>9.2f}{:>9.2f}".format(
+                name, *[1000 * p for p in percentiles]
+            ),
+            file=file_,
+        )
+
+
+def check_gates(results, min_fps=None, min_lock_rate=None, min_agreement=None):
+    """Returns the list of failed regression gates."""
+    failures = []
+    if min_fps is not None and results.fps < min_fps:
+        failures.append("fps {:.1f} < {}".format(results.fps, min_fps))
+    if min_lock_rate is not None and results.lock_rate < min_lock_rate:
+        failures.append(
+            "lock rate {:.3f} < {}".format(results.lock_rate, min_lock_rate)
+        )
+    if min_agreement is not None:
+        agreement = results.answer_agreement
+        if agreement is None or agreement < min_agreement:
+            failures.append("answer agreement {} < {}".format(agreement, min_agreement))
+    return failures
+
+
+def _open_corpus(args):
+    if os.path.isfile(args.corpus) and args.corpus.endswith(".eyedb"):
+        return session_corpus(args.corpus)
+    elif os.path.isdir(args.corpus):
+        if os.path.isfile(os.path.join(args.corpus, "session.eyedb")):
+            return session_corpus(args.corpus)
+        frames = directory_frames(args.corpus)
+        truth = synthetic_captures.read_ground_truth(args.corpus)
+    else:
+        frames = source_frames(sources.open_source(args.corpus))
+        truth = {}
+    id_num_digits = args.id_num_digits
+    if args.dimensions:
+        dimensions, _ = utils.parse_dimensions(args.dimensions)
+    elif truth:
+        # Synthetic captures: take the configuration from the ground truth
+        record = next(iter(truth.values()))
+        dimensions = [tuple(d) for d in record["dimensions"]]
+        id_num_digits = id_num_digits or record["id_num_digits"]
+    else:
+        raise ValueError("Answer box dimensions are required for this corpus")
+    return Corpus(frames, dimensions, id_num_digits=id_num_digits)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded frames through the detection pipeline."
+    )
+    parser.add_argument(
+        "corpus",
+        help="session directory, directory of images, multi-page TIFF or video file",
+    )
+    parser.add_argument(
+        "-d",
+        "--dimensions",
+        default=None,
+        help='answer box dimensions (e.g. "3,5;3,5"), except for sessions'
+        " and synthetic captures",
+    )
+    parser.add_argument(
+        "-i",
+        "--id-num-digits",
+        type=int,
+        default=0,
+        help="number of digits of the student id, except for sessions",
+    )
+    parser.add_argument("--no-id", action="store_true", help="do not read student ids")
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=None,
+        help="maximum number of detection attempts per frame",
+    )
+    parser.add_argument(
+        "--quality-gate",
+        action="store_true",
+        help="skip the frames that are moving or blurry",
+    )
+    parser.add_argument(
+        "--max-motion",
+        type=float,
+        default=detection.param_quality_gate_max_motion,
+        help="maximum motion energy for the quality gate",
+    )
+    parser.add_argument(
+        "--min-sharpness",
+        type=float,
+        default=detection.param_quality_gate_min_sharpness,
+        help="minimum sharpness for the quality gate",
+    )
+    parser.add_argument(
+        "--json", metavar="FILE", default=None, help="write the results as JSON"
+    )
+    parser.add_argument(
+        "--min-fps", type=float, default=None, help="fail below this frame rate"
+    )
+    parser.add_argument(
+        "--min-lock-rate", type=float, default=None, help="fail below this lock rate"
+    )
+    parser.add_argument(
+        "--min-agreement",
+        type=float,
+        default=None,
+        help="fail below this answer agreement",
+    )
+    args = parser.parse_args()
+    if args.max_attempts is not None and args.max_attempts < 1:
+        parser.error("--max-attempts must be at least 1")
+    return args
+
+
+def main():
+    args = _parse_args()
+    corpus = _open_corpus(args)
+    if args.quality_gate:
+        quality_gate = detection.FrameQualityGate(
+            max_motion=args.max_motion, min_sharpness=args.min_sharpness
+        )
+    else:
+        quality_gate = None
+    results = replay(
+        corpus,
+        max_attempts=args.max_attempts,
+        read_id=not args.no_id,
+        quality_gate=quality_gate,
+    )
+    print_report(results)
+    if args.json:
+        with open(args.json, mode="w") as f:
+            json.dump(results.as_dict(), f, indent=4)
+    failures = check_gates(
+        results,
+        min_fps=args.min_fps,
+        min_lock_rate=args.min_lock_rate,
+        min_agreement=args.min_agreement,
+    )
+    if failures:
+        print("Regression gates failed: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Measures the startup time of the detection pipeline.
+#
+# Each run is a new Python process, so that imports and model loading
+# are measured as users experience them. Stages report the time since
+# the process started running Python code, except "process", which is
+# the total time of the process, interpreter startup included.
+#
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+STAGES = ("import", "context", "crosses_classifier", "first_frame", "process")
+
+
+def _child(args):
+    start = time.perf_counter()
+    times = {}
+    from .. import utils
+    from .. import detection
+
+    times["import"] = time.perf_counter() - start
+    context = detection.ExamDetectorContext()
+    times["context"] = time.perf_counter() - start
+    context.crosses_classifier
+    times["crosses_classifier"] = time.perf_counter() - start
+    if args.image:
+        options = detection.ExamDetector.get_default_options()
+        options["capture-from-file"] = True
+        options["capture-raw-file"] = args.image
+        dimensions, _ = utils.parse_dimensions(args.dimensions)
+        detector = detection.ExamDetector(dimensions, context, options)
+        detector.detect()
+        times["first_frame"] = time.perf_counter() - start
+    print(json.dumps(times))
+
+
+def _run(args):
+    command = [sys.executable, "-m", "eyegrade.tools.startup_benchmark", "--child"]
+    if args.image:
+        command.extend(["--image", args.image, "--dimensions", args.dimensions])
+    start = time.perf_counter()
+    output = subprocess.run(
+        command, check=True, stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    total = time.perf_counter() - start
+    times = json.loads(output.splitlines()[-1])
+    times["process"] = total
+    return times
+
+
+def benchmark(args):
+    """Returns the median time since process start at each stage."""
+    runs = [_run(args) for _ in range(args.runs)]
+    return {
+        stage: statistics.median(run[stage] for run in runs)
+        for stage in STAGES
+        if stage in runs[0]
+    }
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the detection pipeline."
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="number of runs (default 5)"
+    )
+    parser.add_argument(
+        "--image", default=None, help="also measure the detection of this image"
+    )
+    parser.add_argument(
+        "--dimensions",
+        default="4,10;4,10",
+        help='answer box dimensions of the image (default "4,10;4,10")',
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    if args.child:
+        _child(args)
+        return
+    times = benchmark(args)
+    print("Median times, in ms ({} runs):".format(args.runs))
+    for stage in STAGES:
+        if stage in times:
+            print("{:<20}{:>10.1f}".format(stage, 1000 * times[stage]))
+
+
+if __name__ == "__main__":
+    main()
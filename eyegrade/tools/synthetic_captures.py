@@ -0,0 +1,633 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Renders synthetic captures of answer sheets with known contents.
+#
+# Answer tables are drawn on a blank sheet with the layout that
+# eyegrade-create produces (answer cells, infobits and, optionally,
+# the student id box) and marked with crosses. The sheet is then
+# warped into a camera frame with a random perspective, blurred,
+# lit with a gradient and noised. Each capture comes with its ground
+# truth: the answers, model and student id written on it and the
+# position of the cell corners in the frame.
+#
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import collections
+
+import cv2
+import numpy as np
+
+from .. import utils
+from .. import detection
+from ..create import sheets
+
+# File of the ground truth of the captures written to a directory,
+# with a JSON object per line:
+GROUND_TRUTH_FILE = "ground-truth.jsonl"
+
+# Sheet margins, in millimetres (the layout of the sheet itself is
+# the one of sheets.AnswerSheet):
+PEN_WIDTH = 0.45
+SHEET_MARGIN = 60.0
+CONTENT_MARGIN = 2.0
+
+PAPER_COLOR = (232, 236, 236)
+INK_COLOR = (30, 30, 30)
+PEN_COLOR = (150, 60, 30)
+BACKGROUND_COLOR = (70, 80, 90)
+
+# Rendering resolution of the sheet relative to the resolution of
+# the frame, for anti-aliasing:
+SUPERSAMPLING = 2
+
+SyntheticCapture = collections.namedtuple(
+    "SyntheticCapture",
+    ("image", "answers", "marks", "model", "student_id", "corners", "id_corners"),
+)
+SyntheticCapture.__doc__ = """A synthetic capture and its ground truth.
+
+`answers` contains the answer to each question as detection reports
+it (0 for blank or multiple marks, or the number of the marked
+choice starting at 1), and `marks` the tuple of marked choices of
+each question. `corners` contains the cell corners of each answer
+table in the frame, as a matrix of (x, y) points with a row per
+horizontal line of the table. `id_corners` contains the upper and
+lower corners of the id box, or is None when there is no id box.
+
+"""
+
+
+class RecordingContext(detection.ExamDetectorContext):
+    """Detection context that records the Hough thresholds used.
+
+    `thresholds` holds the threshold of every detection attempt, in
+    order, for checking how the thresholds are cycled.
+
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.thresholds = []
+
+    def get_hough_threshold(self):
+        threshold = super().get_hough_threshold()
+        self.thresholds.append(threshold)
+        return threshold
+
+
+class CaptureGenerator:
+    """Generates synthetic captures of answer sheets.
+
+    `dimensions` is the list of (num_choices, num_questions) pairs of
+    the answer tables. The distortion of the captures is controlled
+    by: `fill` (range of the fraction of the frame the tables take),
+    `perspective` (maximum displacement of each corner of the tables,
+    as a fraction of their size), `rotation` (maximum rotation in
+    degrees), `blur` (maximum sigma of the gaussian blur, in pixels),
+    `noise` (maximum standard deviation of the gaussian noise) and
+    `lighting` (maximum darkening of the lighting gradient, from 0
+    to 1). Each capture gets random values up to those limits. Set
+    them to 0 for clean captures.
+
+    """
+
+    def __init__(
+        self,
+        dimensions,
+        id_num_digits=0,
+        infobits=True,
+        left_to_right_numbering=False,
+        width=640,
+        height=480,
+        fill=(0.75, 0.95),
+        perspective=0.03,
+        rotation=2.5,
+        blur=1.2,
+        noise=3.0,
+        lighting=0.35,
+        seed=None,
+    ):
+        # Answer sheets printed by eyegrade-create have light letters
+        # in the cells, but captures are drawn without them:
+        self.sheet = sheets.AnswerSheet(
+            dimensions,
+            id_num_digits=id_num_digits,
+            infobits=infobits,
+            left_to_right_numbering=left_to_right_numbering,
+            cell_letters=False,
+        )
+        self.dimensions = self.sheet.dimensions
+        self.id_num_digits = id_num_digits
+        self.infobits = infobits
+        self.left_to_right_numbering = left_to_right_numbering
+        self.width = width
+        self.height = height
+        self.fill = fill
+        self.perspective = perspective
+        self.rotation = rotation
+        self.blur = blur
+        self.noise = noise
+        self.lighting = lighting
+        self.random = random.Random(seed)
+        self._np_random = np.random.default_rng(self.random.getrandbits(32))
+        self._compute_layout()
+
+    @property
+    def num_questions(self):
+        return self.sheet.num_questions
+
+    @property
+    def num_bits(self):
+        return self.sheet.num_bits
+
+    def models(self):
+        """Returns the models that the infobits can encode."""
+        return self.sheet.models()
+
+    def random_marks(self, blank_rate=0.1, multiple_rate=0.03):
+        """Returns random marks for the questions.
+
+        Each question is left blank with probability `blank_rate`,
+        gets two marks with probability `multiple_rate` and one mark
+        otherwise.
+
+        """
+        marks = []
+        for table, _ in self.sheet.question_cells:
+            num_choices = self.dimensions[table][0]
+            value = self.random.random()
+            if value < blank_rate:
+                marks.append(())
+            elif value < blank_rate + multiple_rate and num_choices > 1:
+                choices = self.random.sample(range(1, num_choices + 1), 2)
+                marks.append(tuple(sorted(choices)))
+            else:
+                marks.append((self.random.randint(1, num_choices),))
+        return marks
+
+    def generate(self, marks=None, model=None, student_id=None):
+        """Returns a new SyntheticCapture.
+
+        `marks` is a list with the tuple of marked choices (starting
+        at 1) of each question. Random marks, model and student id
+        are used for the ones not given.
+
+        """
+        marks, model, student_id = self._contents(marks, model, student_id)
+        homography, scale = self._random_homography()
+        ppm = SUPERSAMPLING * scale
+        sheet = self._render_sheet(ppm, marks, model, student_id)
+        image = self._warp(sheet, ppm, homography)
+        image = self._degrade(image, self._random_degradation())
+        return self._capture(image, homography, marks, model, student_id)
+
+    def generate_sequence(
+        self, num_moving, num_still, step=12.0, marks=None, model=None, student_id=None
+    ):
+        """Returns a list of captures of a sheet that moves and then stops.
+
+        The sheet slides `step` pixels per frame, with motion blur,
+        during the first `num_moving` frames, and stays still for the
+        next `num_still` frames, which only differ in their noise. It
+        simulates a sheet being placed under the camera.
+
+        """
+        marks, model, student_id = self._contents(marks, model, student_id)
+        homography, scale = self._random_homography()
+        ppm = SUPERSAMPLING * scale
+        sheet = self._render_sheet(ppm, marks, model, student_id)
+        degradation = self._random_degradation()
+        angle = self.random.uniform(0, 2 * math.pi)
+        direction = (math.cos(angle), math.sin(angle))
+        captures = []
+        for i in range(num_moving + num_still):
+            distance = step * max(0, num_moving - i)
+            shift = np.array(
+                [
+                    [1, 0, direction[0] * distance],
+                    [0, 1, direction[1] * distance],
+                    [0, 0, 1],
+                ]
+            )
+            frame_homography = shift.dot(homography)
+            image = self._warp(sheet, ppm, frame_homography)
+            if distance > 0:
+                image = _motion_blur(image, direction, step)
+            image = self._degrade(image, degradation)
+            captures.append(
+                self._capture(image, frame_homography, marks, model, student_id)
+            )
+        return captures
+
+    def _contents(self, marks, model, student_id):
+        if marks is None:
+            marks = self.random_marks()
+        elif len(marks) != self.num_questions:
+            raise ValueError(
+                "Marks expected for {} questions".format(self.num_questions)
+            )
+        if self.infobits:
+            if model is None:
+                model = self.random.choice(self.models())
+        else:
+            model = None
+        if self.id_num_digits:
+            if student_id is None:
+                student_id = "".join(
+                    str(self.random.randint(0, 9)) for _ in range(self.id_num_digits)
+                )
+            elif len(student_id) != self.id_num_digits:
+                raise ValueError("Wrong number of digits in the student id")
+        else:
+            student_id = None
+        return marks, model, student_id
+
+    def _warp(self, sheet, ppm, homography):
+        # From sheet pixels to layout coordinates:
+        to_layout = np.array(
+            [
+                [1 / ppm, 0, -self._offset[0]],
+                [0, 1 / ppm, -self._offset[1]],
+                [0, 0, 1],
+            ]
+        )
+        return cv2.warpPerspective(
+            sheet,
+            homography.dot(to_layout),
+            (self.width, self.height),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=BACKGROUND_COLOR,
+        )
+
+    def _capture(self, image, homography, marks, model, student_id):
+        answers = [m[0] if len(m) == 1 else 0 for m in marks]
+        corners = [
+            _transform(homography, table_corners) for table_corners in self._corners()
+        ]
+        if self.id_num_digits:
+            id_corners = _transform(homography, self._id_corners())
+        else:
+            id_corners = None
+        return SyntheticCapture(
+            image, answers, list(marks), model, student_id, corners, id_corners
+        )
+
+    def _compute_layout(self):
+        """Computes the position of the sheet in the rendered image, in mm."""
+        left, _, right, bottom = self.sheet.bounds
+        # Sheet coordinates: content shifted to leave a margin of paper
+        self._offset = (SHEET_MARGIN - left, SHEET_MARGIN)
+        self._content = (
+            left - CONTENT_MARGIN,
+            -sheets.CELL_HEIGHT - CONTENT_MARGIN,
+            right + CONTENT_MARGIN,
+            bottom + CONTENT_MARGIN,
+        )
+        self._sheet_size = (
+            right - left + 2 * SHEET_MARGIN,
+            bottom + 2 * SHEET_MARGIN,
+        )
+
+    def _corners(self):
+        return self.sheet.corners()
+
+    def _id_corners(self):
+        return self.sheet.id_corners()
+
+    def _random_homography(self):
+        """Returns a random homography from layout coordinates to the frame.
+
+        Also returns the approximate scale of the frame in pixels per mm.
+
+        """
+        rnd = self.random
+        x0, y0, x1, y1 = self._content
+        width, height = x1 - x0, y1 - y0
+        fill = rnd.uniform(*self.fill) if self.fill[0] < self.fill[1] else self.fill[0]
+        scale = fill * min(self.width / width, self.height / height)
+        angle = math.radians(rnd.uniform(-self.rotation, self.rotation))
+        cos, sin = math.cos(angle), math.sin(angle)
+        center = (
+            self.width / 2 + rnd.uniform(-1, 1) * (1 - fill) * self.width / 4,
+            self.height / 2 + rnd.uniform(-1, 1) * (1 - fill) * self.height / 4,
+        )
+        max_shift = self.perspective * scale * max(width, height)
+        src = []
+        dst = []
+        for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1)):
+            src.append((x, y))
+            dx = (x - (x0 + x1) / 2) * scale
+            dy = (y - (y0 + y1) / 2) * scale
+            dst.append(
+                (
+                    center[0] + cos * dx - sin * dy + rnd.uniform(-1, 1) * max_shift,
+                    center[1] + sin * dx + cos * dy + rnd.uniform(-1, 1) * max_shift,
+                )
+            )
+        dst = self._fit_in_frame(np.array(dst, dtype=np.float32))
+        homography = cv2.getPerspectiveTransform(np.array(src, dtype=np.float32), dst)
+        return homography, scale
+
+    def _fit_in_frame(self, points):
+        """Shrinks and moves the points, if needed, to keep them in the frame."""
+        low = points.min(axis=0)
+        high = points.max(axis=0)
+        frame = np.array([self.width - 1, self.height - 1], dtype=np.float32)
+        factor = min(1.0, float(np.min(frame / (high - low))))
+        points = low + (points - low) * factor
+        high = low + (high - low) * factor
+        return points - np.minimum(low, 0) - np.maximum(high - frame, 0)
+
+    def _render_sheet(self, ppm, marks, model, student_id):
+        width = int(math.ceil(self._sheet_size[0] * ppm))
+        height = int(math.ceil(self._sheet_size[1] * ppm))
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:, :] = PAPER_COLOR
+        pen = sheets.ImagePen(image, ppm, self._offset, ink=INK_COLOR)
+        self.sheet.draw(pen, model=model)
+        for question, (table, row) in enumerate(self.sheet.question_cells):
+            for choice in marks[question]:
+                self._draw_cross(
+                    pen, self.sheet.vlines[table][choice - 1], self.sheet.hlines[row]
+                )
+        if self.id_num_digits:
+            self._draw_student_id(pen, student_id)
+        return image
+
+    def _draw_cross(self, pen, left, top):
+        rnd = self.random
+
+        def point(x, y):
+            return (
+                left + (x + rnd.uniform(-0.05, 0.05)) * sheets.CELL_WIDTH,
+                top + (y + rnd.uniform(-0.05, 0.05)) * sheets.CELL_HEIGHT,
+            )
+
+        margin_x = rnd.uniform(0.12, 0.25)
+        margin_y = rnd.uniform(0.12, 0.25)
+        pen.line(
+            point(margin_x, margin_y),
+            point(1 - margin_x, 1 - margin_y),
+            color=PEN_COLOR,
+            width=PEN_WIDTH,
+        )
+        pen.line(
+            point(1 - margin_x, margin_y),
+            point(margin_x, 1 - margin_y),
+            color=PEN_COLOR,
+            width=PEN_WIDTH,
+        )
+
+    def _draw_student_id(self, pen, student_id):
+        top, bottom = self.sheet.id_hlines
+        for x, digit in zip(self.sheet.id_vlines, student_id):
+            pen.text(
+                digit,
+                (
+                    x + sheets.ID_CELL_WIDTH / 2 + self.random.uniform(-0.3, 0.3),
+                    (top + bottom) / 2 + self.random.uniform(-0.3, 0.3),
+                ),
+                0.65 * sheets.ID_CELL_HEIGHT,
+                color=PEN_COLOR,
+                font=cv2.FONT_HERSHEY_SCRIPT_SIMPLEX,
+                thickness=PEN_WIDTH,
+            )
+
+    def _random_degradation(self):
+        """Returns random (blur, lighting angle, darkening, noise) values."""
+        rnd = self.random
+        return (
+            rnd.uniform(0, self.blur),
+            rnd.uniform(0, 2 * math.pi),
+            rnd.uniform(0, self.lighting),
+            rnd.uniform(0, self.noise),
+        )
+
+    def _degrade(self, image, degradation):
+        sigma, angle, darkening, noise = degradation
+        image = image.astype(np.float32)
+        if sigma > 0.1:
+            image = cv2.GaussianBlur(image, (0, 0), sigma)
+        if darkening > 0:
+            xs, ys = np.meshgrid(
+                np.arange(self.width, dtype=np.float32),
+                np.arange(self.height, dtype=np.float32),
+            )
+            ramp = xs * math.cos(angle) + ys * math.sin(angle)
+            ramp = (ramp - ramp.min()) / max(1.0, float(ramp.max() - ramp.min()))
+            gain = 1 - darkening * ramp
+            image *= gain[:, :, np.newaxis]
+        if noise > 0:
+            image += self._np_random.normal(0, noise, image.shape).astype(np.float32)
+        return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def _motion_blur(image, direction, length):
+    """Blurs the image along the direction of the motion."""
+    size = max(3, int(round(length)) | 1)
+    kernel = np.zeros((size, size), dtype=np.float32)
+    center = size // 2
+    end = (
+        int(round(center + direction[0] * center)),
+        int(round(center + direction[1] * center)),
+    )
+    start = (2 * center - end[0], 2 * center - end[1])
+    cv2.line(kernel, start, end, 1.0)
+    return cv2.filter2D(image, -1, kernel / kernel.sum())
+
+
+def _transform(homography, matrix):
+    """Applies the homography to a matrix of points."""
+    points = np.array(matrix, dtype=np.float64).reshape(-1, 1, 2)
+    transformed = cv2.perspectiveTransform(points, homography)
+    rows = transformed.reshape(len(matrix), -1, 2).tolist()
+    return [[tuple(point) for point in row] for row in rows]
+
+
+def ground_truth(name, capture, generator):
+    """Returns the ground truth of a capture as a JSON-serializable dict."""
+    return {
+        "image": name,
+        "dimensions": generator.dimensions,
+        "id_num_digits": generator.id_num_digits,
+        "answers": capture.answers,
+        "marks": capture.marks,
+        "model": capture.model,
+        "student_id": capture.student_id,
+        "corners": _rounded(capture.corners),
+        "id_corners": _rounded(capture.id_corners),
+    }
+
+
+def _rounded(matrixes):
+    if matrixes is None:
+        return None
+    elif isinstance(matrixes, (int, float)):
+        return round(matrixes, 2)
+    else:
+        return [_rounded(item) for item in matrixes]
+
+
+def write_captures(
+    directory,
+    generator,
+    num_captures,
+    blank_rate=0.1,
+    multiple_rate=0.03,
+    num_moving=0,
+    num_still=0,
+):
+    """Writes captures as PNG files to the directory, with their ground truth.
+
+    The ground truth is written to the file GROUND_TRUTH_FILE of the
+    directory, with a JSON object per capture. If `num_moving` or
+    `num_still` are not 0, a sequence of frames (see
+    `CaptureGenerator.generate_sequence`) is written for each capture.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, GROUND_TRUTH_FILE), mode="w") as f:
+        for i in range(num_captures):
+            marks = generator.random_marks(
+                blank_rate=blank_rate, multiple_rate=multiple_rate
+            )
+            if num_moving or num_still:
+                captures = generator.generate_sequence(
+                    num_moving, num_still, marks=marks
+                )
+                names = [
+                    "capture-{:05d}-{:03d}.png".format(i, j)
+                    for j in range(len(captures))
+                ]
+            else:
+                captures = [generator.generate(marks=marks)]
+                names = ["capture-{:05d}.png".format(i)]
+            for name, capture in zip(names, captures):
+                cv2.imwrite(os.path.join(directory, name), capture.image)
+                print(json.dumps(ground_truth(name, capture, generator)), file=f)
+
+
+def read_ground_truth(directory):
+    """Returns the ground truth of a directory as a dict keyed by image name.
+
+    Returns an empty dict if the directory has no ground truth file.
+
+    """
+    filename = os.path.join(directory, GROUND_TRUTH_FILE)
+    if not os.path.isfile(filename):
+        return {}
+    records = {}
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record["image"]] = record
+    return records
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic captures of answer sheets."
+    )
+    parser.add_argument("directory", help="output directory")
+    parser.add_argument(
+        "-d",
+        "--dimensions",
+        required=True,
+        help='answer box dimensions (e.g. "3,5;3,5")',
+    )
+    parser.add_argument(
+        "-n", "--num-captures", type=int, default=100, help="number of captures"
+    )
+    parser.add_argument(
+        "-i",
+        "--id-num-digits",
+        type=int,
+        default=0,
+        help="number of digits of the student id box (none by default)",
+    )
+    parser.add_argument(
+        "--survey", action="store_true", help="do not draw the model infobits"
+    )
+    parser.add_argument(
+        "--left-to-right",
+        action="store_true",
+        help="number questions from left to right",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--width", type=int, default=640, help="frame width")
+    parser.add_argument("--height", type=int, default=480, help="frame height")
+    parser.add_argument(
+        "--clean", action="store_true", help="do not distort the captures"
+    )
+    parser.add_argument(
+        "--moving",
+        type=int,
+        default=0,
+        help="write sequences with this number of frames of a moving sheet",
+    )
+    parser.add_argument(
+        "--still",
+        type=int,
+        default=0,
+        help="number of still frames after the moving ones in sequences",
+    )
+    parser.add_argument("--blank-rate", type=float, default=0.1)
+    parser.add_argument("--multiple-rate", type=float, default=0.03)
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    dimensions, _ = utils.parse_dimensions(args.dimensions)
+    options = {}
+    if args.clean:
+        options = dict(perspective=0, rotation=0, blur=0, noise=0, lighting=0)
+    generator = CaptureGenerator(
+        dimensions,
+        id_num_digits=args.id_num_digits,
+        infobits=not args.survey,
+        left_to_right_numbering=args.left_to_right,
+        width=args.width,
+        height=args.height,
+        seed=args.seed,
+        **options,
+    )
+    write_captures(
+        args.directory,
+        generator,
+        args.num_captures,
+        blank_rate=args.blank_rate,
+        multiple_rate=args.multiple_rate,
+        num_moving=args.moving,
+        num_still=args.still,
+    )
+    print(
+        "{} captures written to {}".format(args.num_captures, args.directory),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
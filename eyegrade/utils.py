@@ -26,7 +26,6 @@ import contextlib
 
 from typing import Dict
 
-
 program_name = "eyegrade"
 web_location = "https://www.eyegrade.org/"
 source_location = "https://github.com/jfisteus/eyegrade"
@@ -34,6 +33,7 @@ help_location = "https://www.eyegrade.org/doc/user-manual/"
 version = "0.10dev1"
 
 re_model_letter = re.compile("[0a-zA-Z]")
+re_model_name = re.compile("[A-Z]+$")
 
 csv_tabs_dialect = "tabs"
 csv.register_dialect(csv_tabs_dialect, delimiter=str("\t"))
@@ -107,6 +107,10 @@ def _read_config():
         "save-filename-pattern": default_capture_pattern,
         "csv-dialect": "tabs",
         "default-charset": "utf8",  # special value: 'system-default'
+        "timing-log": None,
+        "quality-gate": "yes",
+        "quality-gate-max-motion": None,
+        "quality-gate-min-sharpness": None,
     }
     parser = configparser.ConfigParser()
     home = user_home()
@@ -132,6 +136,10 @@ def _read_config():
     else:
         conf["error-logging"] = False
     conf["camera-dev"] = int(conf["camera-dev"])
+    conf["quality-gate"] = conf["quality-gate"] == "yes"
+    for key in ("quality-gate-max-motion", "quality-gate-min-sharpness"):
+        if conf[key] is not None:
+            conf[key] = float(conf[key])
     if conf["default-charset"] == "system-default":
         conf["default-charset"] = locale.getpreferredencoding()
     if "gui-styles" in conf:
@@ -326,6 +334,65 @@ def _permute_answers(answers, permutation):
     return permutted
 
 
+def model_index(model):
+    """Returns the number of a model, starting at 0 for model "A".
+
+    Models after "Z" are named like spreadsheet columns: "AA", "AB"...
+    Raises an exception if `model` is not a valid model name.
+
+    """
+    if not model or not re_model_name.match(model):
+        raise Exception("Incorrect model letter")
+    index = 0
+    for letter in model:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def model_name(index):
+    """Returns the name of the model with the given number (see model_index)."""
+    name = []
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        name.append(chr(65 + remainder))
+    return "".join(reversed(name))
+
+
+def parse_models(text):
+    """Returns the list of models in a command line option.
+
+    Models are given as a concatenation of letters (ABC) or as a
+    comma-separated list of models (A,B,AA).
+
+    """
+    text = text.upper()
+    if "," in text:
+        return [model.strip() for model in text.split(",") if model.strip()]
+    else:
+        return list(text)
+
+
+def model_sort_key(model):
+    """Key for sorting models: "0", "A", "B"... "Z", "AA", "AB"..."""
+    return (len(model), model)
+
+
+def max_models(num_bits, extended=True):
+    """Returns how many models the given number of infobits can encode.
+
+    The classic encoding (see `encode_model`) is limited to 8 models
+    (A - H). The extended one can encode 8 ** (num_bits // 4) models.
+
+    """
+    if num_bits < 4:
+        return 2**num_bits
+    elif extended:
+        return 8 ** (num_bits // 4)
+    else:
+        return 8
+
+
 def encode_model(model, num_tables, num_answers):
     """Given the letter of the model, returns the infobits pattern.
 
@@ -334,55 +401,78 @@ def encode_model(model, num_tables, num_answers):
     The length of the string is 'num_tables' * 'num_answers', where
     'num_tables' is the number of answer tables and 'num_tables'
     the number of answers per question. The 'model' must be a
-    capital ASCII letter.
+    valid model name (see `model_index`).
+
+    Bits are grouped in blocks of four: three bits of the model
+    number and a parity bit. Models A - H repeat the same block
+    through all the infobits (classic encoding). Models beyond H use
+    the extended encoding, in which the first block has the three
+    lowest bits of the model number and each following block the
+    next three bits, xor-ed with the first block. Models A - H have
+    the same pattern in both encodings. The bits that do not fill a
+    block repeat the beginning of the first block.
 
     """
-    if len(model) != 1 or model < "A" or model > "Z":
-        raise Exception("Incorrect model letter")
-    if model > "H":
-        raise Exception("Model is currently limited to A - H")
-    model_num = ord(model) - 65
+    model_num = model_index(model)
     num_bits = num_tables * num_answers
-    if model_num >= 2**num_bits:
+    if model_num >= max_models(num_bits):
         raise Exception("Model number too big given the number of answers")
-    seed = _int_to_bin(model_num, 3, True)
-    seed[2] = not seed[2]
-    seed.append(seed[0] ^ seed[1] ^ seed[2])
-    seed[2] = not seed[2]
-    bit_list = seed * (1 + (num_bits - 1) // 4)
-    return bit_list[: num_tables * num_answers]
+    num_blocks = max(1, num_bits // 4)
+    digits = [(model_num >> (3 * i)) & 7 for i in range(num_blocks)]
+    blocks = [_model_block(digits[0])]
+    blocks.extend(_model_block(digit ^ digits[0]) for digit in digits[1:])
+    bit_list = [bit for block in blocks for bit in block] + blocks[0]
+    return bit_list[:num_bits]
 
 
-def decode_model(bit_list, accept_model_0=False):
+def decode_model(bit_list, accept_model_0=False, extended=False):
     """Given the bits that encode the model, returns the associated letter.
 
     It decoding/checksum fails, None is returned. The list of bits must
     be a list of boolean variables.
 
     The special model 0 is not valid unless `accept_model_0` is set.
+    Models encoded with the extended encoding are decoded only if
+    `extended` is set. Otherwise, every block must be the same.
 
     """
     # x3 = x0 ^ x1 ^ not x2; x0-x3 == x4-x7 == x8-x11 == ...
     valid = False
+    model_num = 0
     if len(bit_list) == 2 or len(bit_list) == 3:
         valid = True
+        model_num = _block_value(bit_list)
     elif len(bit_list) >= 4:
-        if bit_list[3] == bit_list[0] ^ bit_list[1] ^ (not bit_list[2]):
-            valid = True
-            for i in range(4, len(bit_list)):
-                if bit_list[i] != bit_list[i - 4]:
-                    valid = False
-                    break
-    if valid:
-        return chr(
-            65 + (int(bit_list[0]) | int(bit_list[1]) << 1 | int(bit_list[2]) << 2)
+        blocks = [bit_list[i : i + 4] for i in range(0, len(bit_list) - 3, 4)]
+        remainder = bit_list[4 * len(blocks) :]
+        valid = remainder == blocks[0][: len(remainder)] and all(
+            block[3] == block[0] ^ block[1] ^ (not block[2]) for block in blocks
         )
+        if valid and not extended:
+            valid = all(block == blocks[0] for block in blocks)
+        if valid:
+            first = _block_value(blocks[0])
+            model_num = first
+            for i, block in enumerate(blocks[1:], start=1):
+                model_num |= (_block_value(block) ^ first) << (3 * i)
+    if valid:
+        return model_name(model_num)
     elif accept_model_0 and max(bit_list) is False:
         return "0"
     else:
         return None
 
 
+def _model_block(digit):
+    block = _int_to_bin(digit, 3, True)
+    block.append(block[0] ^ block[1] ^ (not block[2]))
+    return block
+
+
+def _block_value(bits):
+    return sum(int(bit) << i for i, bit in enumerate(bits[:3]))
+
+
 def _int_to_bin(n, num_digits, reverse=False):
     """Returns the binary representation of a number as a list of booleans.
 
@@ -0,0 +1,457 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+
+# Grading of the images that a scanner drops into a directory.
+#
+# The directory is polled for new image files. A file is graded once
+# its size and modification time have not changed for a while,
+# because scanners write files progressively. On Linux, inotify wakes
+# the poller up as soon as a file is written, but polling remains the
+# reference: inotify does not report the files written by other
+# hosts to a network share. Graded files are moved to the
+# "processed" subdirectory and the rest to "failed".
+#
+# Files are identified by the digest of their contents in a ledger
+# stored in the session database. A file is recorded as graded in the
+# same transaction that stores its exam, so that after a restart
+# files already graded are not graded again, even if they were not
+# moved yet.
+#
+# Multi-page TIFF files are split into their pages, which are graded
+# as separate images and recorded in the ledger as "digest#page", so
+# that a restart grades only the pages that were not graded yet. The
+# file is moved when all its pages are done: to "failed" if any of
+# them failed.
+#
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+import hashlib
+import argparse
+import collections
+import concurrent.futures
+
+import cv2
+
+from . import utils
+from . import server
+from . import sources
+from . import stations
+
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+
+# inotify events that may mean that a file has been written
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+
+
+class FolderWatcher:
+    """Finds the image files of a directory that are ready to be read.
+
+    A file is ready when its size and modification time have not
+    changed for `settle_time` seconds, as observed by this object
+    (not the modification time itself, because the clock of the
+    scanner may differ). Each file is returned just once by `poll`,
+    unless it is written again.
+
+    """
+
+    def __init__(self, directory, settle_time=2.0, use_inotify=True):
+        self.directory = directory
+        self.settle_time = settle_time
+        self._seen = {}
+        self._returned = {}
+        self._inotify = _Inotify.open(directory) if use_inotify else None
+
+    @property
+    def settling(self):
+        """Number of files seen that are not ready yet."""
+        return sum(
+            1
+            for name, (signature, _) in self._seen.items()
+            if self._returned.get(name) != signature
+        )
+
+    def poll(self):
+        """Returns the names of the new files that are ready, sorted."""
+        now = time.monotonic()
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if (
+                    entry.name.startswith(".")
+                    or not entry.name.lower().endswith(sources.IMAGE_EXTENSIONS)
+                    or not entry.is_file()
+                ):
+                    continue
+                stat = entry.stat()
+                current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        ready = []
+        for name, signature in current.items():
+            if self._returned.get(name) == signature:
+                continue
+            seen = self._seen.get(name)
+            if seen is None or seen[0] != signature:
+                self._seen[name] = (signature, now)
+            elif signature[0] > 0 and now - seen[1] >= self.settle_time:
+                ready.append(name)
+                self._returned[name] = signature
+        for name in self._seen.keys() - current.keys():
+            del self._seen[name]
+            self._returned.pop(name, None)
+        return sorted(ready)
+
+    def wait(self, timeout):
+        """Waits for `timeout` seconds or, with inotify, until a file is written."""
+        if self._inotify is not None:
+            self._inotify.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class WatchDaemon:
+    """Grades the files that appear in a directory.
+
+    Files are graded by the worker pool (server.WorkerPool), which
+    must store the exams. The results are reported through
+    `on_result`, called with the file name, the result of
+    `server.exam_result` (None if the file failed) and an error
+    message (None on success). The pages of multi-page TIFF files
+    are reported separately, named "file#page" (starting at 0).
+
+    """
+
+    def __init__(
+        self,
+        directory,
+        writer,
+        pool,
+        settle_time=2.0,
+        poll_interval=1.0,
+        use_inotify=True,
+        on_result=None,
+    ):
+        self.directory = directory
+        self.writer = writer
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.on_result = on_result
+        self.watcher = FolderWatcher(directory, settle_time, use_inotify)
+        self.ledger = writer.processed_files()
+        self.graded = 0
+        self.failed = 0
+        self.skipped = 0
+        self._ready = collections.deque()
+        self._in_flight = {}
+
+    @property
+    def idle(self):
+        return not (self._ready or self._in_flight or self.watcher.settling)
+
+    def run(self, until_idle=False):
+        """Grades files until interrupted or, if `until_idle`, until idle."""
+        try:
+            while True:
+                self._ready.extend(self.watcher.poll())
+                self._submit_ready()
+                if until_idle and self.idle:
+                    break
+                if self._in_flight:
+                    done, _ = concurrent.futures.wait(
+                        self._in_flight,
+                        timeout=self.poll_interval,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    self._collect(done)
+                elif self.watcher.settling:
+                    self.watcher.wait(min(self.poll_interval, self.watcher.settle_time))
+                else:
+                    self.watcher.wait(self.poll_interval)
+        finally:
+            # Let the files being graded finish, but do not start new ones
+            self._collect(concurrent.futures.wait(self._in_flight)[0])
+            self.watcher.close()
+
+    def _submit_ready(self):
+        while self._ready:
+            if isinstance(self._ready[0], _PagedFile):
+                paged = self._ready[0]
+                if not self._submit_pages(paged):
+                    break
+                self._ready.popleft()
+                self._finish(paged)
+                continue
+            name = self._ready[0]
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, mode="rb") as f:
+                    data = f.read()
+            except OSError:
+                # The file was removed meanwhile
+                self._ready.popleft()
+                continue
+            digest = hashlib.sha1(data).hexdigest()
+            entry = self.ledger.get(digest)
+            if entry is not None and entry["status"] == "graded":
+                self._move(name, PROCESSED_DIR)
+                self.skipped += 1
+                self._ready.popleft()
+                continue
+            pages = _open_pages(path)
+            if pages is not None:
+                self._ready[0] = _PagedFile(name, digest, pages)
+                continue
+            try:
+                future = self.pool.submit(data, processed_file=(digest, name))
+            except server.Saturated:
+                break
+            self._ready.popleft()
+            self._in_flight[future] = (name, digest, None)
+
+    def _submit_pages(self, paged):
+        """Submits the pages of the file. Returns False if the pool is full."""
+        while paged.next_page < paged.pages.num_pages:
+            page = paged.next_page
+            name = "{}#{}".format(paged.name, page)
+            digest = "{}#{}".format(paged.digest, page)
+            if paged.data is None:
+                # Pages are read in order, even the ones to be skipped
+                success, image = paged.pages.read()
+                entry = self.ledger.get(digest)
+                if entry is not None and entry["status"] == "graded":
+                    paged.next_page += 1
+                    self.skipped += 1
+                    continue
+                if success:
+                    success, encoded = cv2.imencode(".png", image)
+                if not success:
+                    self._fail(name, digest, "Cannot read the page")
+                    paged.failed += 1
+                    paged.next_page += 1
+                    continue
+                paged.data = encoded.tobytes()
+            try:
+                future = self.pool.submit(paged.data, processed_file=(digest, name))
+            except server.Saturated:
+                return False
+            paged.data = None
+            paged.next_page += 1
+            paged.in_flight += 1
+            self._in_flight[future] = (name, digest, paged)
+        return True
+
+    def _collect(self, done):
+        for future in done:
+            name, digest, paged = self._in_flight.pop(future)
+            try:
+                result = future.result()[0]
+            except Exception as e:
+                self._fail(name, digest, str(e) or e.__class__.__name__)
+                if paged is None:
+                    self._move(name, FAILED_DIR)
+                else:
+                    paged.failed += 1
+            else:
+                self.ledger[digest] = {"status": "graded"}
+                if paged is None:
+                    self._move(name, PROCESSED_DIR)
+                self.graded += 1
+                if self.on_result is not None:
+                    self.on_result(name, result, None)
+            if paged is not None:
+                paged.in_flight -= 1
+                self._finish(paged)
+
+    def _fail(self, name, digest, message):
+        self.writer.record_processed_file(digest, name, "failed", message)
+        self.failed += 1
+        if self.on_result is not None:
+            self.on_result(name, None, message)
+
+    def _finish(self, paged):
+        """Moves a multi-page file once all its pages are done."""
+        if paged.next_page == paged.pages.num_pages and not paged.in_flight:
+            paged.pages.release()
+            self._move(paged.name, FAILED_DIR if paged.failed else PROCESSED_DIR)
+
+    def _move(self, name, subdirectory):
+        target_dir = os.path.join(self.directory, subdirectory)
+        os.makedirs(target_dir, exist_ok=True)
+        base, extension = os.path.splitext(name)
+        target = os.path.join(target_dir, name)
+        i = 1
+        while os.path.exists(target):
+            target = os.path.join(target_dir, "{}-{}{}".format(base, i, extension))
+            i += 1
+        try:
+            os.replace(os.path.join(self.directory, name), target)
+        except FileNotFoundError:
+            pass
+
+
+class _PagedFile:
+    """A multi-page TIFF file whose pages are being submitted."""
+
+    def __init__(self, name, digest, pages):
+        self.name = name
+        self.digest = digest
+        self.pages = pages
+        self.next_page = 0
+        self.in_flight = 0
+        self.failed = 0
+        # The encoded next page, while the pool is full
+        self.data = None
+
+
+def _open_pages(path):
+    """Returns the pages of a TIFF file with more than one page, or None."""
+    if not path.lower().endswith(sources.TIFF_EXTENSIONS):
+        return None
+    try:
+        pages = sources.TiffPages(path)
+    except (ValueError, cv2.error):
+        # Unreadable files fail when graded as a single image
+        return None
+    return pages if pages.num_pages > 1 else None
+
+
+class _Inotify:
+    """Minimal access to Linux inotify through the C library."""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, directory):
+        """Returns a watch on the directory, or None if inotify is not available."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError, TypeError):
+            return None
+        if fd < 0:
+            return None
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return cls(fd)
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            # The events are not needed: the directory is polled anyway
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Grade the exam images that appear in a directory."
+    )
+    parser.add_argument("session", help="session directory or database file")
+    parser.add_argument("directory", help="directory to watch")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=2, help="number of grading workers"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="seconds a file must stay unchanged before grading it",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="seconds between polls"
+    )
+    parser.add_argument(
+        "--until-idle",
+        action="store_true",
+        help="exit when there are no more files to grade",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    if not os.path.isdir(args.directory):
+        print("Not a directory: {}".format(args.directory), file=sys.stderr)
+        sys.exit(1)
+    try:
+        writer = stations.SessionWriter(args.session)
+    except utils.EyegradeException as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    def report(name, result, error):
+        if result is not None:
+            print(
+                "{}: exam {}, score {}".format(
+                    name, result["exam_id"], result["score"]["score"]
+                )
+            )
+        else:
+            print("{}: failed: {}".format(name, error))
+
+    options = stations.detection_options(writer.exam_config, utils.config)
+    pool = server.WorkerPool(
+        writer,
+        options,
+        num_workers=args.workers,
+        queue_size=2 * args.workers,
+        store=True,
+    )
+    daemon = WatchDaemon(
+        args.directory,
+        writer,
+        pool,
+        settle_time=args.settle,
+        poll_interval=args.interval,
+        on_result=report,
+    )
+    try:
+        daemon.run(until_idle=args.until_idle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+        writer.close()
+    print(
+        "Graded: {}, failed: {}, already graded: {}".format(
+            daemon.graded, daemon.failed, daemon.skipped
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
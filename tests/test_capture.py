@@ -45,7 +45,15 @@ def _mock_read_infobits(image, corner_matrixes):
     return [False, True, False, False, False, True]
 
 
-detection.read_infobits = _mock_read_infobits
+_read_infobits = detection.read_infobits
+
+
+def setUpModule():
+    detection.read_infobits = _mock_read_infobits
+
+
+def tearDownModule():
+    detection.read_infobits = _read_infobits
 
 
 class TestDetection(unittest.TestCase):
@@ -74,6 +82,14 @@ class TestDetection(unittest.TestCase):
         self.assertTrue(detector.decisions.answers[4] in range(4))
         self.assertEqual(len(detector.decisions.model), 1)
 
+    def test_classifiers_are_loaded_lazily(self):
+        context = detection.ExamDetectorContext()
+        self.assertIsNone(context._ocr)
+        self.assertIsNone(context._crosses_classifier)
+        crosses_classifier = context.crosses_classifier
+        self.assertIs(context.crosses_classifier, crosses_classifier)
+        self.assertIsNone(context._ocr)
+
     def test_detect_capture_with_id(self):
         image_path = self._get_test_file_path("capture.png")
         options = detection.ExamDetector.get_default_options()
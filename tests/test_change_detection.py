@@ -0,0 +1,72 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import numpy as np
+
+import eyegrade.detection as detection
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+class TestExamChangeDetector(unittest.TestCase):
+    def setUp(self):
+        self.dimensions = [(3, 5)]
+        generator = synthetic_captures.CaptureGenerator(
+            self.dimensions, id_num_digits=9, seed=4
+        )
+        self.image = generator.generate().image
+        options = detection.ExamDetector.get_default_options()
+        for threshold in detection.param_hough_thresholds:
+            self.context = detection.ExamDetectorContext(
+                fixed_hough_threshold=threshold
+            )
+            detector = detection.ExamDetector(
+                self.dimensions, self.context, options, image_raw=self.image
+            )
+            if detector.detect():
+                break
+        self.assertTrue(detector.success)
+        self.change_detector = detection.ExamChangeDetector(
+            detector.capture, self.dimensions, self.context, options
+        )
+
+    def test_same_exam(self):
+        darker = (self.image * 0.8).astype(np.uint8)
+        self.assertTrue(self.change_detector.exam_present(darker))
+        self.assertFalse(self.change_detector.used_hough)
+        self.assertGreater(self.change_detector.similarity, 0.95)
+
+    def test_exam_removed(self):
+        background = np.full_like(self.image, 120)
+        self.assertFalse(self.change_detector.exam_present(background))
+        self.assertFalse(self.change_detector.used_hough)
+        other = synthetic_captures.CaptureGenerator(
+            self.dimensions, id_num_digits=9, seed=5
+        ).generate()
+        self.assertFalse(self.change_detector.exam_present(other.image))
+
+    def test_ambiguous_frames_fall_back_to_hough(self):
+        moved = np.roll(self.image, (5, 8), axis=(0, 1))
+        self.assertTrue(self.change_detector.exam_present(moved))
+        self.assertTrue(self.change_detector.used_hough)
+
+    def test_signature_roi(self):
+        self.assertEqual(detection.signature_roi(None, 640, 480), (0, 0, 640, 480))
+        x0, y0, x1, y1 = self.change_detector.roi
+        self.assertTrue(0 <= x0 < x1 <= 640 and 0 <= y0 < y1 <= 480)
+        self.assertEqual(self.change_detector.reference.shape, (24, 32))
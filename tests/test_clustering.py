@@ -0,0 +1,203 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import math
+import random
+import unittest
+
+import eyegrade.clustering as clustering
+import eyegrade.detection as detection
+import eyegrade.geometry as g
+
+# Number of random cases checked for each property
+NUM_CASES = 300
+
+
+# Reference implementations: the loop-based versions of these
+# functions that the vectorized ones must be compatible with.
+#
+def _reference_detect_directions(lines, threshold):
+    axes = []
+    rho, theta = lines[0]
+    axes.append((theta, [(rho, theta)]))
+    for rho, theta in lines[1:]:
+        if abs(theta - axes[-1][0]) < threshold:
+            axes[-1][1].append((rho, theta))
+        else:
+            axes.append((theta, [(rho, theta)]))
+    if abs(axes[0][0] - axes[-1][0] + math.pi) < threshold:
+        axes[0][1].extend([(-rho, theta - math.pi) for rho, theta in axes[-1][1]])
+        del axes[-1]
+    for i in range(0, len(axes)):
+        avg = sum([theta for rho, theta in axes[i][1]]) / len(axes[i][1])
+        axes[i] = (avg, sorted(axes[i][1], key=lambda x: abs(x[0])))
+    if abs(axes[-1][0] - math.pi) < abs(axes[0][0]):
+        axes = axes[-1:] + axes[0:-1]
+    return axes
+
+
+def _reference_collapse_lines(lines, horizontal, maxgap):
+    main_lines = []
+    sum_rho = lines[0][0]
+    sum_theta = lines[0][1]
+    num_lines = 1
+    last_line = lines[0]
+    for line in lines[1:]:
+        if (
+            (
+                (horizontal and line[1] > last_line[1])
+                or (not horizontal and line[1] < last_line[1])
+            )
+            and abs(line[0] - last_line[0]) >= 5
+        ) or abs(line[0] - last_line[0]) > maxgap:
+            main_lines.append((sum_rho / num_lines, sum_theta / num_lines))
+            sum_rho = line[0]
+            sum_theta = line[1]
+            num_lines = 1
+        else:
+            sum_rho += line[0]
+            sum_theta += line[1]
+            num_lines += 1
+        last_line = line
+    main_lines.append((sum_rho / num_lines, sum_theta / num_lines))
+    return main_lines
+
+
+def _reference_filter_border_lines(lines, image_size, reference_angle):
+    return [
+        line
+        for line in lines
+        if (
+            (abs(line[0]) < 0.97 * image_size and abs(line[0]) > 0.03 * image_size)
+            or not g.angles_perpendicular(reference_angle, line[1])
+        )
+    ]
+
+
+def _random_hough_lines(rnd):
+    """Random lines that resemble the output of detection.detect_lines.
+
+    Lines concentrate around a few random directions, some of them
+    close to 0 and pi in order to exercise the wrap-around of angles.
+
+    """
+    centers = [rnd.choice((0.02, math.pi / 2, math.pi - 0.03))]
+    centers.extend(rnd.uniform(0, math.pi) for _ in range(rnd.randint(0, 3)))
+    lines = []
+    for _ in range(rnd.randint(2, 120)):
+        theta = rnd.choice(centers) + rnd.gauss(0, 0.05)
+        theta = min(max(theta, 0.0), math.pi - 0.01)
+        theta = round(theta, 2)
+        rho = float(rnd.randint(-700, 700))
+        if theta < 0.2 or theta > math.pi - 0.2:
+            rho = abs(rho)
+        lines.append((rho, theta))
+    return sorted(lines, key=lambda x: x[1])
+
+
+def _random_axis_lines(rnd):
+    """Random lines of an axis, sorted by the absolute value of rho."""
+    lines = []
+    rho = rnd.uniform(-20, 50)
+    theta = rnd.uniform(0, math.pi)
+    for _ in range(rnd.randint(0, 40)):
+        rho += rnd.choice((0, 1, 2, 3, 5, 6, 7, 8, 12, 30))
+        lines.append((rho, theta + rnd.choice((-0.01, 0, 0, 0.01))))
+    return sorted(lines, key=lambda x: abs(x[0]))
+
+
+class TestClustering(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(1234)
+
+    def _assert_lines_equal(self, lines1, lines2):
+        self.assertEqual(len(lines1), len(lines2))
+        for line1, line2 in zip(lines1, lines2):
+            self.assertAlmostEqual(line1[0], line2[0])
+            self.assertAlmostEqual(line1[1], line2[1])
+
+    def test_as_lines_array(self):
+        array = clustering.as_lines_array([[[3.0, 0.5]], [[-1.0, 1.5]]])
+        self.assertEqual(array.shape, (2, 2))
+        self.assertEqual(clustering.as_lines_array([]).shape, (0, 2))
+        self.assertEqual(clustering.to_line_tuples(array), [(3.0, 0.5), (-1.0, 1.5)])
+
+    def test_sort_by_theta_is_stable(self):
+        for _ in range(NUM_CASES):
+            lines = [
+                (float(self.rnd.randint(0, 9)), round(self.rnd.random(), 1))
+                for _ in range(self.rnd.randint(1, 50))
+            ]
+            sorted_lines = clustering.sort_by_theta(lines)
+            self.assertEqual(
+                clustering.to_line_tuples(sorted_lines),
+                sorted(lines, key=lambda x: x[1]),
+            )
+
+    def test_angles_perpendicular(self):
+        angles = [self.rnd.uniform(-math.pi, 2 * math.pi) for _ in range(NUM_CASES)]
+        for angle in (0.0, math.pi / 2, 1.0):
+            result = clustering.angles_perpendicular(
+                angle, clustering.as_lines_array([(0, a) for a in angles])[:, 1]
+            )
+            expected = [g.angles_perpendicular(angle, a) for a in angles]
+            self.assertEqual(result.tolist(), expected)
+
+    def test_detect_directions(self):
+        threshold = detection.param_directions_threshold
+        for _ in range(NUM_CASES):
+            lines = _random_hough_lines(self.rnd)
+            expected = _reference_detect_directions(lines, threshold)
+            axes = detection.detect_directions(lines)
+            self.assertEqual(len(axes), len(expected))
+            for (theta, ax_lines), (ref_theta, ref_lines) in zip(axes, expected):
+                self.assertAlmostEqual(theta, ref_theta)
+                self.assertEqual(ax_lines, ref_lines)
+
+    def test_detect_directions_keeps_all_lines(self):
+        for _ in range(NUM_CASES):
+            lines = clustering.as_lines_array(_random_hough_lines(self.rnd))
+            axes = clustering.detect_directions(lines, 0.4)
+            self.assertEqual(sum(len(ax) for _, ax in axes), len(lines))
+            for theta, ax in axes:
+                rhos = abs(ax[:, 0])
+                self.assertTrue((rhos[1:] >= rhos[:-1]).all())
+                self.assertTrue(ax[:, 1].min() <= theta <= ax[:, 1].max())
+
+    def test_collapse_lines_angles(self):
+        for _ in range(NUM_CASES):
+            lines = _random_axis_lines(self.rnd)
+            for horizontal in (True, False):
+                collapsed = detection.collapse_lines_angles(lines, horizontal)
+                if len(lines) < 2:
+                    self.assertIsNone(collapsed)
+                else:
+                    expected = _reference_collapse_lines(
+                        lines, horizontal, detection.param_collapse_lines_maxgap
+                    )
+                    self._assert_lines_equal(collapsed, expected)
+
+    def test_filter_border_lines(self):
+        for _ in range(NUM_CASES):
+            lines = _random_hough_lines(self.rnd)
+            for reference_angle in (0.0, math.pi / 2):
+                size = self.rnd.randint(100, 1400)
+                filtered = clustering.filter_border_lines(lines, size, reference_angle)
+                self.assertEqual(
+                    clustering.to_line_tuples(filtered),
+                    _reference_filter_border_lines(lines, size, reference_angle),
+                )
@@ -0,0 +1,84 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import eyegrade.ocr.sample as sample
+import eyegrade.ocr.dataset as dataset
+import eyegrade.ocr.features as features
+import eyegrade.ocr.preprocessing as preprocessing
+
+
+class TestPackedDataset(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        shutil.copy(os.path.join(dirname, "cross.png"), self.dir_name)
+        self.index_file = os.path.join(self.dir_name, "crosses.txt")
+        with open(self.index_file, mode="w") as f:
+            for i in range(5):
+                print(
+                    "cross.png\t{}\t{}\t0\t27\t0\t1\t32\t29\t32".format(i % 2, i),
+                    file=f,
+                )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_convert(self):
+        original = sample.SampleLoader(self.index_file).samples()
+        output_dir = os.path.join(self.dir_name, "packed")
+        shard_files = dataset.write_dataset(output_dir, original, shard_size=2)
+        self.assertEqual(len(shard_files), 3)
+        loader = dataset.open_loader(output_dir)
+        self.assertIsInstance(loader, dataset.PackedSampleLoader)
+        packed = loader.samples()
+        self.assertEqual(len(packed), 5)
+        for samp, packed_samp in zip(original, packed):
+            cropped = samp.crop()
+            self.assertEqual(packed_samp.label, samp.label)
+            self.assertTrue(np.array_equal(packed_samp.image, cropped.image))
+            self.assertTrue(np.array_equal(packed_samp.corners, cropped.corners))
+        self.assertIsInstance(dataset.Shard(shard_files[0]).pixels, np.memmap)
+        sample_set = sample.SampleSet()
+        sample_set.load_from_loader(dataset.open_loader(shard_files[2]))
+        self.assertEqual(len(sample_set), 1)
+
+    def test_feature_store(self):
+        extractor = preprocessing.CrossesFeatureExtractor()
+        output_dir = os.path.join(self.dir_name, "packed")
+        dataset.write_dataset(
+            output_dir, sample.SampleLoader(self.index_file).iterate_samples()
+        )
+        samples = dataset.PackedSampleLoader(output_dir).samples()
+        store = features.FeatureStore(os.path.join(self.dir_name, "cache"), extractor)
+        matrix = store.features(samples)
+        self.assertEqual(store.num_extractions, 5)
+        self.assertTrue(np.array_equal(matrix[3], extractor.extract(samples[3])))
+        store.features(dataset.PackedSampleLoader(output_dir).samples())
+        self.assertEqual(store.num_extractions, 5)
+
+    def test_empty_dataset(self):
+        output_dir = os.path.join(self.dir_name, "packed")
+        shard_files = dataset.write_dataset(output_dir, [])
+        self.assertEqual(len(shard_files), 1)
+        self.assertEqual(dataset.PackedSampleLoader(output_dir).samples(), [])
@@ -0,0 +1,137 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import random
+import tempfile
+import types
+import unittest
+
+import eyegrade.capture as capture
+import eyegrade.duplicates as duplicates
+import eyegrade.exams as exams
+import eyegrade.sessiondb as sessiondb
+import eyegrade.students as students
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+def exam_capture(synthetic_capture):
+    """Returns an ExamCapture with the cells of the ground truth."""
+    answer_cells = []
+    for corners in synthetic_capture.corners:
+        for upper, lower in zip(corners[:-1], corners[1:]):
+            answer_cells.append(
+                [
+                    capture.CellGeometry(
+                        upper[j], upper[j + 1], lower[j], lower[j + 1], None, None
+                    )
+                    for j in range(len(upper) - 1)
+                ]
+            )
+    return capture.ExamCapture(synthetic_capture.image, answer_cells, [])
+
+
+class TestSheetHash(unittest.TestCase):
+    def test_same_sheet(self):
+        generator = synthetic_captures.CaptureGenerator([(4, 10), (4, 10)], seed=2)
+        for _ in range(5):
+            marks = generator.random_marks()
+            hashes = [
+                exam_capture(generator.generate(marks=marks, model="A")).sheet_hash()
+                for _ in range(2)
+            ]
+            other = exam_capture(generator.generate(model="A")).sheet_hash()
+            self.assertTrue(all(0 <= h < 1 << duplicates.HASH_BITS for h in hashes))
+            self.assertLessEqual(
+                duplicates.hamming_distance(*hashes), duplicates.MAX_DISTANCE
+            )
+            self.assertGreater(
+                duplicates.hamming_distance(hashes[0], other), duplicates.MAX_DISTANCE
+            )
+
+    def test_no_answer_cells(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=2)
+        image = generator.generate().image
+        self.assertIsNone(capture.ExamCapture(image, [], []).sheet_hash())
+
+
+class TestHashIndex(unittest.TestCase):
+    def test_find(self):
+        rnd = random.Random(1)
+        hashes = {i: rnd.getrandbits(64) for i in range(2000)}
+        # Hashes near the first one:
+        for i, num_bits in enumerate((0, 3, 7, 12, 13, 20), start=2000):
+            bits = rnd.sample(range(64), num_bits)
+            hashes[i] = hashes[0] ^ sum(1 << bit for bit in bits)
+        index = duplicates.HashIndex()
+        for key, value in hashes.items():
+            index.add(key, value)
+        self.assertEqual(len(index), 2006)
+        expected = sorted(
+            (duplicates.hamming_distance(hashes[0], value), key)
+            for key, value in hashes.items()
+            if duplicates.hamming_distance(hashes[0], value) <= 12
+        )
+        self.assertEqual(index.find(hashes[0]), expected)
+        self.assertEqual([key for _, key in expected[:5]], [0, 2000, 2001, 2002, 2003])
+        index.remove(2001)
+        index.remove(2001)
+        self.assertNotIn(2001, index)
+        self.assertEqual(
+            [key for _, key in index.find(hashes[0])[:4]], [0, 2000, 2002, 2003]
+        )
+
+
+class TestSessionDuplicates(unittest.TestCase):
+    def test_find_duplicates(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 10)], seed=4)
+        marks = generator.random_marks()
+        first, second = [
+            exam_capture(generator.generate(marks=marks, model="A")) for _ in range(2)
+        ]
+        other = exam_capture(generator.generate(model="A"))
+        exam_config = exams.ExamConfig()
+        exam_config.set_dimensions("3,10")
+        listing = students.GroupListing(students.StudentGroup(1, "G"), [])
+        listing.add_students(
+            [
+                students.Student("1", "Donald Duck", "", "", ""),
+                students.Student("2", "Peter Pan", "", "", ""),
+            ]
+        )
+        listings = students.StudentListings()
+        listings.add_listing(listing)
+        score = types.SimpleNamespace(correct=0, incorrect=0, blank=0, score=0)
+        with tempfile.TemporaryDirectory() as dir_name:
+            session_dir = os.path.join(dir_name, "session")
+            sessiondb.create_session_directory(session_dir, exam_config, listings)
+            session = sessiondb.SessionDB(session_dir)
+            donald, peter = session.get_students()
+            decisions = types.SimpleNamespace(
+                student=donald, model="A", answers=[0] * 10
+            )
+            session.store_exam(1, first, decisions, score, store_captures=False)
+            self.assertEqual(session.find_duplicates(second), [1])
+            self.assertEqual(session.find_duplicates(second, student=donald), [1])
+            self.assertEqual(session.find_duplicates(second, student=peter), [])
+            self.assertEqual(session.find_duplicates(other), [])
+            session.close()
+            session = sessiondb.SessionDB(session_dir)
+            self.assertEqual(session.find_duplicates(second), [1])
+            session.remove_exam(1)
+            self.assertEqual(session.find_duplicates(second), [])
+            session.close()
@@ -0,0 +1,100 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import random
+import unittest
+
+import cv2
+import numpy as np
+
+import eyegrade.ocr.sample as sample
+import eyegrade.ocr.classifiers as classifiers
+import eyegrade.ocr.evaluation as evaluation
+
+
+def _sample_set(num_samples, seed):
+    """Random blank (label 0) and crossed (label 1) cells."""
+    rnd = np.random.RandomState(seed)
+    sample_set = sample.SampleSet()
+    corners = np.array([[2, 2], [29, 2], [2, 29], [29, 29]])
+    samples = []
+    for i in range(num_samples):
+        image = np.full((32, 32), 255, dtype=np.uint8)
+        label = i % 3 == 0
+        if label:
+            a, b = rnd.randint(4, 10, size=2)
+            cv2.line(image, (a, b), (31 - b, 31 - a), 0, 2)
+            cv2.line(image, (31 - a, b), (b, 31 - a), 0, 2)
+        noise = rnd.randint(0, 2, size=image.shape) * rnd.randint(0, 60)
+        image = (image - noise).clip(0, 255).astype(np.uint8)
+        samples.append(sample.Sample(corners, image=image, label=int(label)))
+    sample_set.load_from_samples(samples)
+    return sample_set
+
+
+class TestKFoldCrossEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.sample_set = _sample_set(60, 17)
+        self.classifier = classifiers.DefaultCrossesClassifier(load_from_file=None)
+
+    def test_partition(self):
+        partitions = self.sample_set.partition(4, seed=3)
+        self.assertEqual([len(p) for p in partitions], [15, 15, 15, 15])
+        samples = [s for p in partitions for s in p]
+        self.assertEqual(set(samples), set(self.sample_set))
+        again = self.sample_set.partition(4, seed=3)
+        self.assertEqual([list(p) for p in partitions], [list(p) for p in again])
+
+    def test_parallel_results(self):
+        partitions = self.sample_set.partition(4, seed=0)
+        params = dict(C=10, gamma=0.01)
+        serial = evaluation.KFoldCrossEvaluation(
+            self.classifier, partitions, oversampling=True, training_params=params
+        )
+        self.assertEqual(serial.rounds, 4)
+        self.assertEqual(serial.confusion_matrix.sum(), 60)
+        with evaluation.FoldEvaluator(
+            self.classifier, partitions, oversampling=True, num_workers=2
+        ) as evaluator:
+            evaluator.submit(params)
+            parallel = evaluation.KFoldCrossEvaluation(
+                self.classifier,
+                partitions,
+                training_params=params,
+                evaluator=evaluator,
+            )
+        self.assertTrue(
+            np.array_equal(serial.confusion_matrix, parallel.confusion_matrix)
+        )
+
+    def test_threshold(self):
+        partitions = self.sample_set.partition(4, seed=0)
+        e = evaluation.KFoldCrossEvaluation(
+            self.classifier,
+            partitions,
+            training_params=dict(C=10, gamma=0.01),
+            threshold=1.1,
+        )
+        self.assertEqual(e.rounds, 1)
+        self.assertEqual(e.confusion_matrix.sum(), 15)
+
+    def test_oversample(self):
+        labels = np.array([0, 1, 1, 1, 1, 0, 1])
+        indices = np.array([0, 1, 2, 3, 5, 6])
+        oversampled = evaluation._oversample(indices, labels, random.Random(0))
+        self.assertEqual(sorted(labels[oversampled].tolist()), [0] * 4 + [1] * 4)
+        self.assertTrue(set(oversampled.tolist()) <= set(indices.tolist()))
@@ -70,3 +70,25 @@ class TestExamConfigParser(unittest.TestCase):
         exam_config = exams.ExamConfig()
         with self.assertRaises(utils.EyegradeException):
             exam_config._read_config_parser(exam_data)
+
+    def test_extended_models(self):
+        config_text = """
+            [exam]
+                dimensions: 3,2;3,2
+                id-num-digits: 0
+
+                [solutions]
+                model-B: 1/2/3/1
+                model-AB: 2/2/1/1
+                model-A: 3/1/2/1
+                model-J: 1/1/1/1
+        """
+        exam_data = configparser.ConfigParser()
+        exam_data.read_string(config_text)
+        exam_config = exams.ExamConfig()
+        exam_config._read_config_parser(exam_data)
+        self.assertEqual(exam_config.models, ["A", "B", "J", "AB"])
+        self.assertEqual(exam_config.solutions["AB"], [{2}, {2}, {1}, {1}])
+        self.assertTrue(exam_config.extended_models())
+        exam_config.models = ["A", "B", "H"]
+        self.assertFalse(exam_config.extended_models())
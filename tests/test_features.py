@@ -0,0 +1,87 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import eyegrade.ocr.sample as sample
+import eyegrade.ocr.features as features
+import eyegrade.ocr.preprocessing as preprocessing
+
+
+class TestFeatureStore(unittest.TestCase):
+    def _get_test_file_path(self, filename):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(dirname, filename)
+
+    def _samples(self, shifts):
+        image_path = self._get_test_file_path("cross.png")
+        return [
+            sample.Sample(
+                np.array([[0, 0], [27, 0], [1, 32], [29, 32]]) + shift,
+                image_filename=image_path,
+                label=0,
+            )
+            for shift in shifts
+        ]
+
+    def test_features_are_extracted_once(self):
+        extractor = preprocessing.CrossesFeatureExtractor()
+        samples = self._samples((0, 1, 2))
+        expected = np.array([extractor.extract(s) for s in samples])
+        with tempfile.TemporaryDirectory() as dir_name:
+            store = features.FeatureStore(dir_name, extractor)
+            matrix = store.features(samples)
+            self.assertTrue(np.array_equal(matrix, expected))
+            self.assertEqual(store.num_extractions, 3)
+            store.features(samples[::-1])
+            self.assertEqual(store.num_extractions, 3)
+            # A new store on the same directory reuses the stored features:
+            store = features.FeatureStore(dir_name, extractor)
+            self.assertEqual(len(store), 3)
+            matrix = store.features(samples + self._samples((3,)))
+            self.assertTrue(np.array_equal(matrix[:3], expected))
+            self.assertEqual(store.num_extractions, 1)
+            self.assertEqual(len(store), 4)
+
+    def test_extractor_config(self):
+        samples = self._samples((0,))
+        with tempfile.TemporaryDirectory() as dir_name:
+            store = features.FeatureStore(
+                dir_name, preprocessing.CrossesFeatureExtractor()
+            )
+            store.features(samples)
+            store = features.FeatureStore(
+                dir_name, preprocessing.CrossesFeatureExtractor(dim=20)
+            )
+            self.assertEqual(len(store), 0)
+            self.assertEqual(store.features(samples).shape, (1, 400))
+            self.assertEqual(store.num_extractions, 1)
+
+    def test_samples_without_file(self):
+        extractor = preprocessing.CrossesFeatureExtractor()
+        samp = self._samples((0,))[0]
+        in_memory = sample.Sample(samp.corners, image=samp.image)
+        with tempfile.TemporaryDirectory() as dir_name:
+            store = features.FeatureStore(dir_name, extractor)
+            matrix = store.features([in_memory, in_memory])
+            self.assertEqual(store.num_extractions, 2)
+            self.assertEqual(len(store), 0)
+            self.assertTrue(np.array_equal(matrix[0], extractor.extract(samp)))
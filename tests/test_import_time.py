@@ -0,0 +1,79 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import sys
+import subprocess
+import unittest
+
+# Modules that detection and OCR programs must not load
+FORBIDDEN_MODULES = (
+    "openpyxl",
+    "sqlite3",
+    "eyegrade.sessiondb",
+    "eyegrade.students",
+    "eyegrade.export",
+    "eyegrade.exams",
+    "PyQt5",
+    "PyQt6",
+)
+
+# Budget for the time spent in Eyegrade's own modules (microseconds),
+# i.e. excluding the time of OpenCV, NumPy and the standard library
+IMPORT_TIME_BUDGET = 150000
+
+
+def _import_times(module):
+    """Returns a dict with the self import time of each module loaded."""
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=root_dir,
+        check=True,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:"):
+            parts = line[len("import time:") :].split("|")
+            if parts[0].strip().isdigit():
+                times[parts[2].strip()] = int(parts[0])
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    def _check_module(self, module):
+        times = _import_times(module)
+        self.assertIn(module, times)
+        for name in times:
+            for forbidden in FORBIDDEN_MODULES:
+                self.assertFalse(
+                    name == forbidden or name.startswith(forbidden + "."),
+                    msg="{} imports {}".format(module, name),
+                )
+        own_time = sum(t for name, t in times.items() if name.startswith("eyegrade"))
+        self.assertLess(own_time, IMPORT_TIME_BUDGET)
+
+    def test_detection(self):
+        self._check_module("eyegrade.detection")
+
+    def test_ocr(self):
+        self._check_module("eyegrade.ocr.classifiers")
+
+    def test_detect_image_tool(self):
+        self._check_module("eyegrade.tools.detect_image")
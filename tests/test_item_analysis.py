@@ -0,0 +1,93 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import collections
+import unittest
+
+import numpy as np
+
+import eyegrade.exams as exams
+import eyegrade.item_analysis as item_analysis
+
+
+class TestItemAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.exam_config = exams.ExamConfig()
+        self.exam_config.set_dimensions("3,2")
+        self.exam_config.set_solutions("A", "1/2")
+        self.exam_config.set_permutations("A", "1{1,2,3}/2{1,2,3}")
+        self.exam_config.set_solutions("B", "1/3")
+        self.exam_config.set_permutations("B", "2{2,1,3}/1{3,2,1}")
+
+    def _analysis(self, exams_data):
+        analysis = item_analysis.ItemAnalysis(self.exam_config)
+        score_stats = collections.defaultdict(lambda: [0, 0, 0.0, 0.0])
+        item_stats = collections.defaultdict(lambda: [0, 0, 0.0])
+        for model, answers, score in exams_data:
+            stats = score_stats[model]
+            stats[0] += 1
+            stats[1] += 1
+            stats[2] += score
+            stats[3] += score * score
+            for question, answer in enumerate(answers):
+                stats = item_stats[(model, question, answer)]
+                stats[0] += 1
+                stats[1] += 1
+                stats[2] += score
+        for model, stats in score_stats.items():
+            analysis.add_scores(model, *stats)
+        for key, stats in item_stats.items():
+            analysis.add_answers(*key, *stats)
+        return analysis
+
+    def test_unpermuted_statistics(self):
+        # Original answers of each exam: (2, 1), (2, 3), (1, 0), (1, 2)
+        exams_data = [
+            ("A", [2, 1], 0.0),
+            ("B", [3, 2], 2.0),
+            ("A", [1, 0], 1.0),
+            ("B", [1, 3], 1.5),
+        ]
+        analysis = self._analysis(exams_data)
+        self.assertEqual(analysis.num_exams, 4)
+        self.assertEqual(analysis.mean_score, 1.125)
+        self.assertEqual(analysis.questions[0].choice_counts, [0, 2, 2, 0])
+        self.assertEqual(analysis.questions[1].choice_counts, [1, 1, 1, 1])
+        self.assertEqual(
+            analysis.questions[0].choice_mean_scores(), [None, 1.25, 1.0, None]
+        )
+        self.assertEqual(analysis.difficulty(0), 0.5)
+        self.assertEqual(analysis.difficulty(1), 0.25)
+        scores = np.array([score for _, _, score in exams_data])
+        correct = np.array([0, 0, 1, 1])
+        self.assertAlmostEqual(
+            analysis.discrimination(0), np.corrcoef(correct, scores)[0, 1]
+        )
+        correct = np.array([0, 0, 0, 1])
+        self.assertAlmostEqual(
+            analysis.discrimination(1), np.corrcoef(correct, scores)[0, 1]
+        )
+
+    def test_undefined_discrimination(self):
+        analysis = self._analysis([("A", [1, 2], 2.0), ("B", [1, 3], 2.0)])
+        self.assertEqual(analysis.difficulty(0), 1.0)
+        self.assertIsNone(analysis.discrimination(0))
+        self.assertEqual(analysis.score_std, 0.0)
+        analysis = item_analysis.ItemAnalysis(self.exam_config)
+        self.assertIsNone(analysis.mean_score)
+        self.assertIsNone(analysis.difficulty(0))
+        self.assertIsNone(analysis.discrimination(0))
@@ -0,0 +1,187 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+import eyegrade.create.latex as latex
+import eyegrade.create.buildcache as buildcache
+
+# Stand-in for pdflatex: it takes 0.3 seconds and fails for files
+# that contain FAIL. The .aux file it writes contains the lines of
+# the file with a \label, and it asks for another run when there
+# was no .aux file and there are references. Runs are logged into
+# the file runs.log of its directory.
+FAKE_PDFLATEX = """#!{python}
+import os
+import sys
+import time
+
+output_dir = sys.argv[sys.argv.index("-output-directory") + 1]
+name = sys.argv[-1]
+base_name = os.path.join(output_dir, os.path.splitext(name)[0])
+with open(os.path.join(os.path.dirname(sys.argv[0]), "runs.log"), "a") as f:
+    f.write(name + "\\n")
+time.sleep(0.3)
+text = open(name).read()
+had_aux = os.path.exists(base_name + ".aux")
+with open(base_name + ".aux", "w") as f:
+    f.writelines(line for line in text.splitlines(True) if "\\\\label" in line)
+with open(base_name + ".log", "w") as f:
+    f.write("log")
+if "FAIL" in text:
+    print("Error in " + name)
+    sys.exit(1)
+if not had_aux and "\\\\ref" in text:
+    print("Rerun to get cross-references right.")
+with open(base_name + ".pdf", "w") as f:
+    f.write(os.getcwd())
+"""
+
+
+class TestCompileLatex(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.dir_name, "bin")
+        self.runs_file = os.path.join(bin_dir, "runs.log")
+        os.mkdir(bin_dir)
+        pdflatex = os.path.join(bin_dir, "pdflatex")
+        with open(pdflatex, mode="w") as f:
+            f.write(FAKE_PDFLATEX.format(python=sys.executable))
+        os.chmod(pdflatex, 0o755)
+        self.old_path = os.environ["PATH"]
+        os.environ["PATH"] = bin_dir + os.pathsep + self.old_path
+        self.output_dir = os.path.join(self.dir_name, "output")
+        os.mkdir(self.output_dir)
+
+    def tearDown(self):
+        os.environ["PATH"] = self.old_path
+        shutil.rmtree(self.dir_name)
+
+    def _runs(self):
+        if not os.path.exists(self.runs_file):
+            return []
+        with open(self.runs_file) as f:
+            runs = f.read().split()
+        os.remove(self.runs_file)
+        return runs
+
+    def _latex_files(self, contents):
+        filenames = []
+        for i, content in enumerate(contents):
+            filename = os.path.join(self.output_dir, "exam-{}.tex".format(i))
+            with open(filename, mode="w") as f:
+                f.write(content)
+            filenames.append(filename)
+        return filenames
+
+    def test_compile_latex(self):
+        latex_file = self._latex_files(["ok"])[0]
+        cwd = os.getcwd()
+        success, _, produced_filename = latex.compile_latex(latex_file, remove_tex=True)
+        self.assertTrue(success)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(produced_filename, os.path.join(self.output_dir, "exam-0.pdf"))
+        # pdflatex ran in the directory of the file:
+        with open(produced_filename) as f:
+            self.assertEqual(
+                os.path.realpath(f.read()), os.path.realpath(self.output_dir)
+            )
+        self.assertEqual(os.listdir(self.output_dir), ["exam-0.pdf"])
+
+    def test_compile_latex_files(self):
+        latex_files = self._latex_files(["ok", "FAIL", "ok", "ok"])
+        start = time.perf_counter()
+        results = latex.compile_latex_files(latex_files, jobs=4, remove_tex=True)
+        self.assertLess(time.perf_counter() - start, 4 * 0.3)
+        self.assertEqual([r.latex_file for r in results], latex_files)
+        self.assertEqual([r.success for r in results], [True, False, True, True])
+        self.assertIn(b"Error in exam-1.tex", results[1].output)
+        self.assertIsNone(results[1].produced_filename)
+        self.assertGreaterEqual(results[0].elapsed, 0.3)
+        # No auxiliary files are left, and the failed file keeps its log:
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            ["exam-0.pdf", "exam-1.log", "exam-1.tex", "exam-2.pdf", "exam-3.pdf"],
+        )
+
+    def test_passes(self):
+        latex_files = self._latex_files(["ok", "\\label{a}\n\\ref{a}"])
+        latex.compile_latex_files(latex_files)
+        self.assertEqual(self._runs(), ["exam-0.tex", "exam-1.tex", "exam-1.tex"])
+
+    def test_build_cache(self):
+        cache = buildcache.BuildCache(os.path.join(self.dir_name, "cache"))
+        contents = ["\\label{a}\n\\ref{a}", "\\includegraphics{fig}"]
+        with open(os.path.join(self.output_dir, "fig.png"), "w") as f:
+            f.write("figure")
+        latex_files = self._latex_files(contents)
+        results = latex.compile_latex_files(latex_files, remove_tex=True, cache=cache)
+        self.assertEqual([r.cached for r in results], [False, False])
+        self.assertEqual(self._runs(), ["exam-0.tex", "exam-0.tex", "exam-1.tex"])
+        # Nothing changed:
+        self._latex_files(contents)
+        results = latex.compile_latex_files(latex_files, remove_tex=True, cache=cache)
+        self.assertEqual([r.cached for r in results], [True, True])
+        self.assertEqual(self._runs(), [])
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)), ["exam-0.pdf", "exam-1.pdf", "fig.png"]
+        )
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        # The text changes, but not the labels, so that the .aux file
+        # of the previous build is still valid; the figure changes:
+        self._latex_files(["Text\n" + contents[0], contents[1]])
+        with open(os.path.join(self.output_dir, "fig.png"), "w") as f:
+            f.write("new figure")
+        results = latex.compile_latex_files(latex_files, remove_tex=True, cache=cache)
+        self.assertEqual([r.cached for r in results], [False, False])
+        self.assertEqual(self._runs(), ["exam-0.tex", "exam-1.tex"])
+        # A label changes:
+        self._latex_files(["\\label{b}\n\\ref{b}", contents[1]])
+        latex.compile_latex_files(latex_files, remove_tex=True, cache=cache)
+        self.assertEqual(self._runs(), ["exam-0.tex", "exam-0.tex"])
+
+    def test_compile_while_writing(self):
+        started = []
+
+        def write_files():
+            for i in range(3):
+                if i > 0:
+                    # The previous file gets compiled meanwhile
+                    deadline = time.monotonic() + 5
+                    while (
+                        not os.path.exists(self.runs_file)
+                        and time.monotonic() < deadline
+                    ):
+                        time.sleep(0.01)
+                    started.append(os.path.exists(self.runs_file))
+                filename = os.path.join(self.output_dir, "exam-{}.tex".format(i))
+                with open(filename, mode="w") as f:
+                    f.write("ok")
+                yield filename
+
+        results = latex.compile_latex_files(write_files(), jobs=2, remove_tex=True)
+        self.assertEqual(started, [True, True])
+        self.assertEqual([r.success for r in results], [True, True, True])
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            ["exam-0.pdf", "exam-1.pdf", "exam-2.pdf"],
+        )
@@ -0,0 +1,166 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import tempfile
+import types
+import unittest
+
+import eyegrade.exams as exams
+import eyegrade.merge as merge
+import eyegrade.scoring as scoring
+import eyegrade.sessiondb as sessiondb
+import eyegrade.students as students
+import eyegrade.utils as utils
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.exam_config = exams.ExamConfig(
+            filename=os.path.join(os.path.dirname(__file__), "test.eye")
+        )
+        self.exam_config.capture_pattern = "exam-{student-id}-{seq-number}.png"
+        listing = students.GroupListing(students.StudentGroup(1, "G"), [])
+        listing.add_students(
+            [
+                students.Student("100", "Donald Duck", None, None, None),
+                students.Student("200", "Peter Pan", None, None, None),
+            ]
+        )
+        self.listings = students.StudentListings()
+        self.listings.add_listing(listing)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_merge(self):
+        first = self._create_session(
+            "first", {1: ("100", "A", [1, 2, 3, 3, 1]), 2: (None, "B", [2, 0, 2, 2, 1])}
+        )
+        second = self._create_session(
+            "second",
+            {1: ("200", "A", [3, 2, 3, 3, 1]), 3: ("300", "D", [1, 1, 2, 0, 3])},
+        )
+        os.remove(os.path.join(second, "internal", "raw-3.png"))
+        target = self._path("merged")
+        merge.create_target(target, first)
+        merger = merge.SessionMerger(target, jobs=2)
+        first_report = merger.merge(first)
+        second_report = merger.merge(second)
+        merger.close()
+        self.assertTrue(first_report.consistent)
+        self.assertTrue(second_report.consistent)
+        self.assertEqual(first_report.num_exams, 2)
+        self.assertEqual(first_report.tables["Answers"], (10, 10))
+        self.assertEqual(first_report.tables["ExamHashes"], (2, 2))
+        self.assertEqual(first_report.captures["linked"], 4)
+        self.assertEqual(second_report.exam_ids, (1, 3))
+        self.assertEqual(second_report.offset, 2)
+        self.assertEqual(second_report.students_matched, 1)
+        self.assertEqual(second_report.students_added, 1)
+        self.assertEqual(second_report.captures["linked"], 3)
+        self.assertEqual(second_report.captures["missing"], 1)
+        session = sessiondb.SessionDB(target)
+        merged = {
+            exam.exam_id: (
+                exam.decisions.student.student_id if exam.decisions.student else None,
+                exam.decisions.model,
+                exam.decisions.answers,
+            )
+            for exam in session.read_exams()
+        }
+        self.assertEqual(
+            merged,
+            {
+                1: ("100", "A", [1, 2, 3, 3, 1]),
+                2: (None, "B", [2, 0, 2, 2, 1]),
+                3: ("200", "A", [3, 2, 3, 3, 1]),
+                5: ("300", "D", [1, 1, 2, 0, 3]),
+            },
+        )
+        self.assertEqual(session.next_exam_id(), 6)
+        self.assertTrue(
+            os.path.exists(os.path.join(target, "captures", "exam-300-5.png"))
+        )
+        analysis = session.read_item_analysis()
+        self.assertEqual(analysis.num_exams, 4)
+        self.assertEqual(analysis.questions[0].choice_counts, [0, 2, 1, 1])
+        session.close()
+
+    def test_dry_run(self):
+        source = self._create_session("source", {1: ("100", "A", [1, 2, 3, 3, 1])})
+        target = self._create_session("target", {})
+        merger = merge.SessionMerger(target, dry_run=True)
+        report = merger.merge(source)
+        merger.close()
+        self.assertTrue(report.consistent)
+        self.assertEqual(report.tables["Exams"], (1, 1))
+        self.assertEqual(report.captures["found"], 2)
+        session = sessiondb.SessionDB(target)
+        self.assertEqual(session.read_exams(), [])
+        session.close()
+        self.assertEqual(os.listdir(os.path.join(target, "internal")), [])
+
+    def test_incompatible(self):
+        source = self._create_session("source", {})
+        self.exam_config.set_solutions("A", [[2], [1], [1], [1], [1]])
+        target = self._create_session("target", {})
+        merger = merge.SessionMerger(target)
+        self.assertRaises(utils.EyegradeException, merger.check, source)
+        self.assertRaises(utils.EyegradeException, merger.check, target)
+        merger.close()
+
+    def _create_session(self, name, all_exams):
+        session_dir = self._path(name)
+        sessiondb.create_session_directory(session_dir, self.exam_config, self.listings)
+        session = sessiondb.SessionDB(session_dir)
+        known = {student.student_id: student for student in session.get_students()}
+        exam_capture = types.SimpleNamespace(
+            answer_cells=[], id_cells=[], sheet_hash=lambda: 12345
+        )
+        for exam_id, (student_id, model, answers) in all_exams.items():
+            if student_id is None:
+                student = None
+            elif student_id in known:
+                student = known[student_id]
+            else:
+                student = students.Student(student_id, "New", None, None, None)
+                student.group_id = 1
+            decisions = sessiondb.ExamDecisionsFromDB(answers, student, None, model)
+            score = scoring.Score(
+                answers,
+                self.exam_config.get_solutions(model),
+                self.exam_config.scores[model],
+            )
+            session.store_exam(
+                exam_id, exam_capture, decisions, score, store_captures=False
+            )
+            name = utils.capture_name(
+                self.exam_config.capture_pattern, exam_id, student
+            )
+            for path in (
+                os.path.join(session_dir, "captures", name),
+                os.path.join(session_dir, "internal", "raw-{}.png".format(exam_id)),
+            ):
+                with open(path, "wb") as f:
+                    f.write(b"capture")
+        session.close()
+        return session_dir
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir.name, name)
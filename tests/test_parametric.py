@@ -0,0 +1,99 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import eyegrade.utils as utils
+import eyegrade.create.slots as slots
+import eyegrade.create.questions as questions
+import eyegrade.create.parametric as parametric
+
+
+def _component(in_choice, text, code=None):
+    component = questions.QuestionComponent(in_choice, text=text)
+    component.code = code
+    return component
+
+
+def _parameter_set(**parameters):
+    parameter_set = parametric.ParameterSet()
+    for name, value in parameters.items():
+        parameter_set.add_parameter(name, value)
+    return parameter_set
+
+
+class TestSlotText(unittest.TestCase):
+    def test_fill(self):
+        text = slots.SlotText("{{a}} plus {{b}} is {{c}}{{a}}")
+        self.assertEqual(text.keys, ["a", "b", "c", "a"])
+        self.assertEqual(text.fill({"a": "1", "b": "2", "c": "3"}), "1 plus 2 is 31")
+        self.assertEqual(text.fill_with(str.upper), "A plus B is CA")
+        with self.assertRaises(KeyError):
+            text.fill({"a": "1"})
+
+    def test_no_slots(self):
+        text = slots.SlotText("No {slots} here")
+        self.assertEqual(text.keys, [])
+        self.assertEqual(text.fill({}), "No {slots} here")
+
+
+class TestParametricQuestion(unittest.TestCase):
+    def setUp(self):
+        text = _component(
+            False,
+            [("text", "Compute {{f}}({{x}})"), ("code", "{{f}}"), ("text", "")],
+            code="def {{f}}(x): pass",
+        )
+        self.pattern = questions.QuestionVariation(
+            text,
+            [_component(True, "{{correct}}")],
+            [_component(True, "{{x}}"), _component(True, "none")],
+            [],
+            [1],
+        )
+
+    def test_add_parameter_set(self):
+        question = parametric.ParametricQuestion(self.pattern)
+        question.add_parameter_set(_parameter_set(f="sin", x="0", correct="0"))
+        question.add_parameter_set(_parameter_set(f="cos", x="0", correct="1"))
+        self.assertEqual(question.num_variations, 2)
+        variation = question.variations[1]
+        self.assertEqual(
+            variation.text.text,
+            [("text", "Compute cos(0)"), ("code", "{{f}}"), ("text", "")],
+        )
+        self.assertEqual(variation.text.code, "def cos(x): pass")
+        self.assertEqual(
+            [choice.text for choice in variation.choices()], ["1", "0", "none"]
+        )
+        self.assertEqual(variation.fix_last, [1])
+        # The pattern is not modified:
+        self.assertEqual(self.pattern.correct_choices[0].text, "{{correct}}")
+
+    def test_apply_to(self):
+        parameter_set = _parameter_set(f="tan", x="1", correct="1.56")
+        variation = parameter_set.apply_to(self.pattern)
+        self.assertEqual(variation.text.text[0], ("text", "Compute tan(1)"))
+        component = parameter_set.apply_to_question_component(
+            self.pattern.incorrect_choices[0]
+        )
+        self.assertEqual(component.text, "1")
+
+    def test_undefined_parameter(self):
+        question = parametric.ParametricQuestion(self.pattern)
+        with self.assertRaises(utils.EyegradeException):
+            question.add_parameter_set(_parameter_set(f="sin", x="0"))
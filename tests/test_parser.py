@@ -0,0 +1,120 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import tempfile
+import unittest
+
+import eyegrade.utils as utils
+import eyegrade.create.parser as parser
+import eyegrade.create.questions as questions
+import eyegrade.create.parametric as parametric
+
+EXAM = """<?xml version="1.0" encoding="UTF-8"?>
+<exam xmlns="http://www.it.uc3m.es/jaf/eyegrade/ns/"
+      xmlns:eye="http://www.it.uc3m.es/jaf/eyegrade/ns/">
+  <subject>Computer   Science</subject>
+  <studentId eye:label="NIA" eye:length="6" />
+  <question>
+    <!-- Q1 -->
+    <text>Before <!-- a comment --> after
+      <code>int x;</code> end</text>
+    <choices>
+      <correct eye:fix="last">one &amp; two</correct>
+      <incorrect>three</incorrect>
+    </choices>
+  </question>
+  <group>
+    <variation_params>
+      <variation><param eye:name="a">1</param></variation>
+      <variation><param eye:name="a">2</param></variation>
+    </variation_params>
+    <common><text>Common {{a}}</text></common>
+    <question>
+      <text>Question {{a}}</text>
+      <choices><correct>{{a}}</correct><incorrect>0</incorrect></choices>
+    </question>
+  </group>
+  <scores eye:correct="1" eye:incorrect="0.5" />
+</exam>
+"""
+
+
+class TestParser(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.TemporaryDirectory()
+        self.exam_file = os.path.join(self.dir_name.name, "exam.xml")
+        self._write_exam(EXAM)
+
+    def tearDown(self):
+        self.dir_name.cleanup()
+
+    def _write_exam(self, text):
+        with open(self.exam_file, mode="w") as f:
+            f.write(text)
+
+    def test_parse_exam(self):
+        exam = parser.parse_exam(self.exam_file)
+        self.assertEqual(exam.subject, "Computer Science")
+        self.assertEqual(exam.student_id_label, "NIA")
+        self.assertEqual(exam.student_id_length, 6)
+        self.assertEqual(exam.num_questions(), 2)
+        self.assertEqual(exam.scores.format_correct_score(), "1")
+        question = exam.questions[0]
+        self.assertIsInstance(question, questions.FixedQuestion)
+        variation = question.variations[0]
+        self.assertEqual(
+            variation.text.text,
+            [
+                ("text", "Before"),
+                ("text", "after"),
+                ("code", "int x;"),
+                ("text", "end"),
+            ],
+        )
+        self.assertEqual(variation.correct_choices[0].text, "one & two")
+        self.assertEqual(variation.fix_last, [0])
+        group = exam.questions.groups[1]
+        self.assertIsInstance(
+            group.common_text, parametric.ParametricGroupCommonComponent
+        )
+        self.assertEqual(len(group.common_text.parameter_sets), 2)
+        self.assertIsInstance(exam.questions[1], parametric.ParametricQuestion)
+
+    def test_bad_root_element(self):
+        self._write_exam('<exam xmlns="http://example.com/"></exam>')
+        with self.assertRaises(utils.EyegradeException):
+            parser.parse_exam(self.exam_file)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.dir_name.name, "cache")
+        exam = parser.parse_exam(self.exam_file, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cached_exam = parser.parse_exam(self.exam_file, cache_dir=cache_dir)
+        self.assertEqual(cached_exam.subject, exam.subject)
+        self.assertEqual(cached_exam.num_questions(), exam.num_questions())
+        # Changes in the file are parsed again:
+        self._write_exam(EXAM.replace("Computer", "Political"))
+        exam = parser.parse_exam(self.exam_file, cache_dir=cache_dir)
+        self.assertEqual(exam.subject, "Political Science")
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        # Damaged entries are ignored:
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), mode="wb") as f:
+                f.write(b"garbage")
+        exam = parser.parse_exam(self.exam_file, cache_dir=cache_dir)
+        self.assertEqual(exam.subject, "Political Science")
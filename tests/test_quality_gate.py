@@ -0,0 +1,76 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import unittest
+
+import cv2
+
+import eyegrade.detection as detection
+import eyegrade.tools.replay_benchmark as replay_benchmark
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+class TestFrameQualityGate(unittest.TestCase):
+    def setUp(self):
+        self.generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=7)
+
+    def test_still_frames_pass(self):
+        captures = self.generator.generate_sequence(0, 4)
+        gate = detection.FrameQualityGate()
+        self.assertTrue(all(gate.check(c.image) for c in captures))
+        self.assertEqual(gate.frames, 4)
+        self.assertEqual(gate.skipped, 0)
+        self.assertLess(gate.motion, 1.0)
+
+    def test_moving_frames_are_skipped(self):
+        captures = self.generator.generate_sequence(4, 3)
+        gate = detection.FrameQualityGate()
+        accepted = [gate.check(c.image) for c in captures]
+        # The first frame has nothing to be compared with:
+        self.assertEqual(accepted[1:4], [False] * 3)
+        self.assertEqual(accepted[5:], [True] * 2)
+        self.assertAlmostEqual(gate.skipped_fraction, accepted.count(False) / 7)
+        gate.reset()
+        self.assertTrue(gate.check(captures[0].image))
+        self.assertEqual(gate.motion, 0.0)
+
+    def test_blurry_frames_are_skipped(self):
+        image = self.generator.generate().image
+        blurry = cv2.GaussianBlur(image, (0, 0), 4.0)
+        gate = detection.FrameQualityGate(max_motion=None)
+        self.assertTrue(gate.check(image))
+        self.assertFalse(gate.check(blurry))
+        self.assertLess(gate.sharpness, detection.param_quality_gate_min_sharpness)
+        gate = detection.FrameQualityGate(max_motion=None, min_sharpness=None)
+        self.assertTrue(gate.check(blurry))
+
+    def test_replay_with_gate(self):
+        captures = self.generator.generate_sequence(4, 3)
+        frames = [
+            replay_benchmark.Frame(str(i), c.image, c.answers, c.model)
+            for i, c in enumerate(captures)
+        ]
+        corpus = replay_benchmark.Corpus(frames, [(3, 5)])
+        results = replay_benchmark.replay(
+            corpus, read_id=False, quality_gate=detection.FrameQualityGate()
+        )
+        self.assertEqual(results.frames, 7)
+        self.assertGreaterEqual(results.skipped, 3)
+        self.assertGreater(results.gate_time, 0)
+        self.assertGreaterEqual(results.locked, 2)
+        self.assertGreaterEqual(results.frames_to_first_lock, 5)
+        self.assertEqual(results.as_dict()["skipped"], results.skipped)
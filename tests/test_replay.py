@@ -0,0 +1,132 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import cv2
+
+import eyegrade.detection as detection
+import eyegrade.exams as exams
+import eyegrade.images as images
+import eyegrade.sessiondb as sessiondb
+import eyegrade.students as students
+import eyegrade.tools.replay_benchmark as replay_benchmark
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+class TestReplayBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        self.image_path = os.path.join(dirname, "capture.png")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _detect(self):
+        context = detection.ExamDetectorContext(fixed_hough_threshold=180)
+        options = detection.ExamDetector.get_default_options()
+        options["capture-from-file"] = True
+        options["capture-raw-file"] = self.image_path
+        detector = detection.ExamDetector(((3, 5),), context, options)
+        self.assertTrue(detector.detect())
+        return detector
+
+    def _create_session(self):
+        exam_config = exams.ExamConfig()
+        exam_config.set_dimensions("3,5")
+        session_dir = os.path.join(self.dir_name, "session")
+        sessiondb.create_session_directory(
+            session_dir, exam_config, students.StudentListings()
+        )
+        session = sessiondb.SessionDB(session_dir)
+        score = types.SimpleNamespace(correct=0, incorrect=0, blank=0, score=0)
+        detector = self._detect()
+        session.store_exam(1, detector.capture, detector.decisions, score)
+        # The second exam was corrected by the user in question 1:
+        decisions = self._detect().decisions
+        decisions.answers[0] = 1 + decisions.answers[0] % 3
+        session.store_exam(2, detector.capture, decisions, score)
+        # The raw capture of the third one is missing:
+        session.store_exam(3, detector.capture, decisions, score, store_captures=False)
+        session.close()
+        return session_dir
+
+    def test_session(self):
+        session_dir = self._create_session()
+        corpus = replay_benchmark.session_corpus(session_dir)
+        self.assertEqual(corpus.dimensions, [(3, 5)])
+        results = replay_benchmark.replay(corpus)
+        self.assertEqual(results.frames, 2)
+        self.assertEqual(results.locked, 2)
+        self.assertEqual(results.compared_questions, 10)
+        self.assertEqual(results.answer_agreement, 0.9)
+        self.assertEqual(results.exam_agreement, 0.5)
+        self.assertEqual(len(results.disagreements), 1)
+        self.assertIn("total", results.stage_percentiles)
+        self.assertGreater(results.fps, 0)
+        self.assertEqual(
+            replay_benchmark.check_gates(results, min_lock_rate=1, min_agreement=0.9),
+            [],
+        )
+        self.assertEqual(
+            len(replay_benchmark.check_gates(results, min_agreement=0.95)), 1
+        )
+
+    def test_hough_thresholds(self):
+        # The frame finds the boxes but fails at some thresholds:
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=3)
+        capture = generator.generate()
+        frame = replay_benchmark.Frame("frame", capture.image, None, None)
+        corpus = replay_benchmark.Corpus([frame], [(3, 5)])
+        context = synthetic_captures.RecordingContext()
+        results = replay_benchmark.replay(corpus, context=context)
+        self.assertEqual(results.locked, 1)
+        self.assertEqual(results.attempts, len(context.thresholds))
+        # Each attempt uses a different threshold:
+        self.assertEqual(len(set(context.thresholds)), len(context.thresholds))
+        self.assertRaises(ValueError, replay_benchmark.replay, corpus, max_attempts=0)
+
+    def test_directory(self):
+        for name in ("a.png", "b.png", "notes.txt"):
+            shutil.copy(self.image_path, os.path.join(self.dir_name, name))
+        frames = replay_benchmark.directory_frames(self.dir_name)
+        corpus = replay_benchmark.Corpus(frames, [(3, 5)])
+        results = replay_benchmark.replay(corpus)
+        self.assertEqual(results.frames, 2)
+        self.assertEqual(results.lock_rate, 1.0)
+        self.assertIsNone(results.answer_agreement)
+
+    def test_video(self):
+        image = images.load_image(self.image_path)
+        height, width = image.shape[:2]
+        filename = os.path.join(self.dir_name, "video.avi")
+        writer = cv2.VideoWriter(
+            filename, cv2.VideoWriter_fourcc(*"MJPG"), 5, (width, height)
+        )
+        if not writer.isOpened():
+            self.skipTest("No video encoder available")
+        for _ in range(3):
+            writer.write(image)
+        writer.release()
+        frames = list(replay_benchmark.video_frames(filename))
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(frames[0].image.shape, image.shape)
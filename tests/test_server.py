@@ -0,0 +1,140 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import json
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+import unittest
+import http.client
+
+import cv2
+import numpy as np
+
+import eyegrade.detection as detection
+
+import eyegrade.exams as exams
+import eyegrade.server as server
+import eyegrade.sessiondb as sessiondb
+import eyegrade.stations as stations
+import eyegrade.students as students
+import eyegrade.tools.grading_client as grading_client
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+class TestGradingServer(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        exam_config = exams.ExamConfig()
+        exam_config.set_dimensions("3,5")
+        for model in "ABCDEFGH":
+            exam_config.set_solutions(model, [[1], [2], [3], [1], [2]])
+        session_dir = os.path.join(self.dir_name, "session")
+        sessiondb.create_session_directory(
+            session_dir, exam_config, students.StudentListings()
+        )
+        self.writer = stations.SessionWriter(session_dir)
+        self.options = stations.detection_options(
+            self.writer.exam_config, {"error-logging": False, "timing-log": None}
+        )
+        self.pool = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.pool.close()
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.writer.close()
+        shutil.rmtree(self.dir_name)
+
+    def _start(self, num_workers=1, queue_size=4):
+        self.pool = server.WorkerPool(
+            self.writer, self.options, num_workers=num_workers, queue_size=queue_size
+        )
+        self.server = server.GradingServer(self.pool)
+        self.port = asyncio.run_coroutine_threadsafe(
+            self.server.start("127.0.0.1", 0), self.loop
+        ).result()
+
+    def _request(self, method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        content = response.read().decode("utf-8")
+        connection.close()
+        return response.status, content
+
+    def test_grade(self):
+        self._start()
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=5)
+        capture = generator.generate(marks=[(1,), (2,), (1,), (), (2, 3)])
+        _, data = cv2.imencode(".png", capture.image)
+        status, content = self._request("POST", "/grade", data.tobytes())
+        self.assertEqual(status, 200)
+        result = json.loads(content)
+        self.assertEqual(result["answers"], [1, 2, 1, 0, 0])
+        self.assertEqual(result["model"], capture.model)
+        self.assertEqual(result["score"]["correct"], 2)
+        self.assertEqual(result["score"]["incorrect"], 1)
+        self.assertIsNone(result["exam_id"])
+        status, content = self._request("POST", "/grade", b"not an image")
+        self.assertEqual(status, 400)
+        status, _ = self._request("GET", "/grade")
+        self.assertEqual(status, 405)
+        status, content = self._request("GET", "/metrics")
+        self.assertEqual(status, 200)
+        self.assertIn('eyegrade_requests_total{path="/grade",status="200"} 1', content)
+        self.assertIn('eyegrade_request_seconds_bucket{le="+Inf"} 2', content)
+        self.assertIn("eyegrade_grading_seconds_count 1", content)
+        results = grading_client.load_test(
+            "http://127.0.0.1:{}/grade".format(self.port),
+            [data.tobytes()],
+            6,
+            concurrency=2,
+        )
+        self.assertEqual(results.statuses, {200: 6})
+        self.assertEqual(grading_client.summary(results)["statuses"], {"200": 6})
+
+    def test_hough_thresholds(self):
+        self._start()
+        blank = np.full((480, 640, 3), synthetic_captures.BACKGROUND_COLOR, np.uint8)
+        _, data = cv2.imencode(".png", blank)
+        context = synthetic_captures.RecordingContext()
+        context.next_hough_threshold()
+        with self.assertRaises(server.GradingFailed):
+            self.pool._grade(context, data.tobytes(), None)
+        thresholds = detection.param_hough_thresholds
+        self.assertEqual(context.thresholds, thresholds[1:] + thresholds[:1])
+
+    def test_saturated(self):
+        # Without workers, the first image stays in the queue forever
+        self._start(num_workers=0, queue_size=1)
+        pending = socket.create_connection(("127.0.0.1", self.port))
+        pending.sendall(b"POST /grade HTTP/1.1\r\nContent-Length: 1\r\n\r\nx")
+        while self.pool.queued == 0:
+            pass
+        status, content = self._request("POST", "/grade", b"x")
+        self.assertEqual(status, 503)
+        self.assertIn("error", json.loads(content))
+        pending.close()
@@ -19,10 +19,13 @@
 import unittest
 import os.path
 import tempfile
+import types
 
 import eyegrade.sessiondb as sessiondb
 import eyegrade.exams as exams
 import eyegrade.students as students
+import eyegrade.export as export
+import eyegrade.scoring as scoring
 
 
 class TestSessionDB(unittest.TestCase):
@@ -80,6 +83,23 @@ class TestSessionDB(unittest.TestCase):
             self.assertEqual(session.exam_config, exam_config)
             session.close()
 
+    def test_exam_data_extended_models(self):
+        exam_config = exams.ExamConfig(filename=self._get_test_file_path("test.eye"))
+        exam_config.capture_pattern = "exam-{student-id}-{seq-number}.png"
+        for model, other in (("Z", "A"), ("AA", "B"), ("CX", "C")):
+            exam_config.set_solutions(model, exam_config.get_solutions(other))
+            exam_config.set_permutations(model, exam_config.get_permutations(other))
+            exam_config.set_equal_scores(model)
+        listings = students.StudentListings()
+        with tempfile.TemporaryDirectory() as dir_name:
+            session_dir = os.path.join(dir_name, "test_session")
+            sessiondb.create_session_directory(session_dir, exam_config, listings)
+            session = sessiondb.SessionDB(session_dir)
+            session.exam_config.variations = {}
+            self.assertEqual(session.exam_config.models, exam_config.models)
+            self.assertEqual(session.exam_config, exam_config)
+            session.close()
+
     def test_student_list(self):
         exam_config = exams.ExamConfig(filename=self._get_test_file_path("test.eye"))
         exam_config.capture_pattern = "exam-{student-id}-{seq-number}.png"
@@ -107,3 +127,184 @@ class TestSessionDB(unittest.TestCase):
                 self.assertEqual(student_1.name, student_2.name)
                 self.assertEqual(student_1.student_id, student_2.student_id)
             session.close()
+
+    def _graded_session(self, dir_name):
+        exam_config = exams.ExamConfig(filename=self._get_test_file_path("test.eye"))
+        listings = students.StudentListings()
+        for i, student_list in enumerate((self.students, self.more_students)):
+            group = students.StudentGroup(i + 1, "G{}".format(i + 1))
+            listing = students.GroupListing(group, [])
+            listing.add_students(student_list)
+            listings.add_listing(listing)
+        session_dir = os.path.join(dir_name, "test_session")
+        sessiondb.create_session_directory(session_dir, exam_config, listings)
+        session = sessiondb.SessionDB(session_dir)
+        cursor = session.conn.cursor()
+        cursor.execute("SELECT db_id FROM Students ORDER BY db_id")
+        db_ids = [row[0] for row in cursor.fetchall()]
+        # The second student of each group has no exam:
+        graded = [db_ids[0], db_ids[2], db_ids[3], db_ids[5]]
+        num_questions = exam_config.num_questions
+        for exam_id, db_id in enumerate(graded, start=1):
+            cursor.execute(
+                "INSERT INTO Exams VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (exam_id, db_id, exam_id % 2, exam_id, 1, 0, exam_id / 2),
+            )
+            cursor.executemany(
+                "INSERT INTO Answers VALUES (?, ?, ?)",
+                [(exam_id, q, (q + exam_id) % 4) for q in range(num_questions)],
+            )
+        session.conn.commit()
+        return session
+
+    def test_grades_iterator(self):
+        with tempfile.TemporaryDirectory() as dir_name:
+            session = self._graded_session(dir_name)
+            grades = list(session.grades_iterator())
+            self.assertEqual(len(grades), 6)
+            self.assertEqual([exam["exam_id"] for exam in grades], [1, "", 2, 3, "", 4])
+            for exam in grades:
+                if exam["exam_id"] == "":
+                    self.assertEqual(
+                        exam["answers"], [0] * session.exam_config.num_questions
+                    )
+                    self.assertEqual(exam["score"], "")
+                else:
+                    self.assertEqual(
+                        exam["answers"], session.read_answers(exam["exam_id"])
+                    )
+                    self.assertEqual(
+                        exam["answers"],
+                        [
+                            (q + exam["exam_id"]) % 4
+                            for q in range(session.exam_config.num_questions)
+                        ],
+                    )
+            grades = list(
+                session.grades_iterator(
+                    all_students=False,
+                    sort_key=export.SortBy.GRADING_SEQUENCE,
+                    student_group=session.get_student_groups()[1],
+                )
+            )
+            self.assertEqual([exam["exam_id"] for exam in grades], [3, 4])
+            self.assertEqual(
+                [exam["student"].student_id for exam in grades],
+                ["909090909", "555555555"],
+            )
+            exams_list = list(session.exams_iterator())
+            self.assertEqual([exam["exam_id"] for exam in exams_list], [1, 2, 3, 4])
+            self.assertEqual(exams_list[1]["student_id"], "313131313")
+            self.assertEqual(exams_list[1]["answers"], session.read_answers(2))
+            session.close()
+
+    def test_export_grades_xlsx(self):
+        import openpyxl
+
+        with tempfile.TemporaryDirectory() as dir_name:
+            session = self._graded_session(dir_name)
+            helper = export.GradesExportHelper(
+                session.exam_config, session.get_student_groups()
+            )
+            helper.file_name = os.path.join(dir_name, "grades.xlsx")
+            helper.file_format = export.FileFormat.XLSX
+            helper.export_all_groups(False)
+            helper.sort_by = export.SortBy.STUDENT_LIST
+            helper.all_students = True
+            helper.add_column_headers = True
+            helper.export_columns(("student_id", "score", "answers"))
+            session.export_grades(helper)
+            num_questions = session.exam_config.num_questions
+            session.close()
+            workbook = openpyxl.load_workbook(helper.file_name, read_only=True)
+            self.assertEqual(workbook.sheetnames, ["G1", "G2"])
+            rows = list(workbook["G2"].values)
+            workbook.close()
+            self.assertEqual(rows[0][:3], ("Id", "Score", "Q1"))
+            self.assertEqual(
+                rows[1],
+                ("909090909", 1.5) + tuple((q + 3) % 4 for q in range(num_questions)),
+            )
+            self.assertEqual(len(rows), 4)
+
+    def test_item_analysis(self):
+        exam_config = exams.ExamConfig(filename=self._get_test_file_path("test.eye"))
+        listings = students.StudentListings()
+        exam_capture = types.SimpleNamespace(
+            answer_cells=[], id_cells=[], sheet_hash=lambda: None
+        )
+        all_answers = {
+            1: ("A", [1, 2, 3, 3, 1]),
+            2: ("B", [2, 0, 2, 2, 1]),
+            3: ("A", [3, 2, 3, 3, 1]),
+            4: ("D", [1, 1, 2, 0, 3]),
+            5: ("C", [2, 1, 1, 1, 2]),
+        }
+        with tempfile.TemporaryDirectory() as dir_name:
+            session_dir = os.path.join(dir_name, "test_session")
+            sessiondb.create_session_directory(session_dir, exam_config, listings)
+            session = sessiondb.SessionDB(session_dir)
+            for exam_id, (model, answers) in all_answers.items():
+                decisions = sessiondb.ExamDecisionsFromDB(answers, None, None, model)
+                session.store_exam(
+                    exam_id,
+                    exam_capture,
+                    decisions,
+                    self._score(exam_config, model, answers),
+                    store_captures=False,
+                )
+            answers = [3, 2, 3, 3, 0]
+            decisions = sessiondb.ExamDecisionsFromDB(answers, None, None, "A")
+            session.update_answer(
+                3,
+                4,
+                exam_capture,
+                decisions,
+                self._score(exam_config, "A", answers),
+                store_captures=False,
+            )
+            all_answers[3] = ("A", answers)
+            session.remove_exam(5)
+            del all_answers[5]
+            analysis = session.read_item_analysis()
+            self.assertEqual(analysis.num_exams, 4)
+            scores = [
+                self._score(exam_config, model, answers).score
+                for model, answers in all_answers.values()
+            ]
+            self.assertAlmostEqual(analysis.mean_score, sum(scores) / 4)
+            # Question 1 (canonical order) is the first question of
+            # models A and C, the fourth of B and the fifth of D.
+            # The correct choice is always the first one in the original
+            # order:
+            question = analysis.questions[0]
+            self.assertEqual(question.num_exams, 4)
+            self.assertEqual(question.choice_counts, [0, 2, 1, 1])
+            self.assertEqual(analysis.difficulty(0), 0.5)
+            self.assertEqual(analysis.questions[4].choice_counts, [1, 3, 0, 0])
+            # Incremental aggregates match the ones built from scratch:
+            cursor = session.conn.cursor()
+            cursor.execute("SELECT * FROM ItemStats WHERE num_exams > 0")
+            item_stats = sorted(tuple(row) for row in cursor.fetchall())
+            cursor.execute("DROP TABLE ItemStats")
+            cursor.execute("DROP TABLE ScoreStats")
+            session.close()
+            session = sessiondb.SessionDB(session_dir)
+            rebuilt = session.read_item_analysis()
+            cursor = session.conn.cursor()
+            cursor.execute("SELECT * FROM ItemStats")
+            self.assertEqual(
+                [row[:5] for row in sorted(tuple(row) for row in cursor.fetchall())],
+                [row[:5] for row in item_stats],
+            )
+            self.assertEqual(rebuilt.questions[0].choice_counts, [0, 2, 1, 1])
+            for i in range(exam_config.num_questions):
+                self.assertAlmostEqual(
+                    rebuilt.discrimination(i), analysis.discrimination(i)
+                )
+            session.close()
+
+    def _score(self, exam_config, model, answers):
+        return scoring.Score(
+            answers, exam_config.get_solutions(model), exam_config.scores[model]
+        )
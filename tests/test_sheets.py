@@ -0,0 +1,125 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import re
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+import eyegrade.detection as detection
+import eyegrade.create.sheets as sheets
+
+
+def _capture(image, width=640, height=480, angle=2.0, fill=0.9):
+    """Places the rendered sheet in a frame, as a camera would see it."""
+    factor = fill * min(width / image.shape[1], height / image.shape[0])
+    matrix = cv2.getRotationMatrix2D(
+        (image.shape[1] / 2, image.shape[0] / 2), angle, factor
+    )
+    matrix[:, 2] += (width / 2 - image.shape[1] / 2, height / 2 - image.shape[0] / 2)
+    frame = cv2.warpAffine(
+        image, matrix, (width, height), flags=cv2.INTER_AREA, borderValue=255
+    )
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+class TestAnswerSheet(unittest.TestCase):
+    def _detect(self, dimensions, frame, id_num_digits=0, extended_models=False):
+        options = detection.ExamDetector.get_default_options()
+        options["id-num-digits"] = id_num_digits
+        options["extended-models"] = extended_models
+        for threshold in detection.param_hough_thresholds:
+            context = detection.ExamDetectorContext(fixed_hough_threshold=threshold)
+            detector = detection.ExamDetector(
+                dimensions, context, options, image_raw=frame
+            )
+            if detector.detect():
+                return detector
+        return None
+
+    def test_layout(self):
+        sheet = sheets.AnswerSheet([(3, 4), (3, 2)], id_num_digits=5)
+        self.assertEqual(sheet.num_questions, 6)
+        self.assertEqual(sheet.num_bits, 6)
+        self.assertEqual(sheet.models(), list("ABCDEFGH"))
+        self.assertEqual(sheet.bits("0"), [False] * 6)
+        corners = sheet.corners()
+        self.assertEqual([len(c) for c in corners], [5, 3])
+        self.assertEqual([len(row) for row in corners[0]], [4] * 5)
+        self.assertEqual(len(sheet.id_corners()[0]), 6)
+        left, top, right, bottom = sheet.bounds
+        self.assertLess(left, corners[0][0][0][0])
+        self.assertGreater(bottom, corners[0][-1][0][1])
+        survey = sheets.AnswerSheet([(3, 4)], infobits=False)
+        self.assertEqual(survey.models(), [])
+        self.assertIsNone(survey.bits("A"))
+
+    def test_detection(self):
+        dimensions = [(4, 10)]
+        for id_num_digits in (0, 8):
+            sheet = sheets.AnswerSheet(dimensions, id_num_digits=id_num_digits)
+            for model in sheet.models()[:4]:
+                image = sheets.render_image(sheet, model=model, dpi=300)
+                detector = self._detect(
+                    dimensions, _capture(image), id_num_digits=id_num_digits
+                )
+                self.assertIsNotNone(detector)
+                self.assertEqual(detector.decisions.model, model)
+                self.assertEqual(detector.decisions.answers, [0] * 10)
+
+    def test_detection_extended_models(self):
+        dimensions = [(4, 10), (4, 10)]
+        sheet = sheets.AnswerSheet(dimensions)
+        for model, classic_model in (("C", "C"), ("J", None), ("BK", None)):
+            frame = _capture(sheets.render_image(sheet, model=model, dpi=300))
+            detector = self._detect(dimensions, frame, extended_models=True)
+            self.assertEqual(detector.decisions.model, model)
+            detector = self._detect(dimensions, frame)
+            self.assertEqual(detector.decisions.model, classic_model)
+
+    def test_write_image(self):
+        sheet = sheets.AnswerSheet([(3, 5)])
+        with tempfile.TemporaryDirectory() as dir_name:
+            filename = os.path.join(dir_name, "sheet.png")
+            sheets.write_image(filename, sheet, model="B", dpi=100)
+            image = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+        self.assertTrue(np.array_equal(image, sheets.render_image(sheet, "B", 100)))
+        left, top, right, bottom = sheet.bounds
+        width_mm = right - left + 2 * sheets.PAGE_MARGIN
+        self.assertAlmostEqual(image.shape[1], width_mm * 100 / 25.4, delta=1)
+
+    def test_write_pdf(self):
+        sheet = sheets.AnswerSheet([(3, 5), (3, 5)], id_num_digits=4)
+        with tempfile.TemporaryDirectory() as dir_name:
+            filename = os.path.join(dir_name, "sheets.pdf")
+            sheets.write_pdf(filename, sheet, ["A", "B", "C"], page_size=sheets.A4)
+            with open(filename, mode="rb") as f:
+                data = f.read()
+        self.assertTrue(data.startswith(b"%PDF-1.4"))
+        self.assertTrue(data.endswith(b"%%EOF\n"))
+        self.assertIn(b"/Count 3", data)
+        self.assertEqual(len(re.findall(rb"/Type /Page ", data)), 3)
+        # The cross-reference table points to every object:
+        startxref = int(re.search(rb"startxref\n(\d+)", data).group(1))
+        self.assertTrue(data[startxref:].startswith(b"xref\n0 10\n"))
+        offsets = re.findall(rb"(\d{10}) 00000 n ", data[startxref:])
+        self.assertEqual(len(offsets), 9)
+        for number, offset in enumerate(offsets, start=1):
+            self.assertTrue(data[int(offset) :].startswith(b"%d 0 obj" % number))
@@ -0,0 +1,96 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+import eyegrade.detection as detection
+import eyegrade.sources as sources
+
+
+def _page(value):
+    return np.full((60, 80, 3), value, dtype=np.uint8)
+
+
+class TestSources(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_tiff_pages(self):
+        filename = os.path.join(self.dir_name, "stack.tiff")
+        cv2.imwritemulti(filename, [_page(10), _page(20), _page(30)])
+        source = sources.open_source(filename)
+        self.assertIsInstance(source, sources.TiffPages)
+        self.assertTrue(source.pages)
+        self.assertEqual(source.num_pages, 3)
+        pages = list(source)
+        self.assertEqual([int(page[0, 0, 0]) for page in pages], [10, 20, 30])
+        self.assertEqual(pages[0].shape, (60, 80, 3))
+        self.assertEqual(source.frame_name(2), filename + "#2")
+        self.assertEqual(source.read(), (False, None))
+
+    def test_video_frames(self):
+        filename = os.path.join(self.dir_name, "video.avi")
+        writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"MJPG"), 5, (80, 60))
+        if not writer.isOpened():
+            self.skipTest("No video encoder available")
+        for i in range(7):
+            writer.write(_page(30 * i))
+        writer.release()
+        source = sources.open_source(filename)
+        self.assertIsInstance(source, sources.VideoFrames)
+        self.assertFalse(source.pages)
+        self.assertEqual(len(list(source)), 7)
+        source.release()
+        source = sources.VideoFrames(filename, step=3)
+        frames = list(source)
+        self.assertEqual(len(frames), 3)
+        self.assertAlmostEqual(int(frames[1][0, 0, 0]), 90, delta=5)
+        self.assertEqual(source.frame_name(2), filename + "#6")
+        source.release()
+
+    def test_image_files(self):
+        for name, value in (("b.png", 20), ("a.png", 10)):
+            cv2.imwrite(os.path.join(self.dir_name, name), _page(value))
+        with open(os.path.join(self.dir_name, "c.png"), mode="w") as f:
+            f.write("not an image")
+        source = sources.open_source(self.dir_name)
+        self.assertEqual([int(page[0, 0, 0]) for page in source], [10, 20])
+        self.assertEqual(source.frame_name(1), os.path.join(self.dir_name, "b.png"))
+        with self.assertRaises(ValueError):
+            sources.open_source(os.path.join(self.dir_name, "missing.avi"))
+
+    def test_detection_context(self):
+        filename = os.path.join(self.dir_name, "stack.tiff")
+        cv2.imwritemulti(filename, [_page(10), _page(20)])
+        context = detection.ExamDetectorContext()
+        context.open_source(sources.TiffPages(filename))
+        self.assertTrue(context.open_camera())
+        context.dump_buffer(1.0)
+        self.assertEqual(int(context.capture()[0, 0, 0]), 10)
+        self.assertEqual(int(context.capture()[0, 0, 0]), 20)
+        self.assertIsNone(context.capture())
+        context.close_camera()
+        self.assertIsNone(context.frame_source)
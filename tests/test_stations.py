@@ -0,0 +1,198 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import threading
+import types
+import unittest
+
+import cv2
+import numpy as np
+
+import eyegrade.detection as detection
+import eyegrade.exams as exams
+import eyegrade.sessiondb as sessiondb
+import eyegrade.sources as sources
+import eyegrade.stations as stations
+import eyegrade.students as students
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+class FramesContext(detection.ExamDetectorContext):
+    """Detection context that captures from a list of frames."""
+
+    def __init__(self, frames):
+        super().__init__(fixed_hough_threshold=180)
+        self.frames = list(frames)
+
+    def capture(self, clone=False, resize=None):
+        return self.frames.pop(0) if self.frames else None
+
+
+class TestStations(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        exam_config = exams.ExamConfig()
+        exam_config.set_dimensions("3,5")
+        for model in "ABCDEFGH":
+            exam_config.set_solutions(model, [[1]] * 5)
+        self.session_dir = os.path.join(self.dir_name, "session")
+        sessiondb.create_session_directory(
+            self.session_dir, exam_config, students.StudentListings()
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_reserve_exam_id(self):
+        writer = stations.SessionWriter(self.session_dir)
+        reserved = []
+
+        def reserve():
+            for _ in range(100):
+                reserved.append(writer.reserve_exam_id())
+
+        threads = [threading.Thread(target=reserve) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        self.assertEqual(sorted(reserved), list(range(1, 401)))
+
+    def test_failed_write(self):
+        def fail():
+            raise ValueError("hash failed")
+
+        writer = stations.SessionWriter(self.session_dir)
+        exams_stored = []
+        for exam_id, sheet_hash in ((1, fail), (2, lambda: None)):
+            exam = types.SimpleNamespace(
+                exam_id=exam_id,
+                capture=types.SimpleNamespace(
+                    answer_cells=[], id_cells=[], sheet_hash=sheet_hash
+                ),
+                decisions=sessiondb.ExamDecisionsFromDB([1] * 5, None, None, "A"),
+                score=types.SimpleNamespace(correct=5, incorrect=0, blank=0, score=5),
+            )
+            exams_stored.append(writer.store_exam(exam))
+        writer.close()
+        self.assertRaises(ValueError, exams_stored[0].result)
+        exams_stored[1].result()
+        # The exam that failed halfway is not committed with the next one
+        session = sessiondb.SessionDB(self.session_dir)
+        self.assertEqual([exam.exam_id for exam in session.read_exams()], [2])
+        self.assertEqual(session.read_item_analysis().num_exams, 1)
+        session.close()
+
+    def test_stations(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=5)
+        blank = np.full((480, 640, 3), synthetic_captures.BACKGROUND_COLOR, np.uint8)
+        expected = []
+        contexts = []
+        for _ in range(2):
+            frames = []
+            for _ in range(2):
+                captures = generator.generate_sequence(0, 3)
+                expected.append((captures[0].answers, captures[0].model))
+                frames.extend(capture.image for capture in captures)
+                frames.extend([blank] * 3)
+            contexts.append(FramesContext(frames))
+        writer = stations.SessionWriter(self.session_dir)
+        options = stations.detection_options(
+            writer.exam_config, {"error-logging": False, "timing-log": None}
+        )
+        graded = []
+        station_list = [
+            stations.GradingStation(
+                str(i),
+                context,
+                writer,
+                options,
+                quality_gate=detection.FrameQualityGate(),
+                on_exam=lambda station, exam: graded.append(exam.exam_id),
+            )
+            for i, context in enumerate(contexts)
+        ]
+        stations.run_stations(station_list)
+        writer.close()
+        for station in station_list:
+            self.assertIsNone(station.error)
+            self.assertEqual(station.num_exams, 2)
+        self.assertEqual(sorted(graded), [1, 2, 3, 4])
+        session = sessiondb.SessionDB(self.session_dir)
+        stored = sorted(
+            (exam.decisions.answers, exam.decisions.model)
+            for exam in session.read_exams()
+        )
+        self.assertEqual(stored, sorted(expected))
+        for exam_id in graded:
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(
+                        self.session_dir, "internal", "raw-{}.png".format(exam_id)
+                    )
+                )
+            )
+        session.close()
+
+    def test_tiff_station(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=6)
+        captures = [generator.generate() for _ in range(3)]
+        blank = np.full((480, 640, 3), synthetic_captures.BACKGROUND_COLOR, np.uint8)
+        filename = os.path.join(self.dir_name, "stack.tiff")
+        cv2.imwritemulti(
+            filename, [captures[0].image, captures[1].image, blank, captures[2].image]
+        )
+        writer = stations.SessionWriter(self.session_dir)
+        options = stations.detection_options(
+            writer.exam_config, {"error-logging": False, "timing-log": None}
+        )
+        context = detection.ExamDetectorContext()
+        context.open_source(sources.TiffPages(filename))
+        station = stations.GradingStation("stack", context, writer, options)
+        stations.run_stations([station])
+        writer.close()
+        self.assertIsNone(station.error)
+        self.assertEqual(station.num_exams, 3)
+        self.assertEqual(station.failed_pages, [filename + "#2"])
+        session = sessiondb.SessionDB(self.session_dir)
+        self.assertEqual(
+            [exam.decisions.answers for exam in session.read_exams()],
+            [capture.answers for capture in captures],
+        )
+        session.close()
+
+    def test_page_thresholds(self):
+        blank = np.full((480, 640, 3), synthetic_captures.BACKGROUND_COLOR, np.uint8)
+        filename = os.path.join(self.dir_name, "blank.tiff")
+        cv2.imwritemulti(filename, [blank, blank])
+        writer = stations.SessionWriter(self.session_dir)
+        options = stations.detection_options(
+            writer.exam_config, {"error-logging": False, "timing-log": None}
+        )
+        context = synthetic_captures.RecordingContext()
+        context.open_source(sources.TiffPages(filename))
+        station = stations.GradingStation("blank", context, writer, options)
+        stations.run_stations([station])
+        writer.close()
+        self.assertIsNone(station.error)
+        self.assertEqual(len(station.failed_pages), 2)
+        # Every threshold is tried once per page:
+        self.assertEqual(context.thresholds, detection.param_hough_thresholds * 2)
@@ -0,0 +1,144 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import math
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import eyegrade.detection as detection
+import eyegrade.tools.replay_benchmark as replay_benchmark
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+def _detect(capture, dimensions, left_to_right_numbering=False):
+    """Detects the capture trying each Hough threshold until success."""
+    options = detection.ExamDetector.get_default_options()
+    options["left-to-right-numbering"] = left_to_right_numbering
+    for threshold in detection.param_hough_thresholds:
+        context = detection.ExamDetectorContext(fixed_hough_threshold=threshold)
+        detector = detection.ExamDetector(
+            dimensions, context, options, image_raw=capture.image
+        )
+        if detector.detect():
+            return detector
+    return None
+
+
+class TestSyntheticCaptures(unittest.TestCase):
+    def test_ground_truth(self):
+        generator = synthetic_captures.CaptureGenerator(
+            [(3, 6), (3, 5)], id_num_digits=8, seed=1
+        )
+        marks = [(1,), (), (2, 3), (3,), (1,), (2,)] + [(1,)] * 5
+        capture = generator.generate(marks=marks, model="C")
+        self.assertEqual(capture.image.shape, (480, 640, 3))
+        self.assertEqual(capture.answers, [1, 0, 0, 3, 1, 2] + [1] * 5)
+        self.assertEqual(capture.model, "C")
+        self.assertEqual(len(capture.student_id), 8)
+        self.assertEqual([len(c) for c in capture.corners], [7, 6])
+        self.assertEqual(len(capture.corners[0][0]), 4)
+        self.assertEqual([len(row) for row in capture.id_corners], [9, 9])
+        for table in capture.corners:
+            for row in table:
+                for x, y in row:
+                    self.assertTrue(0 <= x < 640 and 0 <= y < 480)
+        self.assertRaises(ValueError, generator.generate, marks=marks[:-1])
+
+    def test_random_contents(self):
+        generator = synthetic_captures.CaptureGenerator([(4, 10)], seed=1)
+        self.assertEqual(generator.models(), list("ABCDEFGH"))
+        capture = generator.generate()
+        self.assertIn(capture.model, generator.models())
+        self.assertIsNone(capture.student_id)
+        self.assertIsNone(capture.id_corners)
+        for marks, answer in zip(capture.marks, capture.answers):
+            self.assertEqual(answer, marks[0] if len(marks) == 1 else 0)
+            self.assertTrue(all(1 <= choice <= 4 for choice in marks))
+        survey = synthetic_captures.CaptureGenerator([(2, 5)], infobits=False)
+        self.assertIsNone(survey.generate().model)
+
+    def test_seed_is_reproducible(self):
+        captures = [
+            synthetic_captures.CaptureGenerator([(3, 5)], seed=7).generate()
+            for _ in range(2)
+        ]
+        self.assertTrue(np.array_equal(captures[0].image, captures[1].image))
+        self.assertEqual(captures[0].answers, captures[1].answers)
+        self.assertEqual(captures[0].corners, captures[1].corners)
+
+    def test_detection(self):
+        dimensions = [(3, 5)]
+        generator = synthetic_captures.CaptureGenerator(
+            dimensions, id_num_digits=9, seed=3
+        )
+        for _ in range(4):
+            capture = generator.generate()
+            detector = _detect(capture, dimensions)
+            self.assertIsNotNone(detector)
+            self.assertEqual(detector.decisions.answers, capture.answers)
+            self.assertEqual(detector.decisions.model, capture.model)
+            # Detected cell corners match the ground truth
+            corners = capture.corners[0]
+            for row, cells in enumerate(detector.capture.answer_cells):
+                for col, cell in enumerate(cells):
+                    self.assertLess(math.dist(cell.plu, corners[row][col]), 3)
+                    self.assertLess(math.dist(cell.prd, corners[row + 1][col + 1]), 3)
+
+    def test_detection_left_to_right(self):
+        dimensions = [(4, 8), (4, 8)]
+        generator = synthetic_captures.CaptureGenerator(
+            dimensions,
+            left_to_right_numbering=True,
+            seed=5,
+            perspective=0,
+            rotation=0,
+            noise=0,
+            lighting=0,
+            blur=0,
+        )
+        capture = generator.generate()
+        detector = _detect(capture, dimensions, left_to_right_numbering=True)
+        self.assertIsNotNone(detector)
+        self.assertEqual(detector.decisions.answers, capture.answers)
+        self.assertEqual(detector.decisions.model, capture.model)
+
+
+class TestSyntheticCorpus(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_replay_directory(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=2)
+        synthetic_captures.write_captures(self.dir_name, generator, 3)
+        truth = synthetic_captures.read_ground_truth(self.dir_name)
+        self.assertEqual(len(truth), 3)
+        record = truth["capture-00000.png"]
+        self.assertEqual(record["dimensions"], [[3, 5]])
+        frames = list(replay_benchmark.directory_frames(self.dir_name))
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(frames[0].answers, record["answers"])
+        self.assertEqual(frames[0].model, record["model"])
+        corpus = replay_benchmark.Corpus(frames, [(3, 5)])
+        results = replay_benchmark.replay(corpus)
+        self.assertEqual(results.frames, 3)
+        self.assertEqual(results.answer_agreement, 1.0)
@@ -0,0 +1,94 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import tempfile
+import unittest
+
+import eyegrade.timing as timing
+import eyegrade.detection as detection
+
+
+class TestTiming(unittest.TestCase):
+    def test_stage_timer(self):
+        timer = timing.StageTimer()
+        with timer.stage("a"):
+            pass
+        with timer.stage("b"):
+            pass
+        first = timer.times["a"]
+        with timer.stage("a"):
+            pass
+        times = timer.finish()
+        self.assertEqual(list(times), ["a", "b", "total"])
+        self.assertGreaterEqual(times["a"], first)
+        self.assertGreaterEqual(times["total"], times["a"] + times["b"])
+
+    def test_null_timer(self):
+        with timing.NULL_TIMER.stage("a"):
+            pass
+        self.assertIsNone(timing.NULL_TIMER.finish())
+
+    def test_statistics(self):
+        statistics = timing.StageStatistics(window=10)
+        for i in range(20):
+            statistics.add({"a": float(i), "total": float(i)})
+        statistics.add({"b": 3.0, "total": 20.0})
+        self.assertEqual(len(statistics), 10)
+        self.assertEqual(statistics.percentiles("a", (0, 100)), [10.0, 19.0])
+        self.assertEqual(statistics.percentiles("b", (50,)), [3.0])
+        self.assertIsNone(statistics.percentiles("c"))
+        self.assertEqual(list(statistics.summary()), ["a", "b", "total"])
+
+    def test_detector_timing(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        context = detection.ExamDetectorContext(fixed_hough_threshold=180)
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_file = os.path.join(log_dir, "timing.jsonl")
+            options = detection.ExamDetector.get_default_options()
+            options["capture-from-file"] = True
+            options["capture-raw-file"] = os.path.join(dirname, "capture.png")
+            options["show-timing"] = True
+            options["timing-log"] = log_file
+            for _ in range(2):
+                detector = detection.ExamDetector(((3, 5),), context, options)
+                detector.detect()
+            context.close_camera()
+            self.assertEqual(len(list(timing.read_log(log_file))), 2)
+            # The log is opened again, in append mode, after closing it:
+            detector = detection.ExamDetector(((3, 5),), context, options)
+            detector.detect()
+            context.close_camera()
+            records = list(timing.read_log(log_file))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(len(context.timing), 3)
+        for stage in ("pre_process", "detect_lines", "total"):
+            self.assertIn(stage, records[2]["stages"])
+            self.assertIsNotNone(context.timing.percentiles(stage))
+        self.assertEqual(records[2]["stages"], detector.stage_times)
+        self.assertEqual(records[2]["hough_threshold"], 180)
+
+    def test_timing_disabled(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        context = detection.ExamDetectorContext(fixed_hough_threshold=180)
+        options = detection.ExamDetector.get_default_options()
+        options["capture-from-file"] = True
+        options["capture-raw-file"] = os.path.join(dirname, "capture.png")
+        detector = detection.ExamDetector(((3, 5),), context, options)
+        detector.detect()
+        self.assertIsNone(detector.stage_times)
+        self.assertEqual(len(context.timing), 0)
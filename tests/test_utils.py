@@ -0,0 +1,85 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import unittest
+
+import eyegrade.utils as utils
+
+
+class TestModelEncoding(unittest.TestCase):
+    def test_model_names(self):
+        names = ["A", "B", "Z", "AA", "AZ", "BA", "ZZ", "AAA"]
+        indices = [0, 1, 25, 26, 51, 52, 701, 702]
+        self.assertEqual([utils.model_index(name) for name in names], indices)
+        self.assertEqual([utils.model_name(index) for index in indices], names)
+        self.assertEqual(sorted(reversed(names), key=utils.model_sort_key), names)
+        for name in ("", "0", "a", "A1"):
+            self.assertRaises(Exception, utils.model_index, name)
+        self.assertEqual(utils.parse_models("abc"), ["A", "B", "C"])
+        self.assertEqual(utils.parse_models("A, b,AA"), ["A", "B", "AA"])
+
+    def test_classic_models(self):
+        # Models A-H keep the pattern of the classic encoding
+        self.assertEqual(utils.encode_model("C", 2, 4), [False, True, False, False] * 2)
+        self.assertEqual(utils.encode_model("F", 1, 5), [True, False, True, True, True])
+        for num_bits in range(4, 13):
+            self.assertEqual(utils.max_models(num_bits, extended=False), 8)
+            for index in range(8):
+                bits = utils.encode_model(utils.model_name(index), 1, num_bits)
+                self.assertEqual(bits[4:], bits[: num_bits - 4])
+                self.assertEqual(utils.decode_model(bits), utils.model_name(index))
+
+    def test_extended_models(self):
+        for num_tables, num_choices in ((1, 3), (2, 4), (2, 5), (3, 4), (4, 5)):
+            num_bits = num_tables * num_choices
+            num_models = utils.max_models(num_bits)
+            self.assertEqual(num_models, 8 ** (num_bits // 4) if num_bits > 3 else 8)
+            patterns = set()
+            for index in range(min(num_models, 600)):
+                model = utils.model_name(index)
+                bits = utils.encode_model(model, num_tables, num_choices)
+                self.assertEqual(len(bits), num_bits)
+                self.assertEqual(utils.decode_model(bits, extended=True), model)
+                if index >= 8:
+                    self.assertIsNone(utils.decode_model(bits))
+                patterns.add(tuple(bits))
+            self.assertEqual(len(patterns), min(num_models, 600))
+            self.assertRaises(
+                Exception,
+                utils.encode_model,
+                utils.model_name(num_models),
+                num_tables,
+                num_choices,
+            )
+
+    def test_single_bit_errors(self):
+        for index in range(64):
+            bits = utils.encode_model(utils.model_name(index), 2, 5)
+            for i in range(len(bits)):
+                wrong = list(bits)
+                wrong[i] = not wrong[i]
+                self.assertIsNone(utils.decode_model(wrong, extended=True))
+
+    def test_decode_model_0(self):
+        for num_bits in range(4, 9):
+            bits = [False] * num_bits
+            self.assertIsNone(utils.decode_model(bits, extended=True))
+            self.assertEqual(utils.decode_model(bits, accept_model_0=True), "0")
+        for bits in itertools.product((False, True), repeat=3):
+            self.assertIsNotNone(utils.decode_model(list(bits)))
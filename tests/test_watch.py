@@ -0,0 +1,166 @@
+# Eyegrade: grading multiple choice questions with a webcam
+# Copyright (C) 2010-2021 Jesus Arias Fisteus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+
+import eyegrade.exams as exams
+import eyegrade.server as server
+import eyegrade.sessiondb as sessiondb
+import eyegrade.stations as stations
+import eyegrade.students as students
+import eyegrade.watch as watch
+import eyegrade.tools.synthetic_captures as synthetic_captures
+
+
+class TestFolderWatcher(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.dir_name, name), mode="wb") as f:
+            f.write(data)
+
+    def test_poll(self):
+        watcher = watch.FolderWatcher(self.dir_name, settle_time=0)
+        self._write("b.png", b"12")
+        self._write("a.png", b"1")
+        self._write("notes.txt", b"1")
+        self._write("empty.png", b"")
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.settling, 3)
+        # The file is still being written:
+        self._write("b.png", b"123")
+        self.assertEqual(watcher.poll(), ["a.png"])
+        self.assertEqual(watcher.poll(), ["b.png"])
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(watcher.settling, 1)
+        self._write("a.png", b"22")
+        watcher.poll()
+        self.assertEqual(watcher.poll(), ["a.png"])
+        watcher.close()
+
+    def test_settle_time(self):
+        watcher = watch.FolderWatcher(self.dir_name, settle_time=60, use_inotify=False)
+        self._write("a.png", b"1")
+        watcher.poll()
+        self.assertEqual(watcher.poll(), [])
+
+
+class TestWatchDaemon(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        exam_config = exams.ExamConfig()
+        exam_config.set_dimensions("3,5")
+        for model in "ABCDEFGH":
+            exam_config.set_solutions(model, [[1]] * 5)
+        self.session_dir = os.path.join(self.dir_name, "session")
+        sessiondb.create_session_directory(
+            self.session_dir, exam_config, students.StudentListings()
+        )
+        self.inbox = os.path.join(self.dir_name, "inbox")
+        os.mkdir(self.inbox)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _run(self):
+        writer = stations.SessionWriter(self.session_dir)
+        options = stations.detection_options(
+            writer.exam_config, {"error-logging": False, "timing-log": None}
+        )
+        pool = server.WorkerPool(writer, options, num_workers=2, store=True)
+        results = []
+        daemon = watch.WatchDaemon(
+            self.inbox,
+            writer,
+            pool,
+            settle_time=0,
+            poll_interval=0.01,
+            on_result=lambda *args: results.append(args),
+        )
+        daemon.run(until_idle=True)
+        pool.close()
+        writer.close()
+        return daemon, results
+
+    def test_watch(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=5)
+        for i in range(3):
+            cv2.imwrite(
+                os.path.join(self.inbox, "scan-{}.png".format(i)),
+                generator.generate().image,
+            )
+        with open(os.path.join(self.inbox, "scan-3.png"), mode="wb") as f:
+            f.write(b"not an image")
+        daemon, results = self._run()
+        self.assertEqual((daemon.graded, daemon.failed, daemon.skipped), (3, 1, 0))
+        self.assertEqual(len(results), 4)
+        processed = os.path.join(self.inbox, watch.PROCESSED_DIR)
+        failed = os.path.join(self.inbox, watch.FAILED_DIR)
+        self.assertEqual(
+            sorted(os.listdir(processed)), ["scan-0.png", "scan-1.png", "scan-2.png"]
+        )
+        self.assertEqual(os.listdir(failed), ["scan-3.png"])
+        self.assertEqual(
+            [name for name in os.listdir(self.inbox) if name.endswith(".png")], []
+        )
+        # After a restart, files already graded are not graded again:
+        shutil.copy(os.path.join(processed, "scan-1.png"), self.inbox)
+        daemon, results = self._run()
+        self.assertEqual((daemon.graded, daemon.failed, daemon.skipped), (0, 0, 1))
+        self.assertIn("scan-1-1.png", os.listdir(processed))
+        session = sessiondb.SessionDB(self.session_dir)
+        self.assertEqual(len(session.read_exams()), 3)
+        ledger = session.processed_files()
+        self.assertEqual(
+            sorted(entry["status"] for entry in ledger.values()),
+            ["failed", "graded", "graded", "graded"],
+        )
+        session.close()
+
+    def test_tiff(self):
+        generator = synthetic_captures.CaptureGenerator([(3, 5)], seed=5)
+        images = [generator.generate().image for _ in range(2)]
+        cv2.imwritemulti(os.path.join(self.inbox, "stack.tiff"), images)
+        daemon, results = self._run()
+        self.assertEqual((daemon.graded, daemon.failed, daemon.skipped), (2, 0, 0))
+        self.assertEqual(
+            sorted(result[0] for result in results), ["stack.tiff#0", "stack.tiff#1"]
+        )
+        processed = os.path.join(self.inbox, watch.PROCESSED_DIR)
+        self.assertEqual(os.listdir(processed), ["stack.tiff"])
+        # After a restart, the pages already graded are not graded again:
+        shutil.copy(os.path.join(processed, "stack.tiff"), self.inbox)
+        daemon, results = self._run()
+        self.assertEqual((daemon.graded, daemon.failed, daemon.skipped), (0, 0, 2))
+        self.assertEqual(sorted(os.listdir(processed)), ["stack-1.tiff", "stack.tiff"])
+        session = sessiondb.SessionDB(self.session_dir)
+        self.assertEqual(len(session.read_exams()), 2)
+        ledger = session.processed_files()
+        self.assertEqual(sorted(digest[-2:] for digest in ledger), ["#0", "#1"])
+        self.assertEqual(
+            [entry["status"] for entry in ledger.values()], ["graded", "graded"]
+        )
+        session.close()